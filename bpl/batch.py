@@ -0,0 +1,99 @@
+"""
+Compilation of many programs at once, each to a file of its own in an output directory.
+
+Each program is compiled by a worker process, which assembles and links it too, so up
+to 'jobs' programs are being compiled or linked at any time, and the compiler is only
+imported once rather than once per program. An error in one program
+is reported with its file name, and the rest of the batch goes on.
+"""
+
+import cStringIO, multiprocessing, os
+from bpl.cache import CompilationCache
+from bpl.code_generator.encoder import EncodingError
+from bpl.compiler import compile
+from bpl.parser.parser import ParserException
+from bpl.scanner.scanner import ScannerException, Scanner
+from bpl.toolchain import build_executable
+from bpl.type_checker.type_checker import TypeCheckerException
+
+def output_path(file_name, output_dir, stop_at_assembly):
+    """Return the path of the assembly file or executable compiled from file_name in output_dir."""
+    name = os.path.splitext(os.path.basename(file_name))[0]
+    return os.path.join(output_dir, name + '.s' if stop_at_assembly else name)
+
+def compile_file(job):
+    """Compile one program of a batch, returning its file name and an error message, or None if it succeeded."""
+    file_name, output_dir, stop_at_assembly, scanner_class, cache_dir, assembler, optimization_level = job
+    if not file_name.endswith('.bpl'):
+        return file_name, 'Error: File name does not have a .bpl extension.'
+    try:
+        input_file = open(file_name)
+    except IOError:
+        return file_name, 'Error: Unable to open .bpl file.'
+    path = output_path(file_name, output_dir, stop_at_assembly)
+    cache = CompilationCache(cache_dir) if cache_dir else None
+    generate = lambda assembly_file: compile(input_file, assembly_file, scanner_class, cache, optimization_level)
+    try:
+        if stop_at_assembly:
+            # compile the whole program before writing it, so an error leaves no assembly file
+            assembly = cStringIO.StringIO()
+            generate(assembly)
+            with open(path, 'w') as assembly_file:
+                assembly_file.write(assembly.getvalue())
+            return file_name, None
+        status, message = build_executable(generate, path, assembler)
+    except (ScannerException, ParserException, TypeCheckerException, EncodingError) as e:
+        return file_name, e.message
+    except (IOError, OSError) as e:
+        return file_name, 'Error: Unable to write {}: {}'.format(path, e.strerror)
+    except Exception as e: # a bug in the compiler shouldn't stop the rest of the batch
+        return file_name, 'Error: {}: {}'.format(type(e).__name__, e)
+    finally:
+        input_file.close()
+    if status:
+        return file_name, message.rstrip('\n')
+    return file_name, None
+
+def compile_batch(file_names, output_dir, jobs=1, stop_at_assembly=False, scanner_class=Scanner, cache_dir=None,
+        assembler='as', optimization_level=0):
+    """Compile each program in file_names into output_dir, 'jobs' at a time.
+
+    Yield a (file name, error message) pair for each program, in the order given, as
+    soon as it and the programs before it are done; the error message is None if the
+    program was compiled. Executables are named after their programs, without the .bpl
+    extension, and assembly files get a .s extension instead. If 'cache_dir' is given,
+    every worker shares the CompilationCache in it. 'assembler' is passed on to
+    build_executable(), and programs are compiled at 'optimization_level'. Programs
+    that would be compiled to the same path, such as x/a.bpl and y/a.bpl, are not
+    compiled, and each gets an error message instead.
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    # files that would be compiled to the same path are reported rather than overwriting each other
+    sharers = {}
+    for file_name in file_names:
+        if file_name.endswith('.bpl'):
+            sharers.setdefault(output_path(file_name, output_dir, stop_at_assembly), []).append(file_name)
+    errors = {}
+    for path, names in sharers.iteritems():
+        if len(names) > 1:
+            for file_name in names:
+                others = [name for name in names if name != file_name]
+                if others:
+                    errors[file_name] = 'Error: {} would also be compiled to {}.'.format(others[0], path)
+                else:
+                    errors[file_name] = 'Error: File is given more than once.'
+    work = [(file_name, output_dir, stop_at_assembly, scanner_class, cache_dir, assembler, optimization_level)
+            for file_name in file_names if file_name not in errors]
+    pool = multiprocessing.Pool(jobs) if jobs > 1 and work else None
+    try:
+        results = pool.imap(compile_file, work) if pool else (compile_file(job) for job in work)
+        for file_name in file_names:
+            if file_name in errors:
+                yield file_name, errors[file_name]
+            else:
+                yield next(results)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
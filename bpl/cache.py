@@ -0,0 +1,169 @@
+"""
+A content-addressed, on-disk cache of compilation results.
+
+Each entry is keyed by a hash of a program's source text, the optimization level
+it's compiled at, the cache format version, and the compiler's own source code, so
+an entry never has to be invalidated: a change to the source or to any module of the
+compiler just produces a different key. An entry holds the
+type-checked parse tree, serialized as an ASTArena (with its declaration links,
+types, and offsets filled in), and the generated assembly, along with the
+position of each function's code in it.
+
+The cache also keeps the Units that incremental compilation produced for the last
+version of each source file it was given, keyed by the file's name. They're stored
+with cPickle, which can run arbitrary code while loading, so a cache directory must be
+trusted as much as the compiler itself: never point bplc at one that others can write.
+"""
+
+import cPickle, hashlib, os, shutil, tempfile
+import bpl
+from bpl.parser.arena import ASTArena, ArenaException
+
+FORMAT_VERSION = 1
+# the hash of the compiler's modules, computed the first time a key is needed
+compiler_hash = None
+
+def compiler_digest():
+    """Return a hash of the source code of the modules in the bpl package, leaving out its tests."""
+    global compiler_hash
+    if compiler_hash is None:
+        root = os.path.dirname(os.path.abspath(bpl.__file__))
+        digest = hashlib.sha1(bpl.__version__)
+        for directory, subdirectories, files in os.walk(root):
+            subdirectories[:] = sorted(name for name in subdirectories if name != 'test')
+            for name in sorted(files):
+                if name.endswith('.py'):
+                    path = os.path.join(directory, name)
+                    with open(path, 'rb') as f:
+                        digest.update('{}\0{}\0'.format(os.path.relpath(path, root), f.read()))
+        compiler_hash = digest.hexdigest()
+    return compiler_hash
+
+class CompilationCache(object):
+    """A directory of cache entries, one subdirectory per key."""
+
+    def __init__(self, directory):
+        """Use 'directory' for the cache, creating it if it doesn't exist."""
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, source, optimization_level=0):
+        """Return the cache key of the program whose source text is 'source', compiled at 'optimization_level'."""
+        digest = hashlib.sha1()
+        digest.update('{}\0{}\0'.format(compiler_digest(), FORMAT_VERSION))
+        if optimization_level:
+            digest.update('-O{}\0'.format(optimization_level))
+        digest.update(source)
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def read(self, key, name):
+        """Return the contents of the file 'name' in the entry for 'key', or None if there is no such entry."""
+        try:
+            with open(os.path.join(self.entry_path(key), name), 'rb') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def load_assembly(self, key):
+        """Return the assembly code cached for 'key', or None on a miss."""
+        return self.read(key, 'assembly.s')
+
+    def load_functions(self, key):
+        """Return a list of (function name, assembly code) pairs, in program order, cached for 'key', or None on a miss."""
+        assembly = self.load_assembly(key)
+        index = self.read(key, 'functions')
+        if assembly is None or index is None:
+            return None
+        functions = []
+        for line in index.splitlines():
+            name, start, end = line.split()
+            functions.append((name, assembly[int(start):int(end)]))
+        return functions
+
+    def load_tree(self, key):
+        """Return the type-checked ASTArena cached for 'key', or None on a miss."""
+        data = self.read(key, 'tree')
+        if data is None:
+            return None
+        try:
+            return ASTArena.from_bytes(data)
+        except ArenaException:
+            return None
+
+    def store(self, key, arena, header, functions):
+        """Cache a compilation result for 'key'.
+
+        'arena' is the type-checked tree, 'header' the assembly that precedes the
+        functions, and 'functions' a list of (function name, assembly code) pairs. The
+        entry is written to a temporary directory and then renamed into place, so
+        concurrent compilers never see a partial entry.
+        """
+        path = self.entry_path(key)
+        if os.path.isdir(path):
+            return
+        parent = os.path.dirname(path)
+        if not os.path.isdir(parent):
+            try:
+                os.makedirs(parent)
+            except OSError: # another compiler may have just created it
+                pass
+        temp = tempfile.mkdtemp(dir=parent)
+        try:
+            index = []
+            position = len(header)
+            with open(os.path.join(temp, 'assembly.s'), 'wb') as f:
+                f.write(header)
+                for name, code in functions:
+                    f.write(code)
+                    index.append('{} {} {}\n'.format(name, position, position + len(code)))
+                    position += len(code)
+            with open(os.path.join(temp, 'functions'), 'wb') as f:
+                f.write(''.join(index))
+            with open(os.path.join(temp, 'tree'), 'wb') as f:
+                f.write(arena.to_bytes())
+            os.rename(temp, path)
+        except OSError:
+            # another compiler stored the same entry first
+            if not os.path.isdir(path):
+                raise
+        finally:
+            if os.path.isdir(temp):
+                shutil.rmtree(temp)
+
+    def units_path(self, name):
+        digest = hashlib.sha1('{}\0{}\0'.format(compiler_digest(), FORMAT_VERSION))
+        digest.update(name)
+        return os.path.join(self.directory, 'incremental', digest.hexdigest())
+
+    def load_units(self, name):
+        """Return the dictionary of Units stored for the source file 'name', or an empty dictionary if there is none.
+
+        The file is unpickled, so the cache directory must be trusted.
+        """
+        try:
+            with open(self.units_path(name), 'rb') as f:
+                return cPickle.load(f)
+        except (IOError, EOFError, cPickle.UnpicklingError): # a missing or damaged file is just a miss
+            return {}
+
+    def store_units(self, name, units):
+        """Store the dictionary of Units for the source file 'name', replacing any stored before."""
+        path = self.units_path(name)
+        parent = os.path.dirname(path)
+        if not os.path.isdir(parent):
+            try:
+                os.makedirs(parent)
+            except OSError: # another compiler may have just created it
+                pass
+        descriptor, temp = tempfile.mkstemp(dir=parent)
+        try:
+            with os.fdopen(descriptor, 'wb') as f:
+                cPickle.dump(units, f, cPickle.HIGHEST_PROTOCOL)
+            os.rename(temp, path)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
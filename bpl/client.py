@@ -0,0 +1,44 @@
+"""
+The client side of the compile server in bpl.server.
+
+This module imports nothing from the rest of the compiler, so that a client starts as
+quickly as Python itself.
+"""
+
+import json, socket
+
+def receive_all(connection):
+    """Return everything read from the socket 'connection' until the other side shuts down."""
+    chunks = []
+    while True:
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return ''.join(chunks)
+
+def request_compilation(socket_path, source, output_path, stop_at_assembly):
+    """Ask the compile server listening on 'socket_path' to compile the program 'source' to output_path.
+
+    output_path is the absolute path of an assembly file if 'stop_at_assembly' is set,
+    and of an executable otherwise. Return the server's (status, message) reply:
+    'status' is 0 if the program was compiled, and 'message' holds any diagnostics.
+    The source, the path, and the message are sent as Latin-1, which JSON can carry
+    whatever bytes they hold.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        client.sendall(json.dumps({'source': source.decode('latin-1'), 'output': output_path.decode('latin-1'),
+                'stop_at_assembly': stop_at_assembly}))
+        client.shutdown(socket.SHUT_WR)
+        reply = receive_all(client)
+    finally:
+        client.close()
+    if not reply:
+        return 1, 'Error: The compile server closed the connection without replying.'
+    try:
+        reply = json.loads(reply)
+        return reply['status'], reply['message'].encode('latin-1')
+    except (ValueError, KeyError, TypeError, AttributeError, UnicodeError):
+        return 1, 'Error: The compile server sent a malformed reply.'
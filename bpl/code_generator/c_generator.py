@@ -0,0 +1,320 @@
+"""
+Translation of type-checked parse trees into C, for building programs with the C compiler's optimizer.
+
+Every value is held in an 8-byte cell, as in the native code: integers are int64_t
+cells holding 32-bit values, and strings and pointers are C pointers. Arithmetic goes
+through small runtime functions that wrap around at 32 bits and trap on division by
+zero, as the native code does, and read, write, and writeln call scanf and printf
+the same way. Identifiers get a bpl_ prefix, which keeps them apart from C's keywords
+and library, and BPL's main becomes bpl_main, called by C's main.
+
+C leaves the order of evaluation of operands and arguments unspecified, while the
+native code evaluates the left side of an operator first and a call's arguments from
+last to first. Where that could change what a program does, because an expression has
+side effects, its parts are evaluated into temporary variables in the native order.
+"""
+
+from bpl.code_generator.encoder import parse_string
+from bpl.parser.parsetree import NodeType
+from bpl.scanner.token import TokenType
+from StringIO import StringIO
+
+RUNTIME = r'''/* generated by bplc */
+#include <signal.h>
+#include <stdint.h>
+#include <stdio.h>
+
+typedef int64_t bpl_int;
+
+static inline bpl_int bpl_rt_wrap(uint64_t number) { return (int32_t)(uint32_t)number; }
+static inline bpl_int bpl_rt_add(bpl_int a, bpl_int b) { return bpl_rt_wrap((uint64_t)a + (uint64_t)b); }
+static inline bpl_int bpl_rt_sub(bpl_int a, bpl_int b) { return bpl_rt_wrap((uint64_t)a - (uint64_t)b); }
+static inline bpl_int bpl_rt_mul(bpl_int a, bpl_int b) { return bpl_rt_wrap((uint64_t)a * (uint64_t)b); }
+static inline bpl_int bpl_rt_neg(bpl_int a) { return bpl_rt_wrap(-(uint64_t)a); }
+static inline void bpl_rt_check_division(bpl_int a, bpl_int b) {
+    if (b == 0 || (a == INT32_MIN && b == -1))
+        raise(SIGFPE);
+}
+static inline bpl_int bpl_rt_div(bpl_int a, bpl_int b) { bpl_rt_check_division(a, b); return a / b; }
+static inline bpl_int bpl_rt_mod(bpl_int a, bpl_int b) { bpl_rt_check_division(a, b); return a % b; }
+static inline void bpl_rt_write_int(bpl_int n) { printf("%d ", (int)n); }
+static inline void bpl_rt_write_string(const char *s) { printf("%s ", s ? s : "(null)"); }
+static inline void bpl_rt_writeln(void) { putchar('\n'); }
+static inline bpl_int bpl_rt_read(void) {
+    int n = 0;
+    if (scanf("%d", &n) != 1)
+        n = 0;
+    return n;
+}
+'''
+
+ARITHMETIC = {
+    TokenType.T_PLUS: 'bpl_rt_add',
+    TokenType.T_MINUS: 'bpl_rt_sub',
+    TokenType.T_MULT: 'bpl_rt_mul',
+    TokenType.T_DIV: 'bpl_rt_div',
+    TokenType.T_MOD: 'bpl_rt_mod',
+}
+COMPARISONS = {
+    TokenType.T_LESS: '<',
+    TokenType.T_LEQ: '<=',
+    TokenType.T_EQ: '==',
+    TokenType.T_NEQ: '!=',
+    TokenType.T_GEQ: '>=',
+    TokenType.T_GREATER: '>',
+}
+# the C types of the values of expressions, by type string
+C_TYPES = {
+    'int': 'bpl_int',
+    'string': 'const char *',
+    'pointer to int': 'bpl_int *',
+    'pointer to string': 'const char **',
+    'int array': 'bpl_int *',
+    'string array': 'const char **',
+}
+
+def c_name(name):
+    return 'bpl_' + name
+
+def c_string(text):
+    """Return the BPL string constant 'text' as a C string literal, with the escapes the assembler would have replaced."""
+    characters = []
+    for character in parse_string('"{}"'.format(text)):
+        if ' ' <= character <= '~' and character not in '"\\?':
+            characters.append(character)
+        else:
+            characters.append('\\{:03o}'.format(ord(character)))
+    return '"{}"'.format(''.join(characters))
+
+def c_declaration(declaration):
+    """Return the C declaration of a variable, array, or parameter, without a semicolon."""
+    element = 'bpl_int ' if declaration.type_token.kind is TokenType.T_INT else 'const char *'
+    if declaration.kind == NodeType.ARRAY_DEC:
+        if declaration.size == -1: # an array parameter
+            return '{}*{}'.format(element, c_name(declaration.name))
+        return '{}{}[{}]'.format(element, c_name(declaration.name), declaration.size)
+    return '{}{}{}'.format(element, '*' if declaration.is_pointer else '', c_name(declaration.name))
+
+def c_return_type(function):
+    if function.type_token.kind is TokenType.T_INT:
+        return 'bpl_int'
+    elif function.type_token.kind is TokenType.T_STRING:
+        return 'const char *'
+    return 'void'
+
+def c_signature(function):
+    params = []
+    param = function.params
+    while param is not None:
+        params.append(c_declaration(param))
+        param = param.next_node
+    return 'static {} {}({})'.format(c_return_type(function), c_name(function.name), ', '.join(params) or 'void')
+
+def unwrapped(text):
+    """Return the C expression 'text' without the parentheses around it, if it has any.
+
+    Every expression that starts with a parenthesis is wrapped in it, so where a comma
+    expression may appear, as in a statement or a condition, they can be dropped.
+    """
+    return text[1:-1] if text.startswith('(') else text
+
+def has_side_effects(expression):
+    """Return whether evaluating 'expression' assigns, reads input, or calls a function."""
+    if expression.kind in (NodeType.ASSIGN_EXP, NodeType.FUN_CALL_EXP, NodeType.READ_EXP):
+        return True
+    elif expression.kind in (NodeType.MATH_EXP, NodeType.COMP_EXP):
+        return has_side_effects(expression.left) or has_side_effects(expression.right)
+    elif expression.kind in (NodeType.ARRAY_EXP, NodeType.NEG_EXP, NodeType.DEREF_EXP, NodeType.ADDRESS_EXP):
+        return has_side_effects(expression.expression)
+    return False
+
+def generate_c(type_checked_parse_tree, output_file):
+    """Write the C translation of a type-checked program to output_file."""
+    output_file.write(RUNTIME)
+    output_file.write('\n')
+    main = None
+    declaration = type_checked_parse_tree
+    while declaration is not None:
+        if declaration.kind == NodeType.FUN_DEC:
+            output_file.write('{};\n'.format(c_signature(declaration)))
+            if declaration.name == 'main':
+                main = declaration
+        else:
+            output_file.write('static {};\n'.format(c_declaration(declaration)))
+        declaration = declaration.next_node
+
+    declaration = type_checked_parse_tree
+    while declaration is not None:
+        if declaration.kind == NodeType.FUN_DEC:
+            output_file.write('\n')
+            CFunctionGenerator(declaration).generate(output_file)
+        declaration = declaration.next_node
+
+    # C's main calls BPL's, and exits with the value it returns
+    if main is not None:
+        arguments = []
+        param = main.params
+        while param is not None:
+            arguments.append('0')
+            param = param.next_node
+        call = '{}({})'.format(c_name('main'), ', '.join(arguments))
+        output_file.write('\nint main(void) {\n')
+        if main.type_token.kind is TokenType.T_INT:
+            output_file.write('    return (int){};\n'.format(call))
+        else:
+            output_file.write('    {};\n    return 0;\n'.format(call))
+        output_file.write('}\n')
+
+class CFunctionGenerator(object):
+    """Translates one function, keeping track of the temporary variables its expressions need."""
+
+    def __init__(self, function):
+        self.function = function
+        # the C type of each temporary variable
+        self.temporaries = []
+
+    def temporary(self, c_type):
+        """Return the name of a new temporary variable of type c_type."""
+        self.temporaries.append(c_type)
+        return 'bpl_tmp_{}'.format(len(self.temporaries) - 1)
+
+    def generate(self, output_file):
+        body = StringIO()
+        self.statements(self.function.body.statements, 1, body)
+        output_file.write('{} {{\n'.format(c_signature(self.function)))
+        self.declarations(self.function.body.local_declarations, 1, output_file)
+        for i, c_type in enumerate(self.temporaries):
+            output_file.write('    {}{}bpl_tmp_{};\n'.format(c_type, '' if c_type.endswith('*') else ' ', i))
+        output_file.write(body.getvalue())
+        # a function that ends without returning a value returns 0, rather than whatever was left in %rax
+        if self.function.type_token.kind is not TokenType.T_VOID:
+            output_file.write('    return 0;\n')
+        output_file.write('}\n')
+
+    def declarations(self, declaration, depth, output_file):
+        # local variables start out as 0, rather than as whatever was left on the stack
+        while declaration is not None:
+            initializer = '{0}' if declaration.kind == NodeType.ARRAY_DEC else '0'
+            output_file.write('{}{} = {};\n'.format('    ' * depth, c_declaration(declaration), initializer))
+            declaration = declaration.next_node
+
+    def statements(self, statement, depth, output_file):
+        while statement is not None:
+            self.statement(statement, depth, output_file)
+            statement = statement.next_node
+
+    def statement(self, statement, depth, output_file):
+        indent = '    ' * depth
+        if statement.kind == NodeType.CMPND_STATEMENT:
+            output_file.write('{}{{\n'.format(indent))
+            self.declarations(statement.local_declarations, depth + 1, output_file)
+            self.statements(statement.statements, depth + 1, output_file)
+            output_file.write('{}}}\n'.format(indent))
+
+        elif statement.kind == NodeType.WRITE_STATEMENT:
+            if statement.expression.type_string == 'int':
+                output_file.write('{}bpl_rt_write_int({});\n'.format(indent, self.expression(statement.expression)))
+            else:
+                output_file.write('{}bpl_rt_write_string({});\n'.format(indent, self.expression(statement.expression)))
+
+        elif statement.kind == NodeType.WRITELN_STATEMENT:
+            output_file.write('{}bpl_rt_writeln();\n'.format(indent))
+
+        elif statement.kind == NodeType.IF_STATEMENT:
+            output_file.write('{}if ({})\n'.format(indent, unwrapped(self.expression(statement.condition))))
+            self.nested_statement(statement.statement, depth, output_file)
+            if statement.else_statement is not None:
+                output_file.write('{}else\n'.format(indent))
+                self.nested_statement(statement.else_statement, depth, output_file)
+
+        elif statement.kind == NodeType.WHILE_STATEMENT:
+            output_file.write('{}while ({})\n'.format(indent, unwrapped(self.expression(statement.condition))))
+            self.nested_statement(statement.statement, depth, output_file)
+
+        elif statement.kind == NodeType.RETURN_STATEMENT:
+            if statement.expression is not None:
+                output_file.write('{}return {};\n'.format(indent, unwrapped(self.expression(statement.expression))))
+            elif self.function.type_token.kind is not TokenType.T_VOID:
+                output_file.write('{}return 0;\n'.format(indent))
+            else:
+                output_file.write('{}return;\n'.format(indent))
+
+        elif statement.kind == NodeType.EXP_STATEMENT:
+            output_file.write('{}{};\n'.format(indent, unwrapped(self.expression(statement.expression))))
+
+    def nested_statement(self, statement, depth, output_file):
+        # a compound statement's braces go at the depth of the statement it belongs to
+        if statement.kind == NodeType.CMPND_STATEMENT:
+            self.statement(statement, depth, output_file)
+        else:
+            self.statement(statement, depth + 1, output_file)
+
+    def expression(self, expression):
+        """Return the C expression for 'expression'."""
+        if expression.kind == NodeType.NUM_EXP:
+            # wrapped around to 32 bits, as the movl the native code uses would
+            number = ((int(expression.number) + 0x80000000) & 0xffffffff) - 0x80000000
+            return str(number) if number >= 0 else '({})'.format(number)
+
+        elif expression.kind == NodeType.STR_EXP:
+            return c_string(expression.string)
+
+        elif expression.kind in (NodeType.MATH_EXP, NodeType.COMP_EXP):
+            left = self.expression(expression.left)
+            right = self.expression(expression.right)
+            sequence = None
+            # evaluate the left side first
+            if has_side_effects(expression.left) or has_side_effects(expression.right):
+                sequence = self.temporary('bpl_int')
+                sequence, left = '{} = {}, '.format(sequence, left), sequence
+            if expression.kind == NodeType.MATH_EXP:
+                operation = '{}({}, {})'.format(ARITHMETIC[expression.token.kind], left, right)
+            else:
+                operation = '({} {} {})'.format(left, COMPARISONS[expression.token.kind], right)
+            return '({}{})'.format(sequence, operation) if sequence else operation
+
+        elif expression.kind == NodeType.FUN_CALL_EXP:
+            args = []
+            arg = expression.arguments
+            while arg is not None:
+                args.append(arg)
+                arg = arg.next_node
+            values = [self.expression(arg) for arg in args]
+            if len(args) > 1 and any(has_side_effects(arg) for arg in args):
+                # evaluate the arguments from last to first, the first one as it's passed
+                sequence = []
+                for i in range(len(args) - 1, 0, -1):
+                    temporary = self.temporary(C_TYPES[args[i].type_string])
+                    sequence.append('{} = {}'.format(temporary, values[i]))
+                    values[i] = temporary
+                return '({}, {}({}))'.format(', '.join(sequence), c_name(expression.name), ', '.join(values))
+            return '{}({})'.format(c_name(expression.name), ', '.join(values))
+
+        elif expression.kind == NodeType.VAR_EXP:
+            return c_name(expression.name)
+
+        elif expression.kind == NodeType.ARRAY_EXP:
+            return '{}[{}]'.format(c_name(expression.name), self.expression(expression.expression))
+
+        elif expression.kind == NodeType.ASSIGN_EXP:
+            left = self.expression(expression.left)
+            right = self.expression(expression.right)
+            if has_side_effects(expression.left) or has_side_effects(expression.right):
+                # find where the value goes, then evaluate it, then store it
+                value_type = C_TYPES[expression.right.type_string]
+                address = self.temporary(value_type + ('*' if value_type.endswith('*') else ' *'))
+                value = self.temporary(value_type)
+                return '({} = &{}, {} = {}, *{} = {})'.format(address, left, value, right, address, value)
+            return '({} = {})'.format(left, right)
+
+        elif expression.kind == NodeType.NEG_EXP:
+            return 'bpl_rt_neg({})'.format(self.expression(expression.expression))
+
+        elif expression.kind == NodeType.DEREF_EXP:
+            return '(*{})'.format(self.expression(expression.expression))
+
+        elif expression.kind == NodeType.ADDRESS_EXP:
+            return '(&{})'.format(self.expression(expression.expression))
+
+        elif expression.kind == NodeType.READ_EXP:
+            return 'bpl_rt_read()'
@@ -3,9 +3,13 @@ AUTHOR: Oren Shoham
 DATE: 4/9/2014
 """
 
+from bpl.code_generator.peephole import AssemblyInstruction, Peephole
 from bpl.parser.parsetree import *
 from bpl.scanner.token import TokenType
+from contextlib import contextmanager
 from itertools import count
+from StringIO import StringIO
+import threading
 
 # Register names
 SP = 'rsp'
@@ -37,13 +41,49 @@ CALLEE_SAVED_5_32 = 'r14d'
 CALLEE_SAVED_6_64 = 'r15'
 CALLEE_SAVED_6_32 = 'r15d'
 
-# infinite label generator
+# infinite label generators, shared by the whole program unless label_scope() is in effect
 data_label = count()
-next_label = lambda : '.L{}'.format(next(data_label))
 string_label = count()
-
-def generate_code(type_checked_parse_tree, output_file):
-    """Top-level code generation function."""
+labels = threading.local()
+
+def next_label():
+    scope = getattr(labels, 'scope', None)
+    if scope is None:
+        return '.L{}'.format(next(data_label))
+    if scope[0] is None:
+        return '.L{}'.format(next(scope[1]))
+    return '.L{}_{}'.format(scope[0], next(scope[1]))
+
+def next_string_label():
+    scope = getattr(labels, 'scope', None)
+    if scope is None:
+        return '.S{}'.format(next(string_label))
+    if scope[0] is None:
+        return '.S{}'.format(next(scope[2]))
+    return '.S{}_{}'.format(scope[0], next(scope[2]))
+
+@contextmanager
+def label_scope(name=None):
+    """Number the jump and string labels generated by this thread inside the with block separately.
+
+    Labels are numbered from 0, so that code generated in the scope doesn't depend on
+    the code generated before it or by other threads. If 'name' is given, labels are
+    qualified with it, e.g. .Lname_0 and .Sname_0; BPL identifiers can't contain
+    underscores, so scopes named after functions can't collide. Otherwise they keep the
+    usual .L0 and .S0 form, which suits code for a whole program.
+    """
+    previous = getattr(labels, 'scope', None)
+    labels.scope = (name, count(), count())
+    try:
+        yield
+    finally:
+        labels.scope = previous
+
+def generate_code(type_checked_parse_tree, output_file, peephole_hits=None):
+    """Top-level code generation function.
+
+    'peephole_hits' is passed on to gen_code_function().
+    """
     compute_offsets(type_checked_parse_tree)
 
     # build a dictionary whose keys are strings and whose values are header labels for those strings
@@ -59,12 +99,40 @@ def generate_code(type_checked_parse_tree, output_file):
     declaration = type_checked_parse_tree
     while declaration is not None:
         if declaration.kind == NodeType.FUN_DEC:
-            gen_code_function(declaration, string_table, output_file)
+            gen_code_function(declaration, string_table, output_file, peephole_hits)
+        declaration = declaration.next_node
+
+def generate_code_sections(type_checked_parse_tree, peephole_hits=None):
+    """Generate the same code as generate_code(), but return it in pieces.
+
+    Return the header (global variables, string constants, and the start of the text
+    section) as a string, and a list of (function name, code) pairs, in program order.
+    """
+    compute_offsets(type_checked_parse_tree)
+
+    string_table = {}
+    declaration = type_checked_parse_tree
+    while declaration is not None:
+        if declaration.kind == NodeType.FUN_DEC:
+            string_table.update(build_string_table(declaration.body))
         declaration = declaration.next_node
 
+    header = StringIO()
+    gen_header(type_checked_parse_tree, string_table, header)
+
+    functions = []
+    declaration = type_checked_parse_tree
+    while declaration is not None:
+        if declaration.kind == NodeType.FUN_DEC:
+            code = StringIO()
+            gen_code_function(declaration, string_table, code, peephole_hits)
+            functions.append((declaration.name, code.getvalue()))
+        declaration = declaration.next_node
+    return header.getvalue(), functions
+
 def build_string_table(node):
     if node.kind == NodeType.STR_EXP:
-        return {node.string: '.S{}'.format(next(string_label))}
+        return {node.string: next_string_label()}
 
     elif node.kind in (NodeType.EXP_STATEMENT, NodeType.WRITE_STATEMENT):
         return build_string_table(node.expression)
@@ -114,15 +182,19 @@ def compute_offsets(parse_tree):
     declaration = parse_tree 
     while declaration is not None:
         if declaration.kind == NodeType.FUN_DEC:
-            parameter_offset = 8
-            param = declaration.params
-            while param is not None:
-                parameter_offset += 8
-                param.offset = parameter_offset
-                param = param.next_node
-            declaration.local_var_offset = -1 * compute_offsets_statement(declaration.body, 0)
+            compute_offsets_function(declaration)
         declaration = declaration.next_node
 
+def compute_offsets_function(function):
+    """Computes stack pointer offsets for the parameters and local variables of a single function."""
+    parameter_offset = 8
+    param = function.params
+    while param is not None:
+        parameter_offset += 8
+        param.offset = parameter_offset
+        param = param.next_node
+    function.local_var_offset = -1 * compute_offsets_statement(function.body, 0)
+
 def compute_offsets_statement(statement, offset):
     """Computes stack pointer offsets for local variable declarations and updates parse tree statement node fields appropriately."""
     if statement.kind == NodeType.CMPND_STATEMENT:
@@ -157,42 +229,59 @@ def compute_offsets_statement(statement, offset):
     else: # return a total local variable offset of 0
         return 0
 
+def gen_instruction(opcode, operands, comment, output_file):
+    """Write an instruction to output_file, or hand it to output_file.emit_instruction() if it takes instructions rather than text (as a Peephole does)."""
+    emit_instruction = getattr(output_file, 'emit_instruction', None)
+    if emit_instruction is not None:
+        emit_instruction(AssemblyInstruction(opcode, operands, comment))
+    elif operands:
+        output_file.write('\t{} {} #{}\n'.format(opcode, ', '.join(operands), comment))
+    else:
+        output_file.write('\t{} #{}\n'.format(opcode, comment))
+
 def gen_reg_reg(opcode, reg1, reg2, comment, output_file):
-    output_file.write('\t{} %{}, %{} #{}\n'.format(opcode, reg1, reg2, comment))
+    gen_instruction(opcode, ['%' + reg1, '%' + reg2], comment, output_file)
 
 def gen_immediate_reg(opcode, immediate, reg, comment, output_file):
-    output_file.write('\t{} ${}, %{} #{}\n'.format(opcode, immediate, reg, comment))
+    gen_instruction(opcode, ['${}'.format(immediate), '%' + reg], comment, output_file)
 
 def gen_indirect_reg(opcode, offset, reg1, reg2, comment, output_file):
-    output_file.write('\t{} {}(%{}), %{} #{}\n'.format(opcode, offset, reg1, reg2, comment))
+    gen_instruction(opcode, ['{}(%{})'.format(offset, reg1), '%' + reg2], comment, output_file)
 
 def gen_reg_indirect(opcode, reg1, offset, reg2, comment, output_file):
-    output_file.write('\t{} %{}, {}(%{}) #{}\n'.format(opcode, reg1, offset, reg2, comment))
+    gen_instruction(opcode, ['%' + reg1, '{}(%{})'.format(offset, reg2)], comment, output_file)
 
 def gen_immediate_indirect(opcode, immediate, offset, reg, comment, output_file):
-    output_file.write('\t{} ${}, {}(%{}) #{}\n'.format(opcode, immediate, offset, reg, comment))
+    gen_instruction(opcode, ['${}'.format(immediate), '{}(%{})'.format(offset, reg)], comment, output_file)
 
 def gen_no_operands(opcode, comment, output_file):
-    output_file.write('\t{} #{}\n'.format(opcode, comment))
+    gen_instruction(opcode, [], comment, output_file)
 
 def gen_direct(opcode, operand, comment, output_file):
-    output_file.write('\t{} {} #{}\n'.format(opcode, operand, comment))
+    gen_instruction(opcode, [str(operand)], comment, output_file)
 
 def gen_reg(opcode, reg, comment, output_file):
-    output_file.write('\t{} %{} #{}\n'.format(opcode, reg, comment))
+    gen_instruction(opcode, ['%' + reg], comment, output_file)
 
 def gen_header(parse_tree, string_table, output_file):
     # allocate global variables and arrays
     declaration = parse_tree
     while declaration is not None:
-        # allocate space for a single variable
-        if declaration.kind == NodeType.VAR_DEC:
-            output_file.write('.comm {}, {}, {}\n'.format(declaration.name, 8, 32))
-        # allocate space for an array
-        elif declaration.kind == NodeType.ARRAY_DEC:
-            output_file.write('.comm {}, {}, {}\n'.format(declaration.name, 8 * declaration.size, 32))
+        gen_global(declaration, output_file)
         declaration = declaration.next_node
 
+    gen_rodata(string_table, output_file)
+    gen_text_header(output_file)
+
+def gen_global(declaration, output_file):
+    # allocate space for a single variable
+    if declaration.kind == NodeType.VAR_DEC:
+        output_file.write('.comm {}, {}, {}\n'.format(declaration.name, 8, 32))
+    # allocate space for an array
+    elif declaration.kind == NodeType.ARRAY_DEC:
+        output_file.write('.comm {}, {}, {}\n'.format(declaration.name, 8 * declaration.size, 32))
+
+def gen_rodata(string_table, output_file):
     output_file.write('.section .rodata\n')
     output_file.write('.WriteIntString: .string "%d "\n')
     output_file.write('.WritelnString: .string "\\n"\n')
@@ -201,13 +290,42 @@ def gen_header(parse_tree, string_table, output_file):
     output_file.write('.ReadIntString: .string "%d"\n')
 
     # store all strings used in the program as read-only data
+    gen_strings(string_table, output_file)
+
+def gen_strings(string_table, output_file):
     for string in string_table:
         output_file.write('{}: .string "{}"\n'.format(string_table[string], string))
 
+def gen_text_header(output_file):
     output_file.write('.text\n')
     output_file.write('.globl main\n')
 
-def gen_code_function(function, string_table, output_file):
+def gen_scoped_function(function, output_file):
+    """Generate code for 'function' that doesn't depend on the code generated for any other function.
+
+    Its labels are numbered in a label_scope() of its own, and the strings it uses are
+    stored in a read-only data section just before its code. Offsets must already have
+    been computed.
+    """
+    with label_scope(function.name):
+        string_table = build_string_table(function.body)
+        if string_table:
+            output_file.write('.section .rodata\n')
+            gen_strings(string_table, output_file)
+            output_file.write('.text\n')
+        gen_code_function(function, string_table, output_file)
+
+def gen_code_function(function, string_table, output_file, peephole_hits=None):
+    """Generate the code of 'function', running it through the peephole optimizer.
+
+    The number of times each peephole pattern applies is added to the dictionary
+    'peephole_hits', if it's given.
+    """
+    peephole = Peephole(output_file, peephole_hits)
+    gen_function_body(function, string_table, peephole)
+    peephole.flush()
+
+def gen_function_body(function, string_table, output_file):
     output_file.write(function.name + ':\n')
     gen_reg_reg('movq', SP, FP, 'set up the frame pointer', output_file)
     gen_immediate_reg('sub', function.local_var_offset, SP, 'allocate local variables', output_file)
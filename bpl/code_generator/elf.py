@@ -0,0 +1,110 @@
+"""
+Relocatable ELF64 object files for x86-64.
+
+object_file() lays out the sections of machine code and data an encoder produced,
+together with their symbols and relocations, the way an assembler's output would be,
+so the linker can link them with the C library like any other object file.
+"""
+
+import struct
+
+# section types and flags
+SHT_PROGBITS = 1
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+SHT_RELA = 4
+SHF_WRITE = 0x1
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+SHF_INFO_LINK = 0x40
+
+# symbol bindings, types, and special section indexes
+STB_LOCAL = 0
+STB_GLOBAL = 1
+STT_NOTYPE = 0
+STT_OBJECT = 1
+STT_SECTION = 3
+SHN_UNDEF = 0
+SHN_COMMON = 0xfff2
+
+# relocation types
+R_X86_64_PC32 = 2
+R_X86_64_PLT32 = 4
+R_X86_64_32 = 10
+R_X86_64_32S = 11
+
+HEADER_SIZE = 64
+SECTION_HEADER = struct.Struct('<IIQQQQIIQQ')
+SYMBOL = struct.Struct('<IBBHQQ')
+RELOCATION = struct.Struct('<QQq')
+
+class StringTable(object):
+    """The contents of a string table section, which names are added to once each."""
+
+    def __init__(self):
+        self.data = bytearray(b'\0')
+        self.offsets = {'': 0}
+
+    def add(self, name):
+        """Return the offset of 'name' in the table, adding it if it isn't there yet."""
+        offset = self.offsets.get(name)
+        if offset is None:
+            offset = self.offsets[name] = len(self.data)
+            self.data += name + b'\0'
+        return offset
+
+def object_file(sections, symbols, relocations):
+    """Return the bytes of a relocatable object file.
+
+    'sections' lists the (name, data, flags, alignment) of each section of code or data;
+    they get section indexes from 1 on. 'symbols' lists the (name, binding, type, section
+    index, value, size) of each symbol, local symbols first; they get symbol indexes
+    from 1 on. 'relocations' maps section indexes to lists of (offset, symbol index,
+    relocation type, addend) tuples.
+    """
+    names = StringTable()
+    symbol_names = StringTable()
+    # (name, type, flags, data, link, info, alignment, entry size) of each section
+    headers = [('', 0, 0, b'', 0, 0, 0, 0)]
+    for name, data, flags, alignment in sections:
+        headers.append((name, SHT_PROGBITS, flags, data, 0, 0, alignment, 0))
+    symbol_table_index = len(headers) + len(relocations)
+    for index in sorted(relocations):
+        data = b''.join(RELOCATION.pack(offset, symbol << 32 | kind, addend)
+                for offset, symbol, kind, addend in relocations[index])
+        headers.append(('.rela' + sections[index - 1][0], SHT_RELA, SHF_INFO_LINK, data,
+                symbol_table_index, index, 8, RELOCATION.size))
+
+    entries = [SYMBOL.pack(0, 0, 0, 0, 0, 0)]
+    first_global = 0
+    for name, binding, kind, section, value, size in symbols:
+        if binding != STB_LOCAL and not first_global:
+            first_global = len(entries)
+        entries.append(SYMBOL.pack(symbol_names.add(name), binding << 4 | kind, 0, section, value, size))
+    headers.append(('.symtab', SHT_SYMTAB, 0, b''.join(entries), symbol_table_index + 1,
+            first_global or len(entries), 8, SYMBOL.size))
+    headers.append(('.strtab', SHT_STRTAB, 0, bytes(symbol_names.data), 0, 0, 1, 0))
+    # an empty .note.GNU-stack section tells the linker the stack needn't be executable
+    headers.append(('.note.GNU-stack', SHT_PROGBITS, 0, b'', 0, 0, 1, 0))
+    for header in headers[1:]:
+        names.add(header[0])
+    headers.append(('.shstrtab', SHT_STRTAB, 0, None, 0, 0, 1, 0))
+    names.add('.shstrtab')
+
+    # lay out the sections' contents after the file header, and their headers after that
+    contents = bytearray(HEADER_SIZE)
+    section_headers = [SECTION_HEADER.pack(0, 0, 0, 0, 0, 0, 0, 0, 0, 0)]
+    for name, kind, flags, data, link, info, alignment, entry_size in headers[1:]:
+        if data is None:
+            data = bytes(names.data)
+        contents += b'\0' * (-len(contents) % alignment)
+        section_headers.append(SECTION_HEADER.pack(names.add(name), kind, flags, 0, len(contents),
+                len(data), link, info, alignment, entry_size))
+        contents += data
+    contents += b'\0' * (-len(contents) % 8)
+    header_offset = len(contents)
+    contents += b''.join(section_headers)
+    contents[:HEADER_SIZE] = struct.pack('<4sBBBB8xHHIQQQIHHHHHH', b'\x7fELF', 2, 1, 1, 0,
+            1, 62, 1, 0, 0, header_offset, 0, HEADER_SIZE, 0, 0, SECTION_HEADER.size,
+            len(headers), len(headers) - 1)
+    return bytes(contents)
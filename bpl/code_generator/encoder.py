@@ -0,0 +1,492 @@
+"""
+An encoder for the x86-64 instructions the code generator uses, producing relocatable ELF objects.
+
+An ObjectWriter takes the place of the assembly file: the code generator writes the
+same lines to it that it writes to a .s file, and each instruction is encoded into
+machine code as soon as its line is complete, so no assembler has to run. Only the
+instructions and directives the code generator emits are supported, and anything
+else raises an EncodingError. Jumps and calls always take 32-bit displacements. A
+reference to a label in the same section is filled in once all the code is written,
+and any other reference becomes a relocation for the linker.
+"""
+
+import re, struct
+from bpl.code_generator import elf
+
+class EncodingError(Exception):
+    def __init__(self, line, message):
+        self.arguments = (line, message)
+        message = 'Encoding Error on "{}": {}'.format(line.strip(), message)
+        Exception.__init__(self, message)
+
+    def __reduce__(self):
+        """Rebuild the exception from its original arguments, so that it can be sent between processes."""
+        return (self.__class__, self.arguments)
+
+# register names, mapped to their numbers and sizes in bytes
+REGISTERS = {}
+for number, name in enumerate(['rax', 'rcx', 'rdx', 'rbx', 'rsp', 'rbp', 'rsi', 'rdi']):
+    REGISTERS[name] = (number, 8)
+    REGISTERS['e' + name[1:]] = (number, 4)
+for number, name in enumerate(['al', 'cl', 'dl', 'bl', 'spl', 'bpl', 'sil', 'dil']):
+    REGISTERS[name] = (number, 1)
+for number in range(8, 16):
+    REGISTERS['r{}'.format(number)] = (number, 8)
+    REGISTERS['r{}d'.format(number)] = (number, 4)
+    REGISTERS['r{}b'.format(number)] = (number, 1)
+
+# condition codes, as they appear in the names of conditional jumps and sets
+CONDITIONS = {'o': 0, 'no': 1, 'b': 2, 'c': 2, 'nae': 2, 'ae': 3, 'nb': 3, 'nc': 3, 'e': 4,
+        'z': 4, 'ne': 5, 'nz': 5, 'be': 6, 'na': 6, 'a': 7, 'nbe': 7, 's': 8, 'ns': 9, 'p': 10,
+        'pe': 10, 'np': 11, 'po': 11, 'l': 12, 'nge': 12, 'ge': 13, 'nl': 13, 'le': 14,
+        'ng': 14, 'g': 15, 'nle': 15}
+
+# the kinds of reference to a label that are filled in later
+PC32 = 'pc32'
+ABS32 = 'abs32'
+ABS32S = 'abs32s'
+
+label_pattern = re.compile(r'([.\w$]+):\s*(.*)$')
+memory_pattern = re.compile(r'(-?\w*)\(%(\w+)\)$')
+
+def parse_number(text):
+    """Return the integer 'text' stands for, or None if it's a label."""
+    try:
+        return int(text, 0)
+    except ValueError:
+        return None
+
+def parse_string(text):
+    """Return the bytes of the double-quoted string 'text', with the escapes the GNU assembler understands replaced."""
+    text = text[text.index('"') + 1:text.rindex('"')]
+    if '\\' not in text:
+        return text
+    characters = []
+    i = 0
+    while i < len(text):
+        character = text[i]
+        i += 1
+        if character != '\\' or i == len(text):
+            characters.append(character)
+            continue
+        character = text[i]
+        i += 1
+        if character in 'bfnrtv':
+            characters.append('\b\f\n\r\t\v'['bfnrtv'.index(character)])
+        elif character.isdigit():
+            number = int(character)
+            for digit in text[i:i + 2]:
+                if not digit.isdigit():
+                    break
+                number = number * 8 + int(digit)
+                i += 1
+            characters.append(chr(number & 0xff))
+        elif character in 'xX':
+            number = 0
+            while i < len(text) and text[i] in '0123456789abcdefABCDEF':
+                number = number * 16 + int(text[i], 16)
+                i += 1
+            characters.append(chr(number & 0xff))
+        else:
+            characters.append(character)
+    return ''.join(characters)
+
+class ObjectWriter(object):
+    """A file-like object that encodes the assembly code written to it into an object file."""
+
+    def __init__(self):
+        self.sections = {'.text': bytearray(), '.rodata': bytearray()}
+        self.section = self.sections['.text']
+        self.section_name = '.text'
+        self.labels = {} # label -> (section name, offset)
+        self.fixups = [] # (section name, offset, kind, label, addend)
+        self.globals = set()
+        self.commons = {} # name -> (size, alignment)
+        self.pending = ''
+        self.line = ''
+        # the code generator repeats the same lines over and over, and an instruction's
+        # encoding doesn't depend on where it is, so each line's is only worked out once
+        self.encodings = {} # line, with its newline -> (machine code, [(offset, kind, label, addend)])
+
+    def write(self, text):
+        # the code generator usually writes one whole line at a time
+        encoding = self.encodings.get(text) if not self.pending else None
+        if encoding is not None:
+            self.add_encoding(encoding)
+            return
+        lines = (self.pending + text).split('\n')
+        self.pending = lines.pop()
+        for line in lines:
+            if not line:
+                continue
+            key = line + '\n'
+            encoding = self.encodings.get(key)
+            if encoding is not None:
+                self.add_encoding(encoding)
+                continue
+            self.line = line
+            start = len(self.section)
+            fixups = len(self.fixups)
+            self.add_line(line)
+            if line[0] == '\t':
+                self.encodings[key] = (bytes(self.section[start:]),
+                        [(fixup[1] - start,) + fixup[2:] for fixup in self.fixups[fixups:]])
+
+    def add_encoding(self, encoding):
+        """Add the machine code of a line that was encoded before."""
+        code, fixups = encoding
+        if fixups:
+            start = len(self.section)
+            for offset, kind, label, addend in fixups:
+                self.fixups.append((self.section_name, start + offset, kind, label, addend))
+        self.section += code
+
+    def add_line(self, line):
+        """Encode one line of assembly code."""
+        if line[0] == '\t':
+            comment = line.find(' #')
+            if comment >= 0:
+                line = line[:comment]
+            fields = line.split(None, 1)
+            entry = INSTRUCTIONS.get(fields[0])
+            if entry is None:
+                self.error('unsupported instruction')
+            operands = [self.operand(text) for text in fields[1].split(', ')] if len(fields) > 1 else []
+            encode, argument, size = entry
+            encode(self, argument, self.operand_size(size, operands), operands)
+            return
+        m = label_pattern.match(line)
+        if m is not None:
+            name = m.group(1)
+            if name in self.labels or name in self.commons:
+                self.error('symbol already defined')
+            self.labels[name] = (self.section_name, len(self.section))
+            line = m.group(2)
+            if not line:
+                return
+        fields = line.split(None, 1)
+        directive = fields[0]
+        if directive == '.string':
+            self.section += parse_string(fields[1]) + '\0'
+        elif directive == '.text':
+            self.switch_section('.text')
+        elif directive == '.section' and len(fields) > 1 and fields[1] in self.sections:
+            self.switch_section(fields[1])
+        elif directive == '.globl':
+            self.globals.add(fields[1].strip())
+        elif directive == '.comm':
+            name, size, alignment = [field.strip() for field in fields[1].split(',')]
+            if name in self.labels:
+                self.error('symbol already defined')
+            self.commons[name] = (int(size), int(alignment))
+        else:
+            self.error('unsupported directive')
+
+    def switch_section(self, name):
+        self.section_name = name
+        self.section = self.sections[name]
+
+    def error(self, message):
+        raise EncodingError(self.line, message)
+
+    def operand(self, text):
+        """Return ('r', number, size) for a register, ('i', value, label) for an immediate,
+        ('m', base register number, displacement) for a memory operand, or ('l', label) for a
+        jump or call target."""
+        if text[0] == '%':
+            register = REGISTERS.get(text[1:])
+            if register is None:
+                self.error('unknown register')
+            return ('r',) + register
+        if text[0] == '$':
+            value = parse_number(text[1:])
+            return ('i', value, text[1:] if value is None else None)
+        m = memory_pattern.match(text)
+        if m is not None:
+            base = REGISTERS.get(m.group(2))
+            displacement = parse_number(m.group(1) or '0')
+            if base is None or base[1] != 8 or displacement is None:
+                self.error('unsupported memory operand')
+            return ('m', base[0], displacement)
+        return ('l', text)
+
+    def operand_size(self, size, operands):
+        """Return the size of an instruction's operands, from its suffix or its register operands."""
+        for operand in operands:
+            if operand[0] != 'r' or size == 'mixed':
+                continue
+            if size is None and operand[2] != 1:
+                size = operand[2]
+            elif size != operand[2]:
+                # byte registers only go with the instructions whose entries say so
+                self.error('operand size mismatch')
+        if size is None and any(operand[0] == 'm' for operand in operands):
+            self.error('operand size unknown')
+        return size
+
+    def emit(self, opcode, reg, rm, size, rex_needed=False):
+        """Emit 'opcode' with a ModRM byte for register field 'reg' and register or memory operand 'rm'."""
+        rex = 0x48 if size == 8 else 0x40
+        if reg >= 8:
+            rex |= 0x4
+        if rm[1] >= 8:
+            rex |= 0x1
+        if rex != 0x40 or rex_needed:
+            self.section.append(rex)
+        self.section += opcode
+        if rm[0] == 'r':
+            self.section.append(0xc0 | (reg & 7) << 3 | (rm[1] & 7))
+            return
+        base = rm[1] & 7
+        displacement = rm[2]
+        if displacement == 0 and base != 5:
+            mode, encoded = 0x00, b''
+        elif -128 <= displacement < 128:
+            mode, encoded = 0x40, struct.pack('<b', displacement)
+        else:
+            mode, encoded = 0x80, struct.pack('<i', displacement)
+        self.section.append(mode | (reg & 7) << 3 | base)
+        if base == 4:
+            self.section.append(0x24)
+        self.section += encoded
+
+    def immediate(self, operand, width, kind=ABS32):
+        """Emit the immediate 'operand' in 'width' bytes, leaving room for a label's address."""
+        if operand[2] is not None:
+            self.fixups.append((self.section_name, len(self.section), kind, operand[2], 0))
+            self.section += b'\0' * width
+        else:
+            self.section += struct.pack({1: '<b', 4: '<i', 8: '<q'}[width], operand[1])
+
+    def target(self, operand):
+        """Emit a 32-bit displacement to the jump or call target 'operand'."""
+        if operand[0] != 'l':
+            self.error('unsupported jump or call target')
+        self.fixups.append((self.section_name, len(self.section), PC32, operand[1], -4))
+        self.section += b'\0\0\0\0'
+
+    def flush(self):
+        """Encode the last line written, if it didn't end with a newline."""
+        if self.pending:
+            self.write('\n')
+
+    def getvalue(self):
+        """Return the object file holding everything written so far."""
+        self.flush()
+        section_names = ['.text', '.rodata']
+        section_indexes = dict((name, index + 1) for index, name in enumerate(section_names))
+        symbols = [(name, elf.STB_LOCAL, elf.STT_SECTION, section_indexes[name], 0, 0) for name in section_names]
+        local_labels = sorted(name for name in self.labels if name not in self.globals and not name.startswith('.'))
+        for name in local_labels:
+            section, offset = self.labels[name]
+            symbols.append((name, elf.STB_LOCAL, elf.STT_NOTYPE, section_indexes[section], offset, 0))
+        for name in sorted(name for name in self.globals if name in self.labels):
+            section, offset = self.labels[name]
+            symbols.append((name, elf.STB_GLOBAL, elf.STT_NOTYPE, section_indexes[section], offset, 0))
+        for name in sorted(self.commons):
+            size, alignment = self.commons[name]
+            symbols.append((name, elf.STB_GLOBAL, elf.STT_OBJECT, elf.SHN_COMMON, alignment, size))
+        undefined = sorted(set(fixup[3] for fixup in self.fixups if fixup[3] not in self.labels and
+                fixup[3] not in self.commons) | set(name for name in self.globals if name not in self.labels))
+        for name in undefined:
+            symbols.append((name, elf.STB_GLOBAL, elf.STT_NOTYPE, elf.SHN_UNDEF, 0, 0))
+        # the section symbols come first, so each one's index is its section's
+        symbol_indexes = dict((symbol[0], index + 1) for index, symbol in enumerate(symbols)
+                if symbol[2] != elf.STT_SECTION)
+
+        relocations = {}
+        for section, offset, kind, label, addend in self.fixups:
+            data = self.sections[section]
+            if label in self.labels:
+                target_section, value = self.labels[label]
+                if kind is PC32 and target_section == section:
+                    data[offset:offset + 4] = struct.pack('<i', value + addend - offset)
+                    continue
+                symbol = section_indexes[target_section]
+                addend += value
+                relocation = elf.R_X86_64_PC32
+            else:
+                symbol = symbol_indexes[label]
+                relocation = elf.R_X86_64_PLT32
+            if kind is ABS32:
+                relocation = elf.R_X86_64_32
+            elif kind is ABS32S:
+                relocation = elf.R_X86_64_32S
+            relocations.setdefault(section_indexes[section], []).append((offset, symbol, relocation, addend))
+
+        sections = [('.text', bytes(self.sections['.text']), elf.SHF_ALLOC | elf.SHF_EXECINSTR, 1),
+                ('.rodata', bytes(self.sections['.rodata']), elf.SHF_ALLOC, 1)]
+        return elf.object_file(sections, symbols, relocations)
+
+# the encoders for each kind of instruction, which take the writer, the entry's argument,
+# the operands' size, and the operands
+
+def encode_arithmetic(writer, number, size, operands):
+    if len(operands) != 2:
+        writer.error('expected two operands')
+    source, destination = operands
+    if source[0] == 'i' and destination[0] in 'rm':
+        if source[2] is None and -128 <= source[1] < 128:
+            writer.emit(b'\x83', number, destination, size)
+            writer.immediate(source, 1)
+        else:
+            writer.emit(b'\x81', number, destination, size)
+            writer.immediate(source, 4, ABS32S if size == 8 else ABS32)
+    elif source[0] == 'r' and destination[0] in 'rm':
+        writer.emit(chr(0x01 | number << 3), source[1], destination, size)
+    elif source[0] == 'm' and destination[0] == 'r':
+        writer.emit(chr(0x03 | number << 3), destination[1], source, size)
+    else:
+        writer.error('unsupported operands')
+
+def encode_shift(writer, number, size, operands):
+    if len(operands) != 2 or operands[1][0] not in 'rm':
+        writer.error('unsupported operands')
+    source, destination = operands
+    if source[0] == 'i' and source[2] is None:
+        writer.emit(b'\xc1', number, destination, size)
+        writer.immediate(source, 1)
+    elif source[0] == 'r' and source[1:] == (1, 1):
+        writer.emit(b'\xd3', number, destination, size)
+    else:
+        writer.error('unsupported operands')
+
+def encode_mov(writer, argument, size, operands):
+    if len(operands) != 2:
+        writer.error('expected two operands')
+    source, destination = operands
+    if source[0] == 'i' and destination[0] == 'r':
+        if size == 4:
+            if destination[1] >= 8:
+                writer.section.append(0x41)
+            writer.section.append(0xb8 | destination[1] & 7)
+            writer.immediate(source, 4)
+        elif source[2] is not None or -2 ** 31 <= source[1] < 2 ** 31:
+            writer.emit(b'\xc7', 0, destination, size)
+            writer.immediate(source, 4, ABS32S)
+        else:
+            writer.section.append(0x49 if destination[1] >= 8 else 0x48)
+            writer.section.append(0xb8 | destination[1] & 7)
+            writer.immediate(source, 8)
+    elif source[0] == 'i' and destination[0] == 'm':
+        writer.emit(b'\xc7', 0, destination, size)
+        writer.immediate(source, 4, ABS32S if size == 8 else ABS32)
+    elif source[0] == 'r' and destination[0] in 'rm':
+        writer.emit(b'\x89', source[1], destination, size)
+    elif source[0] == 'm' and destination[0] == 'r':
+        writer.emit(b'\x8b', destination[1], source, size)
+    else:
+        writer.error('unsupported operands')
+
+def encode_extend(writer, argument, mixed, operands):
+    opcode, size, source_size = argument
+    if len(operands) != 2 or operands[0][0] not in 'rm' or operands[1][0] != 'r':
+        writer.error('unsupported operands')
+    source, destination = operands
+    if destination[2] != size or source[0] == 'r' and source[2] != source_size:
+        writer.error('operand size mismatch')
+    writer.emit(opcode, destination[1], source, size, source[0] == 'r' and source[2] == 1 and source[1] >= 4)
+
+def encode_imul(writer, argument, size, operands):
+    if len(operands) == 1 and operands[0][0] in 'rm':
+        writer.emit(b'\xf7', 5, operands[0], size)
+    elif len(operands) == 2 and operands[0][0] in 'rm' and operands[1][0] == 'r':
+        writer.emit(b'\x0f\xaf', operands[1][1], operands[0], size)
+    elif len(operands) in (2, 3) and operands[0][0] == 'i' and operands[0][2] is None and operands[-1][0] == 'r':
+        source = operands[-2] if len(operands) == 3 else operands[1]
+        if source[0] not in 'rm':
+            writer.error('unsupported operands')
+        if -128 <= operands[0][1] < 128:
+            writer.emit(b'\x6b', operands[-1][1], source, size)
+            writer.immediate(operands[0], 1)
+        else:
+            writer.emit(b'\x69', operands[-1][1], source, size)
+            writer.immediate(operands[0], 4)
+    else:
+        writer.error('unsupported operands')
+
+def encode_unary(writer, number, size, operands):
+    if len(operands) != 1 or operands[0][0] not in 'rm':
+        writer.error('unsupported operands')
+    writer.emit(b'\xf7', number, operands[0], size)
+
+def encode_lea(writer, argument, size, operands):
+    if len(operands) != 2 or operands[0][0] != 'm' or operands[1][0] != 'r':
+        writer.error('unsupported operands')
+    writer.emit(b'\x8d', operands[1][1], operands[0], size)
+
+def encode_test(writer, argument, size, operands):
+    if len(operands) != 2 or operands[1][0] not in 'rm':
+        writer.error('unsupported operands')
+    source, destination = operands
+    if source[0] == 'i':
+        writer.emit(b'\xf7', 0, destination, size)
+        writer.immediate(source, 4)
+    elif source[0] == 'r':
+        writer.emit(b'\x85', source[1], destination, size)
+    else:
+        writer.error('unsupported operands')
+
+def encode_push(writer, opcode, size, operands):
+    if len(operands) != 1:
+        writer.error('unsupported operands')
+    operand = operands[0]
+    if operand[0] == 'r':
+        if operand[1] >= 8:
+            writer.section.append(0x41)
+        writer.section.append(opcode | operand[1] & 7)
+    elif operand[0] == 'i' and opcode == 0x50:
+        writer.section.append(0x68)
+        writer.immediate(operand, 4, ABS32S)
+    elif operand[0] == 'm':
+        writer.emit(b'\xff' if opcode == 0x50 else b'\x8f', 6 if opcode == 0x50 else 0, operand, 4)
+    else:
+        writer.error('unsupported operands')
+
+def encode_set(writer, condition, size, operands):
+    if len(operands) != 1 or operands[0][0] not in 'rm' or size != 1:
+        writer.error('unsupported operands')
+    operand = operands[0]
+    writer.emit(chr(0x0f) + chr(0x90 | condition), 0, operand, 4, operand[0] == 'r' and operand[1] >= 4)
+
+def encode_jump(writer, opcode, size, operands):
+    if len(operands) != 1:
+        writer.error('expected one operand')
+    writer.section += opcode
+    writer.target(operands[0])
+
+def encode_fixed(writer, opcode, size, operands):
+    if operands:
+        writer.error('unexpected operands')
+    writer.section += opcode
+
+# mnemonic -> (encoder, argument, operand size given by its suffix)
+INSTRUCTIONS = {}
+SUFFIXES = {'': None, 'l': 4, 'q': 8}
+for base, number in [('add', 0), ('or', 1), ('and', 4), ('sub', 5), ('xor', 6), ('cmp', 7)]:
+    for suffix, size in SUFFIXES.items():
+        INSTRUCTIONS[base + suffix] = (encode_arithmetic, number, size)
+for base, number in [('shl', 4), ('sal', 4), ('shr', 5), ('sar', 7)]:
+    for suffix, size in SUFFIXES.items():
+        INSTRUCTIONS[base + suffix] = (encode_shift, number, size)
+for base, number in [('not', 2), ('neg', 3), ('mul', 4), ('div', 6), ('idiv', 7)]:
+    for suffix, size in SUFFIXES.items():
+        INSTRUCTIONS[base + suffix] = (encode_unary, number, size)
+for suffix, size in SUFFIXES.items():
+    INSTRUCTIONS['mov' + suffix] = (encode_mov, None, size)
+    INSTRUCTIONS['imul' + suffix] = (encode_imul, None, size)
+    INSTRUCTIONS['lea' + suffix] = (encode_lea, None, size)
+    INSTRUCTIONS['test' + suffix] = (encode_test, None, size)
+for name, opcode in [('push', 0x50), ('pop', 0x58)]:
+    INSTRUCTIONS[name] = INSTRUCTIONS[name + 'q'] = (encode_push, opcode, 8)
+INSTRUCTIONS['movzbl'] = (encode_extend, (b'\x0f\xb6', 4, 1), 'mixed')
+INSTRUCTIONS['movzbq'] = (encode_extend, (b'\x0f\xb6', 8, 1), 'mixed')
+INSTRUCTIONS['movslq'] = (encode_extend, (b'\x63', 8, 4), 'mixed')
+for name, condition in CONDITIONS.items():
+    INSTRUCTIONS['j' + name] = (encode_jump, chr(0x0f) + chr(0x80 | condition), None)
+    INSTRUCTIONS['set' + name] = (encode_set, condition, 1)
+INSTRUCTIONS['jmp'] = (encode_jump, b'\xe9', None)
+INSTRUCTIONS['call'] = INSTRUCTIONS['callq'] = (encode_jump, b'\xe8', None)
+for name, opcode in [('ret', b'\xc3'), ('retq', b'\xc3'), ('cltq', b'\x48\x98'), ('cqto', b'\x48\x99'),
+        ('cltd', b'\x99'), ('leave', b'\xc9'), ('nop', b'\x90')]:
+    INSTRUCTIONS[name] = (encode_fixed, opcode, None)
@@ -0,0 +1,434 @@
+"""
+Lowering of IR Programs into assembly code.
+
+The code is written with the code generator's instruction helpers, and keeps to its
+frame layout, and the header (global variables and string constants) is written as
+gen_header() writes it, for the ones the program still uses. Calls follow the System V
+convention instead of the code generator's: the first six arguments are passed in
+%rdi, %rsi, %rdx, %rcx, %r8, and %r9, and the rest on the stack, and a function saves
+%rbx, its frame pointer, along with the other callee-saved registers it uses. A
+parameter passed in a register that has to live in memory gets a frame cell below the
+local variables, and the rest of the parameters are found above the saved %rbx and the
+return address. Temps are kept in the registers allocate_registers() gives them. A
+spilled variable lives in its own frame cell, and every other spilled Temp gets a cell
+below the function's local variables. An instruction works on its operands where they
+are, computing its result in its destination's register, or in the accumulator and
+then storing it, and %rcx and %rdx are only used for scratch. Blocks are laid out in
+the order the function lists them, and a jump to the next block is left out. Finally,
+the code of each function goes through the peephole optimizer.
+"""
+
+from StringIO import StringIO
+from bpl.code_generator.code_generator import gen_reg_reg, gen_immediate_reg, gen_indirect_reg, gen_reg_indirect, \
+        gen_immediate_indirect, gen_no_operands, gen_direct, gen_reg, gen_global, gen_rodata, gen_text_header, \
+        next_label, SP, FP, ACC_64, ACC_32, ARG1_64, ARG2_64, ARG3_64, ARG4_64, ARG4_32
+from bpl.code_generator.peephole import Peephole
+from bpl.code_generator.register_allocation import allocate_registers, ARGUMENT_REGISTERS, CALLEE_SAVED, REGISTERS_32
+from bpl.ir.ir import Opcode, Temp, NEGATED
+
+# the condition code of each comparison, for conditional jumps and sets
+CONDITION_CODES = {
+    Opcode.LESS: 'l',
+    Opcode.LEQ: 'le',
+    Opcode.EQ: 'e',
+    Opcode.NEQ: 'ne',
+    Opcode.GEQ: 'ge',
+    Opcode.GREATER: 'g',
+}
+ARITHMETIC_INSTRUCTIONS = {
+    Opcode.ADD: 'addl',
+    Opcode.SUB: 'subl',
+    Opcode.MUL: 'imull',
+}
+COMMUTATIVE = frozenset((Opcode.ADD, Opcode.MUL))
+
+def lower(program, output_file, peephole_hits=None):
+    """Write the assembly code of the IR 'program' to output_file.
+
+    The code of each function goes through the peephole optimizer, which adds the number
+    of times each of its patterns applies to the dictionary 'peephole_hits', if given.
+    """
+    lower_header(program, output_file)
+    for function in program.functions:
+        lower_function(function, output_file, peephole_hits)
+
+def lower_sections(program, peephole_hits=None):
+    """Lower 'program' like lower(), but return the header as a string, and a list of (function name, code) pairs, in program order."""
+    header = StringIO()
+    lower_header(program, header)
+    functions = []
+    for function in program.functions:
+        code = StringIO()
+        lower_function(function, code, peephole_hits)
+        functions.append((function.name, code.getvalue()))
+    return header.getvalue(), functions
+
+def lower_header(program, output_file):
+    """Write what gen_header() would for the global variables and string constants 'program' still has."""
+    for declaration in program.globals:
+        gen_global(declaration, output_file)
+    gen_rodata(program.string_table, output_file)
+    gen_text_header(output_file)
+
+def lower_function(function, output_file, peephole_hits=None):
+    peephole = Peephole(output_file, peephole_hits)
+    FunctionLowering(function, peephole).lower()
+    peephole.flush()
+
+class FunctionLowering(object):
+    """Writes the assembly code of one IR Function."""
+
+    def __init__(self, function, output_file):
+        self.function = function
+        self.output_file = output_file
+        self.registers = allocate_registers(function)
+        self.frame_size = function.declaration.local_var_offset
+        # the frame offsets of the parameters, which are laid out for the code generator's calling convention
+        self.offsets = {}
+        self.params = []
+        param = function.declaration.params
+        while param is not None:
+            variable = function.variables.get(param)
+            if len(self.params) >= len(ARGUMENT_REGISTERS):
+                self.offsets[param.offset] = 16 + 8 * (len(self.params) - len(ARGUMENT_REGISTERS))
+            elif variable not in self.registers:
+                self.frame_size += 8
+                self.offsets[param.offset] = -self.frame_size
+            self.params.append((param, variable))
+            param = param.next_node
+        self.homes = {}
+        for variable in function.variables.itervalues():
+            self.homes[variable] = self.frame_offset(variable.declaration.offset)
+        for instruction in function.instructions():
+            temp = instruction.destination
+            if temp is not None and temp not in self.homes and temp not in self.registers:
+                self.frame_size += 8
+                self.homes[temp] = -self.frame_size
+        # the callee-saved registers the function uses are saved below its spilled Temps
+        self.saved_registers = []
+        for register in CALLEE_SAVED:
+            if register in self.registers.itervalues():
+                self.frame_size += 8
+                self.saved_registers.append((register, -self.frame_size))
+
+    def lower(self):
+        output_file = self.output_file
+        output_file.write(self.function.name + ':\n')
+        gen_reg('push', FP, 'save the caller\'s frame pointer', output_file)
+        gen_reg_reg('movq', SP, FP, 'set up the frame pointer', output_file)
+        gen_immediate_reg('sub', self.frame_size, SP, 'allocate local variables and temporaries', output_file)
+        for register, offset in self.saved_registers:
+            gen_reg_indirect('movq', register, offset, FP, 'save the callee-saved register %{}'.format(register), output_file)
+        # store the parameters that live in memory before the ones kept in registers are moved into place
+        moves = []
+        for (param, variable), register in zip(self.params, ARGUMENT_REGISTERS):
+            if variable in self.registers:
+                moves.append((register, self.registers[variable]))
+            else:
+                gen_reg_indirect('movq', register, self.frame_offset(param.offset), FP, 'store the parameter {} in its frame cell'.format(param.name), output_file)
+        self.parallel_move(moves)
+        for param, variable in self.params[len(ARGUMENT_REGISTERS):]:
+            if variable in self.registers:
+                gen_indirect_reg('movq', self.frame_offset(param.offset), FP, self.registers[variable], 'put the parameter {} into its register'.format(variable), output_file)
+
+        blocks = self.function.blocks
+        layout = [(block, blocks[i + 1] if i + 1 < len(blocks) else None) for i, block in enumerate(blocks)]
+        # only the blocks that are jumped to, rather than just fallen into, need labels
+        labels = {}
+        for block, next_block in layout:
+            for mnemonic, target in self.jumps(block.terminator, next_block):
+                if target not in labels:
+                    labels[target] = next_label()
+        for block, next_block in layout:
+            if block in labels:
+                output_file.write('{}:\n'.format(labels[block]))
+            for instruction in block.instructions:
+                self.instruction(instruction)
+            for mnemonic, target in self.jumps(block.terminator, next_block):
+                gen_direct(mnemonic, labels[target], 'jump to the target block' if mnemonic == 'jmp' else
+                        'jump if the comparison holds', output_file)
+
+    def jumps(self, terminator, next_block):
+        """Return the (mnemonic, block) pairs of the jumps that end a block with 'terminator', when 'next_block' follows it."""
+        if terminator.opcode == Opcode.JUMP:
+            if terminator.targets[0] is next_block:
+                return []
+            return [('jmp', terminator.targets[0])]
+        if terminator.opcode == Opcode.BRANCH:
+            true_block, false_block = terminator.targets
+            condition = terminator.symbol
+            if true_block is next_block:
+                # fall through to the true block, jumping to the false one if the comparison doesn't hold
+                true_block, false_block = false_block, true_block
+                condition = NEGATED[condition]
+            jumps = [('j' + CONDITION_CODES[condition], true_block)]
+            if false_block is not next_block:
+                jumps.append(('jmp', false_block))
+            return jumps
+        return []
+
+    def frame_offset(self, offset):
+        """Return the frame offset of the cell compute_offsets() gave 'offset'."""
+        return self.offsets.get(offset, offset)
+
+    def parallel_move(self, moves):
+        """Copy each source register of the (source, destination) pairs in 'moves' into its destination, as if all at once."""
+        pending = dict((destination, source) for source, destination in moves if source != destination)
+        while pending:
+            # a destination that no other move reads can be written straight away
+            ready = sorted(destination for destination in pending if destination not in pending.values())
+            if not ready:
+                # only cycles are left, so one is broken by saving a destination in the accumulator
+                saved = min(pending)
+                gen_reg_reg('movq', saved, ACC_64, 'save %{} in the accumulator'.format(saved), self.output_file)
+                for destination, source in pending.items():
+                    if source == saved:
+                        pending[destination] = ACC_64
+                continue
+            for destination in ready:
+                gen_reg_reg('movq', pending.pop(destination), destination, 'copy into %{}'.format(destination), self.output_file)
+
+    def register(self, operand):
+        """Return the register a Temp is kept in, or None if it's spilled or 'operand' is a constant."""
+        if isinstance(operand, Temp):
+            return self.registers.get(operand)
+        return None
+
+    def work_register(self, temp):
+        """Return the register to compute the value of 'temp' in: its own, or the accumulator if it's spilled."""
+        return self.registers.get(temp, ACC_64)
+
+    def move(self, operand, register):
+        """Put the value of a Temp or integer constant into a register."""
+        if not isinstance(operand, Temp):
+            gen_immediate_reg('movl', operand, REGISTERS_32[register], 'put the integer {} into %{}'.format(operand, register), self.output_file)
+        elif operand in self.registers:
+            if self.registers[operand] != register:
+                gen_reg_reg('movq', self.registers[operand], register, 'copy {} into %{}'.format(operand, register), self.output_file)
+        else:
+            gen_indirect_reg('movq', self.homes[operand], FP, register, 'put the value of {} into %{}'.format(operand, register), self.output_file)
+
+    def apply(self, mnemonic, operand, register, comment):
+        """Write the 32-bit instruction 'mnemonic', with a Temp or integer constant as its source and 'register' as its destination."""
+        if not isinstance(operand, Temp):
+            gen_immediate_reg(mnemonic, operand, REGISTERS_32[register], comment, self.output_file)
+        elif operand in self.registers:
+            gen_reg_reg(mnemonic, REGISTERS_32[self.registers[operand]], REGISTERS_32[register], comment, self.output_file)
+        else:
+            gen_indirect_reg(mnemonic, self.homes[operand], FP, REGISTERS_32[register], comment, self.output_file)
+
+    def move_integer(self, operand, register):
+        """Put the integer value of a Temp or constant into a register."""
+        if self.register(operand) != register:
+            self.apply('movl', operand, register, 'put the integer {} into %{}'.format(operand, register))
+
+    def store(self, register, temp):
+        """Put the value in a register into a Temp."""
+        if temp not in self.registers:
+            gen_reg_indirect('movq', register, self.homes[temp], FP, 'store the result in {}'.format(temp), self.output_file)
+        elif self.registers[temp] != register:
+            gen_reg_reg('movq', register, self.registers[temp], 'copy the result into {}'.format(temp), self.output_file)
+
+    def memory_operand(self, temp):
+        """Return a spilled Temp's cell, written as an assembly operand."""
+        return '{}(%{})'.format(self.homes[temp], FP)
+
+    def instruction(self, instruction):
+        output_file = self.output_file
+        opcode = instruction.opcode
+        operands = instruction.operands
+        destination = instruction.destination
+
+        if opcode == Opcode.MOVE:
+            source = operands[0]
+            if source is destination:
+                pass
+            elif destination in self.registers:
+                self.move(source, self.registers[destination])
+            elif isinstance(source, Temp) and source in self.registers:
+                self.store(self.registers[source], destination)
+            elif not isinstance(source, Temp) and source >= 0:
+                gen_immediate_indirect('movq', source, self.homes[destination], FP, 'store the integer {} in {}'.format(source, destination), output_file)
+            else:
+                self.move(source, ACC_64)
+                self.store(ACC_64, destination)
+
+        elif opcode in ARITHMETIC_INSTRUCTIONS:
+            left, right = operands
+            if right is destination and left is not destination and opcode in COMMUTATIVE:
+                left, right = right, left
+            register = self.work_register(destination)
+            if right is destination and left is not destination:
+                # computing in the destination's register would overwrite the right side
+                register = ACC_64
+            self.move_integer(left, register)
+            self.apply(ARITHMETIC_INSTRUCTIONS[opcode], right, register, 'compute the {}'.format(Opcode.names[opcode].lower()))
+            self.store(register, destination)
+
+        elif opcode in (Opcode.DIV, Opcode.MOD):
+            self.move_integer(operands[0], ACC_64)
+            gen_no_operands('cltq', 'sign-extend dividend to rax', output_file)
+            gen_no_operands('cqto', 'sign_extend dividend to rdx', output_file)
+            divisor = operands[1]
+            if not isinstance(divisor, Temp):
+                gen_immediate_reg('movl', divisor, ARG4_32, 'put the divisor into %ecx', output_file)
+                gen_reg('idivl', ARG4_32, 'perform the division operation', output_file)
+            elif divisor in self.registers:
+                gen_reg('idivl', REGISTERS_32[self.registers[divisor]], 'perform the division operation', output_file)
+            else:
+                gen_direct('idivl', self.memory_operand(divisor), 'perform the division operation', output_file)
+            # the quotient is in the accumulator, and the remainder in %rdx
+            self.store(ACC_64 if opcode == Opcode.DIV else ARG3_64, destination)
+
+        elif opcode == Opcode.NEG:
+            register = self.work_register(destination)
+            self.move_integer(operands[0], register)
+            gen_reg('negl', REGISTERS_32[register], 'negate the value', output_file)
+            self.store(register, destination)
+
+        elif opcode in CONDITION_CODES:
+            self.compare(operands)
+            register = self.work_register(destination)
+            gen_reg('set' + CONDITION_CODES[opcode], 'al', 'put 1 into %al if the comparison holds, or 0', output_file)
+            gen_reg_reg('movzbl', 'al', REGISTERS_32[register], 'extend the result of the comparison', output_file)
+            self.store(register, destination)
+
+        elif opcode == Opcode.LOAD:
+            address = self.register(operands[0])
+            if address is None:
+                self.move(operands[0], ACC_64)
+                address = ACC_64
+            register = self.work_register(destination)
+            gen_indirect_reg('movq', 0, address, register, 'load the value at the address in %{}'.format(address), output_file)
+            self.store(register, destination)
+
+        elif opcode == Opcode.STORE:
+            address = self.register(operands[0])
+            if address is None:
+                self.move(operands[0], ACC_64)
+                address = ACC_64
+            value = operands[1]
+            if isinstance(value, Temp) and value in self.registers:
+                gen_reg_indirect('movq', self.registers[value], 0, address, 'store {} at the address in %{}'.format(value, address), output_file)
+            elif not isinstance(value, Temp) and value >= 0:
+                gen_immediate_indirect('movq', value, 0, address, 'store the integer {} at the address in %{}'.format(value, address), output_file)
+            else:
+                self.move(value, ARG4_64)
+                gen_reg_indirect('movq', ARG4_64, 0, address, 'store {} at the address in %{}'.format(value, address), output_file)
+
+        elif opcode in (Opcode.GLOBAL, Opcode.STRING):
+            register = self.work_register(destination)
+            gen_immediate_reg('movq', instruction.symbol, register, 'put the address of {} into %{}'.format(instruction.symbol, register), output_file)
+            self.store(register, destination)
+
+        elif opcode == Opcode.LOCAL:
+            register = self.work_register(destination)
+            offset = self.frame_offset(instruction.symbol)
+            gen_indirect_reg('leaq', offset, FP, register, 'put the address of the frame cell at offset {} into %{}'.format(offset, register), output_file)
+            self.store(register, destination)
+
+        elif opcode == Opcode.INDEX:
+            index = operands[1]
+            if isinstance(index, Temp):
+                self.move_integer(index, ARG4_64)
+                gen_immediate_reg('imul', 8, ARG4_32, 'convert the array index to an offset', output_file)
+            register = self.work_register(destination)
+            self.move(operands[0], register)
+            if isinstance(index, Temp):
+                gen_reg_reg('addq', ARG4_64, register, 'add the offset to the address of the first element of the array', output_file)
+            elif index != 0:
+                gen_immediate_reg('addq', 8 * index, register, 'add the offset of element {} to the address of the array'.format(index), output_file)
+            self.store(register, destination)
+
+        elif opcode == Opcode.CALL:
+            # push the arguments after the first six onto the stack in reverse order
+            for operand in reversed(operands[len(ARGUMENT_REGISTERS):]):
+                if isinstance(operand, Temp) and operand in self.registers:
+                    gen_reg('push', self.registers[operand], 'push the function argument onto the stack', output_file)
+                elif isinstance(operand, Temp):
+                    gen_direct('pushq', self.memory_operand(operand), 'push the function argument onto the stack', output_file)
+                elif operand >= 0:
+                    gen_direct('pushq', '${}'.format(operand), 'push the function argument onto the stack', output_file)
+                else:
+                    self.move(operand, ACC_64)
+                    gen_reg('push', ACC_64, 'push the function argument onto the stack', output_file)
+            # then put the first six into their registers, moving the ones in registers first
+            moves = []
+            for operand, register in zip(operands, ARGUMENT_REGISTERS):
+                if self.register(operand) is not None:
+                    moves.append((self.register(operand), register))
+            self.parallel_move(moves)
+            for operand, register in zip(operands, ARGUMENT_REGISTERS):
+                if self.register(operand) is None:
+                    self.move(operand, register)
+            gen_direct('call', instruction.symbol, 'call function {}'.format(instruction.symbol), output_file)
+            if len(operands) > len(ARGUMENT_REGISTERS):
+                gen_immediate_reg('addq', (len(operands) - len(ARGUMENT_REGISTERS)) * 8, SP, 'pop the function arguments off of the stack', output_file)
+            self.store(ACC_64, destination)
+
+        elif opcode == Opcode.READ:
+            self.align_stack()
+            gen_reg_reg('movq', SP, ARG2_64, 'scanf reads the integer into the cell at the top of the stack', output_file)
+            gen_immediate_reg('movq', '.ReadIntString', ARG1_64, 'put .ReadIntString into %rdi', output_file)
+            self.call_library('scanf')
+            gen_indirect_reg('movl', 0, SP, ACC_32, 'move the integer read from stdin into the accumulator', output_file)
+            self.restore_stack()
+            self.store(ACC_64, destination)
+
+        elif opcode == Opcode.WRITE_INT:
+            self.move_integer(operands[0], ARG2_64)
+            gen_immediate_reg('movq', '.WriteIntString', ARG1_64, 'printf integer formatting string = arg1', output_file)
+            self.align_stack()
+            self.call_library('printf')
+            self.restore_stack()
+
+        elif opcode == Opcode.WRITE_STRING:
+            self.move(operands[0], ARG2_64)
+            gen_immediate_reg('movq', '.WriteStringString', ARG1_64, 'printf string formatting string = arg1', output_file)
+            self.align_stack()
+            self.call_library('printf')
+            self.restore_stack()
+
+        elif opcode == Opcode.WRITELN:
+            gen_immediate_reg('movq', '.WritelnString', ARG1_64, 'printf newline string = arg1', output_file)
+            self.align_stack()
+            self.call_library('printf')
+            self.restore_stack()
+
+        elif opcode == Opcode.BRANCH:
+            # the jumps that follow are written by lower()
+            self.compare(operands)
+
+        elif opcode == Opcode.RETURN:
+            if operands:
+                self.move(operands[0], ACC_64)
+            for register, offset in self.saved_registers:
+                gen_indirect_reg('movq', offset, FP, register, 'restore the callee-saved register %{}'.format(register), output_file)
+            gen_immediate_reg('add', self.frame_size, SP, 'deallocate local variables and temporaries', output_file)
+            gen_reg('pop', FP, 'restore the caller\'s frame pointer', output_file)
+            gen_no_operands('ret', 'return from function "{}"'.format(self.function.name), output_file)
+
+    def compare(self, operands):
+        """Compare the integer operands, setting the flags as 'cmpl b, a' would."""
+        left = self.register(operands[0])
+        if left is None:
+            self.move_integer(operands[0], ACC_64)
+            left = ACC_64
+        self.apply('cmpl', operands[1], left, 'compare the two sides of the comparison')
+
+    def align_stack(self):
+        """Align the stack pointer to 16 bytes, as the C library expects, leaving a free cell at the top of the stack.
+
+        The old stack pointer is saved in the cell above it, and %rcx is overwritten.
+        """
+        gen_reg_reg('movq', SP, ARG4_64, 'save the stack pointer in %rcx', self.output_file)
+        gen_immediate_reg('andq', -16, SP, 'align the stack pointer to 16 bytes', self.output_file)
+        gen_immediate_reg('subq', 16, SP, 'make room for a free cell and the old stack pointer', self.output_file)
+        gen_reg_indirect('movq', ARG4_64, 8, SP, 'save the old stack pointer', self.output_file)
+
+    def restore_stack(self):
+        gen_indirect_reg('movq', 8, SP, SP, 'restore the stack pointer align_stack() saved', self.output_file)
+
+    def call_library(self, name):
+        gen_immediate_reg('movl', 0, ACC_32, 'clear the return value', self.output_file)
+        gen_direct('call', name, 'call the C-lib {} function'.format(name), self.output_file)
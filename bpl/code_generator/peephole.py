@@ -0,0 +1,170 @@
+"""
+A peephole optimizer over the instructions the code generator's helpers emit.
+
+A Peephole stands in for an output file. The gen_* helpers hand it
+AssemblyInstructions through emit_instruction(), and anything written to it as text
+(labels and directives) is kept as it is. When it's flushed, each pattern in PATTERNS
+is tried at each instruction in turn, replacing the instructions it matches, until
+none applies anywhere; then the result is written to the file it wraps. How often each
+pattern applied is counted in 'hits'.
+
+A pattern is a function taking the list of instructions and text, and a position in
+it, which holds an instruction it can start with. If the pattern matches there, it
+returns the number of items it matched and the instructions to put in their place;
+otherwise it returns None. Text is never matched, so the patterns stay within
+straight-line code.
+"""
+
+# the 64-bit register each register name is part of
+FAMILIES = {'%al': '%rax', '%cl': '%rcx', '%dl': '%rdx'}
+for name in ('ax', 'bx', 'cx', 'dx', 'si', 'di', 'bp', 'sp'):
+    FAMILIES['%r' + name] = FAMILIES['%e' + name] = '%r' + name
+for number in range(8, 16):
+    FAMILIES['%r{}'.format(number)] = FAMILIES['%r{}d'.format(number)] = '%r{}'.format(number)
+# instructions that write their last operand without reading it, nor setting the flags
+MOVES = frozenset(('movl', 'movq', 'leaq', 'movzbl', 'movzbq', 'movslq'))
+
+class AssemblyInstruction(object):
+    """One instruction: its mnemonic, its operands in AT&T syntax, and its comment."""
+    __slots__ = ('opcode', 'operands', 'comment')
+
+    def __init__(self, opcode, operands, comment):
+        self.opcode = opcode
+        self.operands = operands
+        self.comment = comment
+
+    def __str__(self):
+        if self.operands:
+            return '\t{} {} #{}\n'.format(self.opcode, ', '.join(self.operands), self.comment)
+        return '\t{} #{}\n'.format(self.opcode, self.comment)
+
+class Peephole(object):
+    """Collects the instructions written for a stretch of code, and writes them out optimized when flushed."""
+
+    def __init__(self, output_file, hits=None):
+        """'hits', if given, is a dictionary the number of times each pattern applies is added to."""
+        self.output_file = output_file
+        self.hits = hits if hits is not None else {}
+        self.items = []
+
+    def emit_instruction(self, instruction):
+        self.items.append(instruction)
+
+    def write(self, text):
+        self.items.append(text)
+
+    def flush(self):
+        """Optimize the instructions collected so far, and write them out."""
+        items = self.items
+        self.items = []
+        i = 0
+        while i < len(items):
+            item = items[i]
+            patterns = () if isinstance(item, basestring) else PATTERNS_BY_OPCODE.get(item.opcode, ())
+            for pattern in patterns:
+                match = pattern(items, i)
+                if match is not None:
+                    break
+            else:
+                i += 1
+                continue
+            length, replacement = match
+            items[i:i + length] = replacement
+            name = pattern.__name__
+            self.hits[name] = self.hits.get(name, 0) + 1
+            # the replacement may complete a pattern that starts a little earlier
+            i = max(0, i - 2)
+        write = self.output_file.write
+        for item in items:
+            write(item if isinstance(item, basestring) else str(item))
+
+def instructions_at(items, i, count):
+    """Return the 'count' instructions starting at items[i], or None if there aren't that many before the next text."""
+    window = items[i:i + count]
+    if len(window) < count or any(isinstance(item, basestring) for item in window):
+        return None
+    return window
+
+def register(operand):
+    """Return the 64-bit register an operand names, or None if it's an immediate or in memory."""
+    return FAMILIES.get(operand)
+
+def mentions(operand, family):
+    """Return whether an operand reads or names the 64-bit register 'family', or part of it."""
+    return register(operand) == family or '(' + family + ')' in operand
+
+def reads_flags(item):
+    """Return whether the instruction 'item' reads the flags an instruction before it sets."""
+    if isinstance(item, basestring):
+        return False
+    opcode = item.opcode
+    return (opcode.startswith('j') and opcode != 'jmp') or opcode.startswith('set') or opcode.startswith('cmov')
+
+def zero_stack_adjustment(items, i):
+    """add $0, %rsp or sub $0, %rsp, which functions without local variables begin and end with."""
+    window = instructions_at(items, i, 1)
+    if (window and window[0].opcode in ('add', 'addq', 'sub', 'subq') and window[0].operands == ['$0', '%rsp']
+            and not reads_flags(items[i + 1] if i + 1 < len(items) else '')):
+        return 1, []
+
+def move_back(items, i):
+    """movq a, b followed by movq b, a, whose second move changes nothing."""
+    window = instructions_at(items, i, 2)
+    if window and window[0].opcode == window[1].opcode == 'movq' and window[0].operands == window[1].operands[::-1]:
+        return 2, window[:1]
+
+def overwritten_move(items, i):
+    """A move into a register that the next instruction overwrites without reading it."""
+    window = instructions_at(items, i, 2)
+    if not window or window[0].opcode not in MOVES or window[1].opcode not in MOVES:
+        return None
+    family = register(window[0].operands[-1])
+    if family is None or register(window[1].operands[-1]) != family:
+        return None
+    if any(mentions(operand, family) for operand in window[1].operands[:-1]):
+        return None
+    return 2, window[1:]
+
+def adjust_push(items, i):
+    """addq $8, %rsp followed by a push, which overwrites the cell that was popped."""
+    window = instructions_at(items, i, 2)
+    if (window and window[0].opcode in ('add', 'addq') and window[0].operands == ['$8', '%rsp']
+            and window[1].opcode in ('push', 'pushq') and '(' not in window[1].operands[0]
+            and window[1].operands[0] != '%rsp'):
+        return 2, [AssemblyInstruction('movq', [window[1].operands[0], '0(%rsp)'], window[1].comment)]
+
+def address_fold(items, i):
+    """movq %r, %t, addq $k, %t, movq 0(%t), %t: a load from k(%r)."""
+    window = instructions_at(items, i, 3)
+    if (not window or window[0].opcode != 'movq' or window[1].opcode not in ('add', 'addq')
+            or window[2].opcode != 'movq'):
+        return None
+    base, temp = window[0].operands
+    if (register(base) is None or register(temp) is None or base == temp or not window[1].operands[0].startswith('$')
+            or window[1].operands[1] != temp or window[2].operands != ['0({})'.format(temp), temp]):
+        return None
+    if i + 3 < len(items) and reads_flags(items[i + 3]):
+        return None
+    offset = window[1].operands[0][1:]
+    return 3, [AssemblyInstruction('movq', ['{}({})'.format(offset, base), temp], window[2].comment)]
+
+def unreachable(items, i):
+    """An instruction after a ret or jmp, before the next label."""
+    window = instructions_at(items, i, 2)
+    if window and window[0].opcode in ('ret', 'jmp'):
+        return 2, window[:1]
+
+# the patterns, each with the mnemonics of the instructions it can start with
+PATTERNS = [
+    (zero_stack_adjustment, ('add', 'addq', 'sub', 'subq')),
+    (move_back, ('movq',)),
+    (overwritten_move, MOVES),
+    (adjust_push, ('add', 'addq')),
+    (address_fold, ('movq',)),
+    (unreachable, ('ret', 'jmp')),
+]
+# the patterns to try at an instruction with each mnemonic, in the order PATTERNS lists them
+PATTERNS_BY_OPCODE = {}
+for pattern, opcodes in PATTERNS:
+    for opcode in opcodes:
+        PATTERNS_BY_OPCODE.setdefault(opcode, []).append(pattern)
@@ -0,0 +1,153 @@
+"""
+Linear-scan register allocation for lowering IR Functions.
+
+The instructions of a function are numbered in the order its blocks are laid out, and
+each Temp gets a live interval, from the first to the last position where it's live.
+The intervals are then scanned in order of their starts, each one getting a register
+that no interval overlapping it holds. When there's none left, whichever of the
+interval and the ones holding suitable registers ends last is spilled, and lives in
+a frame cell instead. The accumulator, %rcx, and %rdx are left free for the
+lowering to compute in, and %rbx and %rsp hold the frame and stack pointers.
+
+A call (including a call into the C library) overwrites the caller-saved registers,
+so an interval that spans one can only have a callee-saved register, which the
+function saves on entry and restores before it returns. An interval that doesn't
+span a call is given a caller-saved register if one is free, since those don't have
+to be saved. A parameter, or an argument of a call, is given the register it's passed
+in when that's free, so it needn't be moved.
+"""
+
+import bisect
+from bpl.code_generator.code_generator import ARG1_64, ARG2_64, ARG3_64, ARG4_64, ARG5_64, ARG6_64
+from bpl.ir.ir import Opcode, Temp
+from bpl.ir.liveness import live_temps
+
+CALLER_SAVED = ('rsi', 'rdi', 'r8', 'r9', 'r10', 'r11')
+CALLEE_SAVED = ('r12', 'r13', 'r14', 'r15', 'rbp')
+# the registers the first six arguments of a call are passed in
+ARGUMENT_REGISTERS = (ARG1_64, ARG2_64, ARG3_64, ARG4_64, ARG5_64, ARG6_64)
+# the 32-bit halves of the registers, for integer arithmetic
+REGISTERS_32 = {
+    'rax': 'eax', 'rbx': 'ebx', 'rcx': 'ecx', 'rdx': 'edx', 'rsi': 'esi', 'rdi': 'edi', 'rbp': 'ebp', 'rsp': 'esp',
+}
+for number in range(8, 16):
+    REGISTERS_32['r{}'.format(number)] = 'r{}d'.format(number)
+
+# instructions that call a function, overwriting the caller-saved registers
+CALLS = frozenset((Opcode.CALL, Opcode.READ, Opcode.WRITE_INT, Opcode.WRITE_STRING, Opcode.WRITELN))
+
+class Interval(object):
+    """The positions from 'start' to 'end' where 'temp' is live, and the register it's given, if any."""
+    __slots__ = ('temp', 'start', 'end', 'register', 'spans_call')
+
+    def __init__(self, temp, position):
+        self.temp = temp
+        self.start = position
+        self.end = position
+        self.register = None
+        self.spans_call = False
+
+def live_intervals(function):
+    """Return the live intervals of the Temps of 'function', sorted by their starts.
+
+    Position 0 stands for the function's entry, where its parameters are assigned, and
+    its instructions are numbered from 1, block by block.
+    """
+    live_in, live_out = live_temps(function)
+    intervals = {}
+    def extend(temp, position):
+        interval = intervals.get(temp)
+        if interval is None:
+            intervals[temp] = Interval(temp, position)
+        elif position < interval.start:
+            interval.start = position
+        elif position > interval.end:
+            interval.end = position
+
+    calls = []
+    position = 1
+    for block in function.blocks:
+        start = position
+        end = position + len(block.instructions) - 1
+        position = end + 1
+        for temp in live_out[block]:
+            extend(temp, end)
+        for offset in range(len(block.instructions) - 1, -1, -1):
+            instruction = block.instructions[offset]
+            if instruction.opcode in CALLS:
+                calls.append(start + offset)
+            if instruction.destination is not None:
+                extend(instruction.destination, start + offset)
+            for temp in instruction.uses():
+                extend(temp, start + offset)
+        for temp in live_in[block]:
+            extend(temp, start)
+    for variable in function.variables.itervalues():
+        # a parameter, whose offset is positive, is assigned on entry
+        if variable in intervals and variable.declaration.offset > 0:
+            extend(variable, 0)
+
+    calls.sort()
+    for interval in intervals.itervalues():
+        # whether a call comes strictly between the interval's start and end
+        i = bisect.bisect_right(calls, interval.start)
+        interval.spans_call = i < len(calls) and calls[i] < interval.end
+    return sorted(intervals.itervalues(), key=lambda interval: (interval.start, interval.temp.number))
+
+def argument_hints(function):
+    """Return a dictionary of the register each Temp of 'function' would best be kept in, if it's passed in one."""
+    hints = {}
+    param = function.declaration.params
+    for register in ARGUMENT_REGISTERS:
+        if param is None:
+            break
+        variable = function.variables.get(param)
+        if variable is not None:
+            hints[variable] = register
+        param = param.next_node
+    for instruction in function.instructions():
+        if instruction.opcode == Opcode.CALL:
+            for operand, register in zip(instruction.operands, ARGUMENT_REGISTERS):
+                if isinstance(operand, Temp):
+                    hints.setdefault(operand, register)
+    return hints
+
+def allocate_registers(function):
+    """Return a dictionary of the register each Temp of 'function' is kept in; Temps that aren't in it are spilled."""
+    free = set(CALLER_SAVED + CALLEE_SAVED)
+    hints = argument_hints(function)
+    # the intervals holding registers, by their ends
+    active = []
+    registers = {}
+    for interval in live_intervals(function):
+        # free the registers of the intervals that are over
+        while active and active[0].end < interval.start:
+            free.add(active.pop(0).register)
+
+        choices = CALLEE_SAVED if interval.spans_call else CALLER_SAVED + CALLEE_SAVED
+        register = hints.get(interval.temp)
+        if register not in choices or register not in free:
+            register = next((choice for choice in choices if choice in free), None)
+        if register is None:
+            # spill whichever interval holding a suitable register ends last, if it ends after this one
+            candidates = [other for other in active if other.register in choices]
+            victim = max(candidates, key=lambda other: other.end) if candidates else None
+            if victim is None or victim.end <= interval.end:
+                continue
+            register = victim.register
+            victim.register = None
+            del registers[victim.temp]
+            active.remove(victim)
+        else:
+            free.remove(register)
+        interval.register = register
+        registers[interval.temp] = register
+        insert_by_end(active, interval)
+    return registers
+
+def insert_by_end(active, interval):
+    """Insert 'interval' into the list 'active', which is sorted by the intervals' ends."""
+    i = len(active)
+    while i > 0 and active[i - 1].end > interval.end:
+        i -= 1
+    active.insert(i, interval)
@@ -1,10 +1,221 @@
-from bpl.code_generator.code_generator import generate_code
-from bpl.scanner.scanner import ScannerException
+from StringIO import StringIO
+import cStringIO
+import multiprocessing
+from bpl.code_generator.c_generator import generate_c
+from bpl.code_generator.code_generator import generate_code, generate_code_sections, compute_offsets, \
+        build_string_table, gen_code_function, gen_global, gen_rodata, gen_text_header, label_scope
+from bpl.code_generator.lowering import lower, lower_sections
+from bpl.incremental import SignatureTable, split_declarations, fingerprint, compile_declarations
+from bpl.ir.ir import build_ir
+from bpl.ir.passes import optimize
+from bpl.parallel import parse_parallel, check_and_generate
+from bpl.scanner.scanner import ScannerException, Scanner, BufferScanner
+from bpl.scanner.token import TokenType
 from bpl.parser.parser import ParserException, Parser
-from bpl.type_checker.type_checker import TypeCheckerException, type_check
+from bpl.parser.arena import ASTArena
+from bpl.parser.parsetree import NodeType
+from bpl.type_checker.type_checker import TypeCheckerException, type_check, find_references, \
+        type_check_declarations
 
-def compile(input_file, assembly_file): 
-    parser = Parser(input_file)
+def compile(input_file, assembly_file, scanner_class=Scanner, cache=None, optimization_level=0, peephole_hits=None):
+    """Compile the program in input_file, writing its assembly code to assembly_file.
+
+    At optimization level 0, the code generator works straight from the parse tree. At
+    higher levels, the program is turned into IR, which the passes of that level's
+    pipeline optimize before it's lowered into assembly code. Either way, the code of
+    each function is run through the peephole optimizer, and the number of times each
+    peephole pattern applies is added to the dictionary 'peephole_hits', if it's given.
+
+    If 'cache' (a CompilationCache) is given and already holds the program's source,
+    its cached assembly is written without scanning, parsing, or type checking it.
+    Otherwise the program is compiled and the result is added to the cache.
+    """
+    if cache is None:
+        parser = Parser(input_file, scanner_class)
+        parse_tree = parser.parse()
+        type_check(parse_tree)
+        # number labels from 0 for every program, whatever this thread compiled before
+        with label_scope():
+            if optimization_level:
+                lower(optimize(build_ir(parse_tree), optimization_level), assembly_file, peephole_hits)
+            else:
+                generate_code(parse_tree, assembly_file, peephole_hits)
+        return
+
+    source = input_file.read()
+    key = cache.key(source, optimization_level)
+    assembly = cache.load_assembly(key)
+    if assembly is not None:
+        assembly_file.write(assembly)
+        return
+
+    parser = Parser(StringIO(source), scanner_class)
+    parse_tree = parser.parse()
+    type_check(parse_tree)
+    with label_scope():
+        if optimization_level:
+            header, functions = lower_sections(optimize(build_ir(parse_tree), optimization_level), peephole_hits)
+        else:
+            header, functions = generate_code_sections(parse_tree, peephole_hits)
+    assembly_file.write(header)
+    for name, code in functions:
+        assembly_file.write(code)
+    cache.store(key, ASTArena.from_tree(parse_tree), header, functions)
+
+def compile_c(input_file, c_file, scanner_class=Scanner):
+    """Compile the program in input_file into C, writing the C source code to c_file."""
+    parser = Parser(input_file, scanner_class)
     parse_tree = parser.parse()
     type_check(parse_tree)
-    generate_code(parse_tree, assembly_file)
+    generate_c(parse_tree, c_file)
+
+def compile_streaming(input_file, assembly_file, scanner_class=Scanner):
+    """Compile one top-level declaration at a time, so that memory use is bounded by the largest function rather than the whole program.
+
+    Each declaration is parsed, linked against the global declarations seen so far,
+    type checked, and (if it's a function) turned into assembly before the next one is
+    parsed. A function's body is dropped once its code has been generated; only its
+    signature is kept, for type checking later calls. Global variables and string
+    literals are emitted in trailing sections. input_file only needs to support
+    readline() (or read(), depending on scanner_class), so it can be a pipe or stdin.
+
+    Since each declaration is checked before the next one is parsed, a program with
+    several errors may have a different one reported first than with compile().
+    """
+    parser = Parser(input_file, scanner_class)
+    symbol_table = [{}]
+    string_table = {}
+    global_declarations = []
+    gen_text_header(assembly_file)
+
+    with label_scope():
+        while True:
+            declaration = parser.declaration()
+            find_references(declaration, symbol_table, False)
+            type_check_declarations(declaration, False)
+            if declaration.kind == NodeType.FUN_DEC:
+                compute_offsets(declaration)
+                # keep the labels of strings that earlier functions already use
+                for string, label in build_string_table(declaration.body).iteritems():
+                    string_table.setdefault(string, label)
+                gen_code_function(declaration, string_table, assembly_file)
+                declaration.body = None
+            else:
+                global_declarations.append(declaration)
+            if parser.scanner.next_token.kind == TokenType.T_EOF:
+                break
+
+    for declaration in global_declarations:
+        gen_global(declaration, assembly_file)
+    gen_rodata(string_table, assembly_file)
+
+def compile_incremental(input_file, assembly_file, cache, name):
+    """Compile the program in input_file, reusing the code of declarations that haven't changed since the last time.
+
+    'cache' is a CompilationCache, which holds the Units compiled for the last version
+    of the source file called 'name'. Each top-level declaration whose text is unchanged
+    reuses its Unit, unless a global it refers to now has a different signature; the
+    rest are parsed, type checked, and generated again. Every function's labels are
+    scoped to it and it carries its own string constants, so the assembly is the same as
+    if the whole program had just been compiled incrementally from scratch.
+
+    As with compile_streaming(), declarations are checked in order, so a program with
+    several errors may have a different one reported first than with compile().
+    """
+    source = input_file.read()
+    previous_units = cache.load_units(name)
+    units = {}
+    symbol_table = [SignatureTable()]
+    visible = {}
+    global_code = []
+    function_code = []
+
+    spans = split_declarations(source)
+    if not spans:
+        # a program without declarations gets the parser's error, as it would from compile()
+        Parser(StringIO(source), BufferScanner).parse()
+    for start, stop, line_number in spans:
+        key = fingerprint(source, start, stop)
+        span_units = previous_units.get(key)
+        if span_units is not None:
+            # reuse the span's units only if each one's globals still have the same signatures
+            for i, unit in enumerate(span_units):
+                if not unit.reusable(visible, span_units[:i]):
+                    span_units = None
+                    break
+        if span_units is None:
+            span_units = compile_declarations(source, start, stop, line_number, symbol_table)
+        else:
+            for unit in span_units:
+                symbol_table[0][unit.name] = unit
+        for unit in span_units:
+            visible[unit.name] = unit.signature
+            if unit.kind == NodeType.FUN_DEC:
+                function_code.append(unit.code)
+            else:
+                global_code.append(unit.code)
+        units[key] = span_units
+
+    cache.store_units(name, units)
+    assembly_file.write(''.join(global_code))
+    gen_rodata({}, assembly_file)
+    gen_text_header(assembly_file)
+    assembly_file.write(''.join(function_code))
+
+def compile_parallel(input_file, assembly_file, jobs, scanner_class=Scanner):
+    """Compile the program in input_file, parsing, type checking, and generating its declarations in 'jobs' processes.
+
+    The declarations are parsed in runs by a pool of workers, then each run is linked to
+    the declarations before it, type checked, and generated by another pool, each
+    function with its own labels and string constants. The assembly is the same for any
+    number of jobs above one. No more jobs are used than there are CPUs, and with a
+    single job there's nothing to spread, so the program is compiled by compile().
+    """
+    jobs = min(jobs, multiprocessing.cpu_count())
+    if jobs <= 1:
+        compile(input_file, assembly_file, scanner_class)
+        return
+    check_and_generate(parse_parallel(input_file.read(), jobs, scanner_class), assembly_file, jobs)
+
+def source_bytes(source):
+    """Return the source code 'source', which may be a str, bytearray, memoryview, or unicode string, as a str."""
+    if isinstance(source, memoryview):
+        return source.tobytes()
+    elif isinstance(source, unicode):
+        return source.encode('utf-8')
+    return str(source)
+
+class CompilerSession(object):
+    """Compiles programs held in memory, without touching the filesystem.
+
+    A session holds the options its programs are compiled with, including the
+    optimization level. Everything a compilation
+    changes (its parse tree, its symbol and string tables, and its label counters)
+    belongs to that one call, so every program gets the same assembly bplc would write
+    for it, and one session can be used by many threads at once.
+    """
+
+    def __init__(self, scanner_class=Scanner, cache=None, optimization_level=0):
+        """Compile programs with 'scanner_class' at 'optimization_level', reusing results from 'cache' (a CompilationCache) if one is given."""
+        self.scanner_class = scanner_class
+        self.cache = cache
+        self.optimization_level = optimization_level
+
+    def compile(self, source, output=None):
+        """Compile the BPL program 'source', which may be a str, bytearray, memoryview, or unicode string.
+
+        If 'output' is None, return the assembly code as a string. Otherwise write it to
+        'output', which may be a bytearray or any object with a write() method, and
+        return 'output'. Errors are raised as ScannerException, ParserException, or
+        TypeCheckerException.
+        """
+        assembly_file = cStringIO.StringIO()
+        compile(cStringIO.StringIO(source_bytes(source)), assembly_file, self.scanner_class, self.cache,
+                self.optimization_level)
+        if output is None:
+            return assembly_file.getvalue()
+        if isinstance(output, bytearray):
+            output.extend(assembly_file.getvalue())
+        else:
+            output.write(assembly_file.getvalue())
+        return output
@@ -0,0 +1,166 @@
+"""
+Incremental compilation of BPL programs, one top-level declaration at a time.
+
+split_declarations() finds the text of each top-level declaration without parsing
+it, and each one is fingerprinted by a hash of that text. A declaration is compiled
+into a Unit: its assembly code (with labels that don't depend on any other
+function), its signature, and the signatures of the global declarations it refers
+to. When a program is recompiled, the Unit of an unchanged declaration is reused as
+long as every global it refers to still has the same signature where it's used, so
+only edited declarations and the users of edited signatures are parsed, type
+checked, and generated again.
+"""
+
+import hashlib, re
+from StringIO import StringIO
+from bpl.code_generator.code_generator import compute_offsets_function, gen_scoped_function, gen_global
+from bpl.parser.arena import ASTArena, FIELDS, CHILD, LIST
+from bpl.parser.parser import Parser
+from bpl.parser.parsetree import NodeType
+from bpl.scanner.token import TokenType
+from bpl.scanner.token_stream import TokenStream, StreamScanner, trailing_pattern
+from bpl.type_checker.type_checker import find_references, type_check_declarations
+
+# the lexemes that decide where a top-level declaration ends: braces and semicolons,
+# and the strings and comments that may contain them
+boundary_pattern = re.compile(r'"[^"\n]*"|/\*[^*]*\*+(?:[^*/][^*]*\*+)*/|[{};]')
+
+def split_declarations(source):
+    """Return the (start, stop, line number of start) of each top-level declaration in 'source'.
+
+    A declaration ends at a semicolon or closing brace outside of any braces, and the
+    next one starts right after it. Any text other than whitespace and comments after
+    the last declaration becomes a final span of its own, so that the parser reports
+    it just as it would in the whole file.
+    """
+    spans = []
+    depth = 0
+    start = 0
+    line_number = 1
+    for m in boundary_pattern.finditer(source):
+        lexeme = m.group()
+        if lexeme == '{':
+            depth += 1
+            continue
+        elif lexeme == '}':
+            depth = max(depth - 1, 0)
+        elif lexeme != ';' or depth > 0:
+            continue
+        if depth == 0:
+            stop = m.end()
+            spans.append((start, stop, line_number))
+            line_number += source.count('\n', start, stop)
+            start = stop
+    if trailing_pattern.match(source, start) is None:
+        spans.append((start, len(source), line_number))
+    return spans
+
+def fingerprint(source, start, stop):
+    """Return the fingerprint of the declaration in source[start:stop]."""
+    return hashlib.sha1(source[start:stop].strip()).hexdigest()
+
+def signature(declaration):
+    """Return a string describing everything about 'declaration' that code using it depends on."""
+    fields = [declaration.kind, declaration.type_token.kind, declaration.name]
+    if declaration.kind is NodeType.FUN_DEC:
+        param = declaration.params
+        while param is not None:
+            fields.append('({})'.format(signature(param)))
+            param = param.next_node
+    else:
+        fields.append(declaration.is_pointer)
+        if declaration.kind is NodeType.ARRAY_DEC:
+            fields.append(declaration.size)
+    return ' '.join(str(field) for field in fields)
+
+def global_references(declaration, top_level):
+    """Return the set of names of the top-level declarations that the body of 'declaration' refers to.
+
+    'top_level' maps names to the top-level declarations that references were linked
+    to by find_references().
+    """
+    names = set()
+    if declaration.kind is not NodeType.FUN_DEC:
+        return names
+    stack = [declaration.body]
+    while stack:
+        node = stack.pop()
+        while node is not None:
+            if node.kind in (NodeType.VAR_EXP, NodeType.ARRAY_EXP, NodeType.FUN_CALL_EXP):
+                if node.declaration is dict.get(top_level, node.name):
+                    names.add(node.name)
+            for field in FIELDS[node.kind]:
+                if field[1] is CHILD or field[1] is LIST:
+                    stack.append(getattr(node, field[0]))
+            node = node.next_node
+    names.discard(declaration.name)
+    return names
+
+class Unit(object):
+    """The compiled form of one top-level declaration."""
+    __slots__ = ('name', 'kind', 'signature', 'declaration_bytes', 'code', 'dependencies')
+
+    def __init__(self, declaration, code, dependencies):
+        """Record the code generated for 'declaration' and the (name, signature) pairs of the globals it uses."""
+        self.name = declaration.name
+        self.kind = declaration.kind
+        self.signature = signature(declaration)
+        # keep only the declaration's signature, not a function's body
+        body = getattr(declaration, 'body', None)
+        if body is not None:
+            declaration.body = None
+        self.declaration_bytes = ASTArena.from_tree(declaration).to_bytes()
+        if body is not None:
+            declaration.body = body
+        self.code = code
+        self.dependencies = tuple(dependencies)
+
+    def reusable(self, visible, preceding=()):
+        """Return whether each global this unit uses still has the same signature.
+
+        'visible' maps the names of the globals declared before this unit's span to their
+        signatures, and 'preceding' lists the Units declared before it in its own span.
+        """
+        for name, dependency in self.dependencies:
+            current = visible.get(name)
+            for unit in preceding:
+                if unit.name == name:
+                    current = unit.signature
+            if current != dependency:
+                return False
+        return True
+
+    def declaration(self):
+        """Return a declaration node for this unit, without a function body."""
+        return ASTArena.from_bytes(self.declaration_bytes).to_tree()
+
+class SignatureTable(dict):
+    """A top-level symbol table that may hold Units, whose declarations are only rebuilt if they're looked up."""
+
+    def __getitem__(self, name):
+        value = dict.__getitem__(self, name)
+        if isinstance(value, Unit):
+            value = value.declaration()
+            dict.__setitem__(self, name, value)
+        return value
+
+def compile_declarations(source, start, stop, line_number, symbol_table):
+    """Parse, type check, and generate code for the declarations in source[start:stop], returning a Unit for each one."""
+    stream = TokenStream(source, start, stop, line_number)
+    parser = Parser.from_scanner(StreamScanner.from_stream(stream))
+    units = []
+    while parser.scanner.next_token.kind != TokenType.T_EOF:
+        declaration = parser.declaration()
+        find_references(declaration, symbol_table, False)
+        type_check_declarations(declaration, False)
+        code = StringIO()
+        if declaration.kind is NodeType.FUN_DEC:
+            compute_offsets_function(declaration)
+            gen_scoped_function(declaration, code)
+        else:
+            gen_global(declaration, code)
+        top_level = symbol_table[0]
+        dependencies = [(name, signature(top_level[name])) for name in
+                sorted(global_references(declaration, top_level))]
+        units.append(Unit(declaration, code.getvalue(), dependencies))
+    return units
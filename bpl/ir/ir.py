@@ -0,0 +1,454 @@
+"""
+An intermediate representation of type-checked programs, which the optimizer works on.
+
+Each function is turned into three-address code: a list of basic blocks, each a run of
+instructions that ends with a jump, a branch, or a return, and the function's control
+flow graph is kept in the blocks' successors and predecessors. An instruction assigns
+at most one Temp, computing it from Temps and integer constants. A local variable or
+parameter whose address is never taken is a Temp too, which any number of instructions
+may assign; every other variable lives in memory, and is read and written through its
+address. Frames are laid out by compute_offsets(), as for the code generator, and the
+string constants are labelled by build_string_table(), so the IR can be lowered into
+code with the same globals and frame cells as the code generator's. Everything is evaluated in the
+order the code generator evaluates it: the left side of an operator first, and a
+call's arguments from last to first.
+"""
+
+from bpl.code_generator.code_generator import build_string_table, compute_offsets
+from bpl.parser.parsetree import NodeType
+from bpl.scanner.token import TokenType, enum
+
+# Operands are described after the colon; 'a' and 'b' are Temps or integer constants.
+Opcode = enum('MOVE',           # d = a
+        'ADD',                  # d = a + b, and so on, wrapping around at 32 bits
+        'SUB',
+        'MUL',
+        'DIV',                  # d = a / b, rounded towards zero
+        'MOD',
+        'NEG',                  # d = -a
+        'LESS',                 # d = 1 if a < b, or 0, and so on
+        'LEQ',
+        'EQ',
+        'NEQ',
+        'GEQ',
+        'GREATER',
+        'LOAD',                 # d = the word at address a
+        'STORE',                # store b at address a
+        'GLOBAL',               # d = the address of the global variable or array named 'symbol'
+        'LOCAL',                # d = the address of the frame cell at offset 'symbol'
+        'STRING',               # d = the address of the string constant labelled 'symbol'
+        'INDEX',                # d = the address of element b of the array at address a
+        'CALL',                 # d = the value the function 'symbol' returns, called with the operands
+        'READ',                 # d = an integer read from standard input
+        'WRITE_INT',            # write the integer a
+        'WRITE_STRING',         # write the string at address a
+        'WRITELN',              # write a newline
+        'JUMP',                 # go to the target
+        'BRANCH',               # go to the first target if a 'symbol' b holds, or to the second
+        'RETURN',               # return a, or nothing if there are no operands
+)
+TERMINATORS = frozenset((Opcode.JUMP, Opcode.BRANCH, Opcode.RETURN))
+# instructions that do more than compute their destination, so they have to stay where they are
+SIDE_EFFECTS = frozenset((Opcode.STORE, Opcode.CALL, Opcode.READ, Opcode.WRITE_INT, Opcode.WRITE_STRING,
+        Opcode.WRITELN)) | TERMINATORS
+
+COMPARISONS = {
+    TokenType.T_LESS: Opcode.LESS,
+    TokenType.T_LEQ: Opcode.LEQ,
+    TokenType.T_EQ: Opcode.EQ,
+    TokenType.T_NEQ: Opcode.NEQ,
+    TokenType.T_GEQ: Opcode.GEQ,
+    TokenType.T_GREATER: Opcode.GREATER,
+}
+ARITHMETIC = {
+    TokenType.T_PLUS: Opcode.ADD,
+    TokenType.T_MINUS: Opcode.SUB,
+    TokenType.T_MULT: Opcode.MUL,
+    TokenType.T_DIV: Opcode.DIV,
+    TokenType.T_MOD: Opcode.MOD,
+}
+# the comparison that holds exactly when each one doesn't
+NEGATED = {
+    Opcode.LESS: Opcode.GEQ,
+    Opcode.LEQ: Opcode.GREATER,
+    Opcode.EQ: Opcode.NEQ,
+    Opcode.NEQ: Opcode.EQ,
+    Opcode.GEQ: Opcode.LESS,
+    Opcode.GREATER: Opcode.LEQ,
+}
+
+def wrap(number):
+    """Return 'number' wrapped around to a signed 32-bit integer."""
+    return ((number + 0x80000000) & 0xffffffff) - 0x80000000
+
+class Temp(object):
+    """A value computed by the function, or one of its variables if 'declaration' is set."""
+    __slots__ = ('number', 'name', 'declaration')
+
+    def __init__(self, number, name, declaration=None):
+        self.number = number
+        self.name = name
+        self.declaration = declaration
+
+    def __str__(self):
+        return '%' + self.name
+
+class Instruction(object):
+    """One instruction: its opcode, the Temp it assigns (or None), and its operands.
+
+    'operands' holds the Temps and integer constants the instruction reads. 'symbol'
+    holds anything else it needs: the function CALL calls, the global variable GLOBAL
+    and the string label STRING stand for, the frame offset LOCAL adds to the frame
+    pointer, or the comparison BRANCH makes. 'targets' holds the blocks JUMP and BRANCH
+    go to.
+    """
+    __slots__ = ('opcode', 'destination', 'operands', 'symbol', 'targets')
+
+    def __init__(self, opcode, destination=None, operands=(), symbol=None, targets=()):
+        self.opcode = opcode
+        self.destination = destination
+        self.operands = list(operands)
+        self.symbol = symbol
+        self.targets = list(targets)
+
+    def uses(self):
+        """Return the Temps the instruction reads."""
+        return [operand for operand in self.operands if isinstance(operand, Temp)]
+
+    def __str__(self):
+        text = Opcode.names[self.opcode].lower()
+        if self.destination is not None:
+            text = '{} = {}'.format(self.destination, text)
+        fields = []
+        if self.opcode == Opcode.BRANCH:
+            text += ' ' + Opcode.names[self.symbol].lower()
+        elif self.symbol is not None:
+            fields.append(str(self.symbol))
+        fields.extend(str(operand) for operand in self.operands)
+        fields.extend('L{}'.format(target.number) for target in self.targets)
+        if self.opcode == Opcode.CALL:
+            return '{} {}({})'.format(text, fields[0], ', '.join(fields[1:]))
+        return '{} {}'.format(text, ', '.join(fields)) if fields else text
+
+class BasicBlock(object):
+    """A run of instructions that control only enters at the top, and leaves at the bottom."""
+    __slots__ = ('number', 'instructions', 'successors', 'predecessors')
+
+    def __init__(self, number):
+        self.number = number
+        self.instructions = []
+        self.successors = []
+        self.predecessors = []
+
+    @property
+    def terminator(self):
+        """The jump, branch, or return that ends the block, or None while it's being built."""
+        if self.instructions and self.instructions[-1].opcode in TERMINATORS:
+            return self.instructions[-1]
+        return None
+
+    def __str__(self):
+        lines = ['L{}:'.format(self.number)]
+        lines.extend('\t{}'.format(instruction) for instruction in self.instructions)
+        return '\n'.join(lines)
+
+class Function(object):
+    """The IR of one function: its blocks, the first of which is its entry, and its Temps."""
+
+    def __init__(self, declaration):
+        self.name = declaration.name
+        self.declaration = declaration
+        self.blocks = []
+        # the Temp each promoted variable or parameter is kept in
+        self.variables = {}
+        self.temp_count = 0
+        self.block_count = 0
+
+    def new_temp(self):
+        self.temp_count += 1
+        return Temp(self.temp_count, str(self.temp_count))
+
+    def new_variable(self, declaration):
+        """Return a new Temp for the variable or parameter 'declaration'."""
+        self.temp_count += 1
+        name = declaration.name
+        # variables in different blocks can have the same name
+        if any(variable.declaration.name == name for variable in self.variables.itervalues()):
+            name = '{}.{}'.format(name, self.temp_count)
+        variable = Temp(self.temp_count, name, declaration)
+        self.variables[declaration] = variable
+        return variable
+
+    def new_block(self):
+        block = BasicBlock(self.block_count)
+        self.block_count += 1
+        self.blocks.append(block)
+        return block
+
+    def update_cfg(self):
+        """Work out every block's successors and predecessors again, from its terminator."""
+        for block in self.blocks:
+            block.predecessors = []
+        for block in self.blocks:
+            terminator = block.terminator
+            block.successors = []
+            for target in (terminator.targets if terminator is not None else ()):
+                if target not in block.successors:
+                    block.successors.append(target)
+                    target.predecessors.append(block)
+
+    def instructions(self):
+        """Yield every instruction, block by block."""
+        for block in self.blocks:
+            for instruction in block.instructions:
+                yield instruction
+
+    def __str__(self):
+        parameters = []
+        param = self.declaration.params
+        while param is not None:
+            variable = self.variables.get(param)
+            parameters.append(str(variable) if variable is not None else '[{}]'.format(param.name))
+            param = param.next_node
+        lines = ['function {}({}):'.format(self.name, ', '.join(parameters))]
+        lines.extend(str(block) for block in self.blocks)
+        return '\n'.join(lines)
+
+class Program(object):
+    """The IR of a whole program: its functions, in program order, and what their code needs besides."""
+
+    def __init__(self, tree, functions, string_table):
+        """'tree' is the type-checked parse tree, whose global variables the program uses, and 'string_table' labels its string constants."""
+        self.tree = tree
+        self.functions = functions
+        self.string_table = string_table
+        # the declarations of the global variables and arrays to allocate
+        self.globals = []
+        declaration = tree
+        while declaration is not None:
+            if declaration.kind in (NodeType.VAR_DEC, NodeType.ARRAY_DEC):
+                self.globals.append(declaration)
+            declaration = declaration.next_node
+
+    def __str__(self):
+        return '\n\n'.join(str(function) for function in self.functions) + '\n'
+
+def build_ir(type_checked_parse_tree):
+    """Return the Program a type-checked parse tree compiles to."""
+    compute_offsets(type_checked_parse_tree)
+    string_table = {}
+    declaration = type_checked_parse_tree
+    while declaration is not None:
+        if declaration.kind == NodeType.FUN_DEC:
+            string_table.update(build_string_table(declaration.body))
+        declaration = declaration.next_node
+
+    functions = []
+    declaration = type_checked_parse_tree
+    while declaration is not None:
+        if declaration.kind == NodeType.FUN_DEC:
+            functions.append(FunctionBuilder(declaration, string_table).build())
+        declaration = declaration.next_node
+    return Program(type_checked_parse_tree, functions, string_table)
+
+def find_addressed(node, addressed):
+    """Add the declarations of the variables whose addresses are taken in 'node', and the nodes after it, to the set 'addressed'."""
+    while node is not None:
+        if node.kind == NodeType.ADDRESS_EXP and node.expression.kind == NodeType.VAR_EXP:
+            addressed.add(node.expression.declaration)
+        for field in ('statements', 'statement', 'else_statement', 'condition', 'expression', 'left', 'right',
+                'arguments'):
+            child = getattr(node, field, None)
+            if child is not None:
+                find_addressed(child, addressed)
+        node = node.next_node
+
+class FunctionBuilder(object):
+    """Builds the IR of one function from its declaration."""
+
+    def __init__(self, declaration, string_table):
+        self.function = Function(declaration)
+        self.string_table = string_table
+        self.addressed = set()
+        find_addressed(declaration.body, self.addressed)
+        self.block = self.function.new_block()
+
+    def build(self):
+        param = self.function.declaration.params
+        while param is not None:
+            self.variable(param)
+            param = param.next_node
+        self.statement(self.function.declaration.body)
+        # a function that ends without a return statement returns whatever is in the accumulator
+        self.emit(Opcode.RETURN)
+        self.function.update_cfg()
+        return self.function
+
+    def variable(self, declaration):
+        """Return the Temp a local variable or parameter is kept in, or None if it has to live in memory."""
+        variable = self.function.variables.get(declaration)
+        if variable is None and declaration.offset is not None and declaration not in self.addressed and \
+                (declaration.kind == NodeType.VAR_DEC or declaration.size == -1):
+            variable = self.function.new_variable(declaration)
+        return variable
+
+    def emit(self, opcode, destination=None, operands=(), symbol=None, targets=()):
+        self.block.instructions.append(Instruction(opcode, destination, operands, symbol, targets))
+
+    def value(self, opcode, operands=(), symbol=None):
+        """Emit an instruction that computes a new Temp, and return the Temp."""
+        temp = self.function.new_temp()
+        self.emit(opcode, temp, operands, symbol)
+        return temp
+
+    def start(self, block):
+        """Go on emitting instructions at the start of 'block'."""
+        self.block = block
+
+    def statement(self, statement):
+        if statement.kind == NodeType.CMPND_STATEMENT:
+            dec = statement.local_declarations
+            while dec is not None:
+                self.variable(dec)
+                dec = dec.next_node
+            stmnt = statement.statements
+            while stmnt is not None:
+                self.statement(stmnt)
+                stmnt = stmnt.next_node
+
+        elif statement.kind == NodeType.WRITE_STATEMENT:
+            value = self.expression(statement.expression)
+            if statement.expression.type_string == 'int':
+                self.emit(Opcode.WRITE_INT, operands=[value])
+            else:
+                self.emit(Opcode.WRITE_STRING, operands=[value])
+
+        elif statement.kind == NodeType.WRITELN_STATEMENT:
+            self.emit(Opcode.WRITELN)
+
+        elif statement.kind == NodeType.IF_STATEMENT:
+            condition = self.expression(statement.condition)
+            then_block = self.function.new_block()
+            else_block = self.function.new_block() if statement.else_statement is not None else None
+            end = self.function.new_block()
+            self.emit(Opcode.BRANCH, operands=[condition, 0], symbol=Opcode.NEQ, targets=[then_block, else_block or end])
+            self.start(then_block)
+            self.statement(statement.statement)
+            self.emit(Opcode.JUMP, targets=[end])
+            if else_block is not None:
+                self.start(else_block)
+                self.statement(statement.else_statement)
+                self.emit(Opcode.JUMP, targets=[end])
+            self.start(end)
+
+        elif statement.kind == NodeType.RETURN_STATEMENT:
+            if statement.expression is not None:
+                self.emit(Opcode.RETURN, operands=[self.expression(statement.expression)])
+            else:
+                self.emit(Opcode.RETURN)
+            # anything after the return statement is unreachable
+            self.start(self.function.new_block())
+
+        elif statement.kind == NodeType.EXP_STATEMENT:
+            self.expression(statement.expression)
+
+        elif statement.kind == NodeType.WHILE_STATEMENT:
+            loop = self.function.new_block()
+            self.emit(Opcode.JUMP, targets=[loop])
+            self.start(loop)
+            condition = self.expression(statement.condition)
+            body = self.function.new_block()
+            end = self.function.new_block()
+            self.emit(Opcode.BRANCH, operands=[condition, 0], symbol=Opcode.NEQ, targets=[body, end])
+            self.start(body)
+            self.statement(statement.statement)
+            self.emit(Opcode.JUMP, targets=[loop])
+            self.start(end)
+
+    def expression(self, expression):
+        """Emit the instructions that compute 'expression', and return the Temp or integer constant it's in.
+
+        A variable's value is copied into a new Temp, since the variable may be
+        assigned again before the value is used.
+        """
+        if expression.kind == NodeType.NUM_EXP:
+            return wrap(int(expression.number))
+
+        elif expression.kind == NodeType.STR_EXP:
+            return self.value(Opcode.STRING, symbol=self.string_table[expression.string])
+
+        elif expression.kind in (NodeType.MATH_EXP, NodeType.COMP_EXP):
+            left = self.expression(expression.left)
+            right = self.expression(expression.right)
+            if expression.kind == NodeType.MATH_EXP:
+                return self.value(ARITHMETIC[expression.token.kind], [left, right])
+            return self.value(COMPARISONS[expression.token.kind], [left, right])
+
+        elif expression.kind == NodeType.FUN_CALL_EXP:
+            args = []
+            arg = expression.arguments
+            while arg is not None:
+                args.append(arg)
+                arg = arg.next_node
+            values = []
+            for arg in reversed(args):
+                if arg.type_string in ('int array', 'string array'):
+                    values.append(self.l_value(arg))
+                else:
+                    values.append(self.expression(arg))
+            values.reverse()
+            return self.value(Opcode.CALL, values, expression.name)
+
+        elif expression.kind == NodeType.VAR_EXP:
+            variable = self.variable(expression.declaration)
+            if variable is not None:
+                return self.value(Opcode.MOVE, [variable])
+            return self.value(Opcode.LOAD, [self.l_value(expression)])
+
+        elif expression.kind in (NodeType.ARRAY_EXP, NodeType.DEREF_EXP):
+            return self.value(Opcode.LOAD, [self.l_value(expression)])
+
+        elif expression.kind == NodeType.ASSIGN_EXP:
+            variable = None
+            if expression.left.kind == NodeType.VAR_EXP:
+                variable = self.variable(expression.left.declaration)
+            if variable is not None:
+                value = self.expression(expression.right)
+                self.emit(Opcode.MOVE, variable, [value])
+            else:
+                address = self.l_value(expression.left)
+                value = self.expression(expression.right)
+                self.emit(Opcode.STORE, operands=[address, value])
+            return value
+
+        elif expression.kind == NodeType.NEG_EXP:
+            return self.value(Opcode.NEG, [self.expression(expression.expression)])
+
+        elif expression.kind == NodeType.ADDRESS_EXP:
+            return self.l_value(expression.expression)
+
+        elif expression.kind == NodeType.READ_EXP:
+            return self.value(Opcode.READ)
+
+    def l_value(self, expression):
+        """Emit the instructions that compute the address of 'expression', and return the Temp it's in; for an array, that's the address of its first element."""
+        if expression.kind in (NodeType.VAR_EXP, NodeType.ARRAY_EXP):
+            index = None
+            if expression.kind == NodeType.ARRAY_EXP:
+                index = self.expression(expression.expression)
+            declaration = expression.declaration
+            if declaration.offset is None:
+                address = self.value(Opcode.GLOBAL, symbol=expression.name)
+            # an array parameter holds the address of the array passed to the function
+            elif declaration.kind == NodeType.ARRAY_DEC and declaration.size == -1:
+                address = self.variable(declaration)
+                if address is None:
+                    address = self.value(Opcode.LOAD, [self.value(Opcode.LOCAL, symbol=declaration.offset)])
+            else:
+                address = self.value(Opcode.LOCAL, symbol=declaration.offset)
+            if index is not None:
+                return self.value(Opcode.INDEX, [address, index])
+            return address
+
+        elif expression.kind == NodeType.DEREF_EXP:
+            return self.expression(expression.expression)
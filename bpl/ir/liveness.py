@@ -0,0 +1,40 @@
+"""
+Liveness analysis over the control flow graph of an IR Function.
+
+A Temp is live at a point if some path from there reads it before assigning it. The
+Temps live at the start and end of each block are found by iterating the usual
+backward dataflow equations until nothing changes.
+"""
+
+def uses_and_definitions(block):
+    """Return the set of Temps 'block' reads before assigning them, and the set of Temps it assigns."""
+    uses = set()
+    definitions = set()
+    for instruction in block.instructions:
+        for temp in instruction.uses():
+            if temp not in definitions:
+                uses.add(temp)
+        if instruction.destination is not None:
+            definitions.add(instruction.destination)
+    return uses, definitions
+
+def live_temps(function):
+    """Return two dictionaries, of the set of Temps live at the start of each block of 'function', and at its end."""
+    summaries = dict((block, uses_and_definitions(block)) for block in function.blocks)
+    live_in = dict((block, set()) for block in function.blocks)
+    live_out = dict((block, set()) for block in function.blocks)
+    changed = True
+    while changed:
+        changed = False
+        # information flows backwards, so visiting blocks from last to first converges sooner
+        for block in reversed(function.blocks):
+            out = set()
+            for successor in block.successors:
+                out |= live_in[successor]
+            uses, definitions = summaries[block]
+            new_in = uses | (out - definitions)
+            if new_in != live_in[block] or out != live_out[block]:
+                live_in[block] = new_in
+                live_out[block] = out
+                changed = True
+    return live_in, live_out
@@ -0,0 +1,324 @@
+"""
+Optimization passes over the IR, and the pass manager that runs them.
+
+A pass is a function that rewrites one IR Function in place, or a whole Program if it's
+marked with whole_program(). The PassManager runs a pipeline of passes over a program,
+bringing each function's control flow graph up to date after every pass, and PIPELINES holds the pipeline for each
+optimization level; at level 0 there's nothing to run, since the code generator works
+from the parse tree instead.
+"""
+
+import operator
+from bpl.ir.ir import Instruction, Opcode, Temp, NEGATED, SIDE_EFFECTS, wrap
+from bpl.ir.liveness import live_temps
+
+COMPARISON_OPCODES = frozenset(NEGATED)
+# how to compute each arithmetic instruction and comparison, before wrapping the result around at 32 bits
+OPERATIONS = {
+    Opcode.ADD: operator.add,
+    Opcode.SUB: operator.sub,
+    Opcode.MUL: operator.mul,
+    Opcode.LESS: operator.lt,
+    Opcode.LEQ: operator.le,
+    Opcode.EQ: operator.eq,
+    Opcode.NEQ: operator.ne,
+    Opcode.GEQ: operator.ge,
+    Opcode.GREATER: operator.gt,
+}
+
+class PassManager(object):
+    """Runs a pipeline of passes over the functions of IR Programs."""
+
+    def __init__(self, passes):
+        self.passes = list(passes)
+
+    def run(self, program):
+        """Run every pass over 'program', or over each of its functions, in order, and return 'program'."""
+        for optimization in self.passes:
+            if getattr(optimization, 'whole_program', False):
+                optimization(program)
+            else:
+                for function in program.functions:
+                    optimization(function)
+            for function in program.functions:
+                function.update_cfg()
+        return program
+
+def whole_program(optimization):
+    """Mark a pass as one that rewrites a whole Program, rather than one Function."""
+    optimization.whole_program = True
+    return optimization
+
+def count_uses(function):
+    """Return a dictionary of the number of times each Temp is read in 'function'."""
+    uses = {}
+    for instruction in function.instructions():
+        for temp in instruction.uses():
+            uses[temp] = uses.get(temp, 0) + 1
+    return uses
+
+def count_definitions(function):
+    """Return a dictionary of the number of instructions that assign each Temp in 'function'."""
+    definitions = {}
+    for instruction in function.instructions():
+        if instruction.destination is not None:
+            definitions[instruction.destination] = definitions.get(instruction.destination, 0) + 1
+    return definitions
+
+def simplify_cfg(function):
+    """Remove unreachable blocks, skip blocks that only jump somewhere else, and merge blocks that always run one after the other."""
+    changed = True
+    while changed:
+        changed = False
+        entry = function.blocks[0]
+
+        reachable = set()
+        stack = [entry]
+        while stack:
+            block = stack.pop()
+            if block not in reachable:
+                reachable.add(block)
+                stack.extend(block.terminator.targets)
+        if len(reachable) != len(function.blocks):
+            function.blocks = [block for block in function.blocks if block in reachable]
+            changed = True
+
+        for block in function.blocks:
+            terminator = block.terminator
+            for i, target in enumerate(terminator.targets):
+                # follow a chain of empty blocks, stopping if it goes round in a loop
+                seen = set()
+                while (target is not entry and target not in seen and len(target.instructions) == 1
+                        and target.terminator.opcode == Opcode.JUMP):
+                    seen.add(target)
+                    target = target.terminator.targets[0]
+                if target is not terminator.targets[i]:
+                    terminator.targets[i] = target
+                    changed = True
+            if terminator.opcode == Opcode.BRANCH and terminator.targets[0] is terminator.targets[1]:
+                block.instructions[-1] = Instruction(Opcode.JUMP, targets=terminator.targets[:1])
+                changed = True
+
+        function.update_cfg()
+        for block in function.blocks:
+            terminator = block.terminator
+            if terminator.opcode != Opcode.JUMP:
+                continue
+            successor = terminator.targets[0]
+            if successor is not entry and successor is not block and len(successor.predecessors) == 1:
+                block.instructions[-1:] = successor.instructions
+                function.blocks.remove(successor)
+                function.update_cfg()
+                changed = True
+                break
+
+def fuse_comparisons(function):
+    """Have a branch on the value of a comparison make the comparison itself.
+
+    The comparison's value has to be used only by the branch, and neither of its
+    operands assigned again before the branch.
+    """
+    uses = count_uses(function)
+    for block in function.blocks:
+        branch = block.terminator
+        if branch.opcode != Opcode.BRANCH or branch.symbol not in (Opcode.NEQ, Opcode.EQ) or branch.operands[1] != 0:
+            continue
+        condition = branch.operands[0]
+        if not isinstance(condition, Temp) or uses.get(condition) != 1:
+            continue
+        for i in range(len(block.instructions) - 2, -1, -1):
+            instruction = block.instructions[i]
+            if instruction.destination is condition:
+                break
+        else:
+            continue
+        if instruction.opcode not in COMPARISON_OPCODES:
+            continue
+        if any(later.destination in instruction.operands for later in block.instructions[i + 1:-1]):
+            continue
+        branch.operands = instruction.operands
+        branch.symbol = instruction.opcode if branch.symbol == Opcode.NEQ else NEGATED[instruction.opcode]
+        del block.instructions[i]
+
+def propagate_copies(function):
+    """Read the source of a copy wherever its copy is read later in the same block, and remove copies that aren't read any more.
+
+    Only copies into Temps that aren't variables, and are assigned once, are
+    propagated, and only as long as the source isn't assigned again.
+    """
+    definitions = count_definitions(function)
+    for block in function.blocks:
+        copies = {}
+        for instruction in block.instructions:
+            if copies:
+                instruction.operands = [copies.get(operand, operand) if isinstance(operand, Temp) else operand
+                        for operand in instruction.operands]
+            destination = instruction.destination
+            if destination is None:
+                continue
+            for copy, source in copies.items():
+                if source is destination:
+                    del copies[copy]
+            if (instruction.opcode == Opcode.MOVE and destination.declaration is None
+                    and definitions[destination] == 1):
+                copies[destination] = instruction.operands[0]
+
+    uses = count_uses(function)
+    for block in function.blocks:
+        block.instructions = [instruction for instruction in block.instructions
+                if instruction.opcode != Opcode.MOVE or instruction.destination in uses
+                or instruction.destination.declaration is not None]
+
+def coalesce_copies(function):
+    """Have the instruction that computes a Temp assign the variable it's then copied into instead.
+
+    The Temp has to be read only by the copy, later in the same block, and the variable
+    mustn't be read or assigned in between.
+    """
+    uses = count_uses(function)
+    definitions = count_definitions(function)
+    for block in function.blocks:
+        instructions = block.instructions
+        i = 0
+        while i < len(instructions):
+            copy = instructions[i]
+            source = copy.operands[0] if copy.opcode == Opcode.MOVE else None
+            if (isinstance(source, Temp) and source.declaration is None and uses[source] == 1
+                    and definitions[source] == 1):
+                j = i - 1
+                while j >= 0 and instructions[j].destination is not source:
+                    between = instructions[j]
+                    if between.destination is copy.destination or copy.destination in between.operands:
+                        break
+                    j -= 1
+                if j >= 0 and instructions[j].destination is source:
+                    instructions[j].destination = copy.destination
+                    del instructions[i]
+                    continue
+            i += 1
+
+def evaluate(opcode, operands):
+    """Return the value of an arithmetic instruction, comparison, or negation with constant operands.
+
+    Returns None for a division that would trap at run time, by zero or of the smallest
+    integer by -1, so that it's left to trap.
+    """
+    if opcode == Opcode.NEG:
+        return wrap(-operands[0])
+    left, right = operands
+    if opcode in (Opcode.DIV, Opcode.MOD):
+        if right == 0 or (left == -0x80000000 and right == -1):
+            return None
+        # the quotient is rounded towards zero, as idiv does
+        quotient = abs(left) // abs(right)
+        if (left < 0) != (right < 0):
+            quotient = -quotient
+        return wrap(quotient) if opcode == Opcode.DIV else left - right * quotient
+    return wrap(int(OPERATIONS[opcode](left, right)))
+
+def fold_constants(function):
+    """Compute instructions whose operands are all constants, read the constant a Temp is assigned wherever it's read, and turn branches on constants into jumps.
+
+    A constant is only propagated out of a Temp that's assigned once, and isn't a
+    parameter. Copies of constants into Temps that aren't read any more are removed,
+    and simplify_cfg() removes the blocks that are no longer reached.
+    """
+    parameters = set(variable for variable in function.variables.itervalues() if variable.declaration.offset > 0)
+    definitions = count_definitions(function)
+    constants = {}
+    changed = True
+    while changed:
+        changed = False
+        for block in function.blocks:
+            for i, instruction in enumerate(block.instructions):
+                operands = [constants.get(operand, operand) if isinstance(operand, Temp) else operand
+                        for operand in instruction.operands]
+                if operands != instruction.operands:
+                    instruction.operands = operands
+                    changed = True
+                if any(isinstance(operand, Temp) for operand in operands):
+                    continue
+                opcode = instruction.opcode
+                if opcode in OPERATIONS or opcode in (Opcode.DIV, Opcode.MOD, Opcode.NEG):
+                    value = evaluate(opcode, operands)
+                    if value is not None:
+                        block.instructions[i] = instruction = Instruction(Opcode.MOVE, instruction.destination, [value])
+                        changed = True
+                elif opcode == Opcode.BRANCH:
+                    target = instruction.targets[0 if evaluate(instruction.symbol, operands) else 1]
+                    block.instructions[i] = Instruction(Opcode.JUMP, targets=[target])
+                    changed = True
+                if (instruction.opcode == Opcode.MOVE and definitions[instruction.destination] == 1
+                        and instruction.destination not in parameters and instruction.destination not in constants):
+                    constants[instruction.destination] = instruction.operands[0]
+                    changed = True
+
+    uses = count_uses(function)
+    for block in function.blocks:
+        block.instructions = [instruction for instruction in block.instructions
+                if instruction.opcode != Opcode.MOVE or instruction.destination in uses
+                or isinstance(instruction.operands[0], Temp)]
+
+def may_trap(instruction):
+    """Return whether a division might trap, being by zero, or of the smallest integer by -1."""
+    if instruction.opcode not in (Opcode.DIV, Opcode.MOD):
+        return False
+    divisor = instruction.operands[1]
+    return isinstance(divisor, Temp) or divisor == 0 or divisor == -1
+
+def eliminate_dead_code(function):
+    """Remove instructions that only assign Temps that aren't read afterwards.
+
+    Instructions with side effects stay, as do divisions that might trap. Code after
+    a return is in a block of its own, which simplify_cfg() removes.
+    """
+    changed = True
+    while changed:
+        changed = False
+        live_in, live_out = live_temps(function)
+        for block in function.blocks:
+            live = set(live_out[block])
+            instructions = []
+            for instruction in reversed(block.instructions):
+                destination = instruction.destination
+                if (destination is not None and destination not in live and instruction.opcode not in SIDE_EFFECTS
+                        and not may_trap(instruction)):
+                    changed = True
+                    continue
+                live.discard(destination)
+                live.update(instruction.uses())
+                instructions.append(instruction)
+            instructions.reverse()
+            block.instructions = instructions
+
+@whole_program
+def remove_unreachable_functions(program):
+    """Remove the functions main() never calls, directly or not, and the global variables and string constants no function left uses."""
+    functions = dict((function.name, function) for function in program.functions)
+    if 'main' not in functions:
+        return
+    reachable = set(['main'])
+    stack = ['main']
+    while stack:
+        for instruction in functions[stack.pop()].instructions():
+            if instruction.opcode == Opcode.CALL and instruction.symbol not in reachable:
+                reachable.add(instruction.symbol)
+                stack.append(instruction.symbol)
+    program.functions = [function for function in program.functions if function.name in reachable]
+
+    symbols = set(instruction.symbol for function in program.functions for instruction in function.instructions()
+            if instruction.opcode in (Opcode.GLOBAL, Opcode.STRING))
+    program.globals = [declaration for declaration in program.globals if declaration.name in symbols]
+    program.string_table = dict((string, label) for string, label in program.string_table.iteritems()
+            if label in symbols)
+
+PIPELINES = {
+    0: [],
+    1: [fold_constants, simplify_cfg, fuse_comparisons, remove_unreachable_functions],
+    2: [propagate_copies, coalesce_copies, fold_constants, eliminate_dead_code, simplify_cfg, fuse_comparisons,
+            remove_unreachable_functions],
+}
+
+def optimize(program, optimization_level):
+    """Run the pipeline for 'optimization_level' over 'program', and return it."""
+    return PassManager(PIPELINES[optimization_level]).run(program)
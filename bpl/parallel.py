@@ -0,0 +1,180 @@
+"""
+Parsing, type checking, and code generation of a program's top-level declarations
+across a pool of worker processes.
+
+parse_parallel() finds where each top-level declaration starts and ends with the
+prescan in bpl.incremental, without parsing anything, and the workers each parse a run
+of declarations from that slice of the source, with the same line numbers as in the
+whole file. A parse tree is too deeply linked to pickle, so each run is sent back as
+the bytes of an ASTArena, which are read back into arrays without building any nodes.
+If any run has an error, the whole program is parsed again by a single Parser, so
+errors are reported exactly as without workers.
+
+check_and_generate() hands the runs to another pool of workers, which are forked after
+they're parsed and so share them without pickling. Each worker rebuilds only its own
+run's declarations, links their references to them and to the top-level declarations
+of the runs before it, which it reads through ArenaNode views, and returns the run's
+code. Every function's labels are numbered in a label_scope() of its own and it
+carries its own string constants, so its code doesn't depend on which worker generated
+it or what else that worker generated, and the assembly is the same for any number of
+workers.
+"""
+
+import multiprocessing
+from StringIO import StringIO
+from bpl.code_generator.code_generator import compute_offsets_function, gen_scoped_function, gen_global, \
+        gen_rodata, gen_text_header
+from bpl.incremental import split_declarations
+from bpl.parser.arena import ASTArena
+from bpl.parser.parser import ParserException, Parser
+from bpl.parser.parsetree import NodeType
+from bpl.scanner.scanner import ScannerException, Scanner
+from bpl.scanner.token_stream import TokenStream, StreamScanner
+from bpl.type_checker.type_checker import TypeCheckerException, find_references, type_check_declaration
+
+# the source of the program being parsed and its declarations' (start, stop, line
+# number) spans, inherited by the workers
+source = ''
+spans = []
+# the runs of the program being compiled, as ASTArenas, inherited by the workers
+arenas = []
+# the start of the earliest run that raised an exception, shared with the workers
+failure = None
+# the earliest run whose references couldn't all be found, shared with the workers
+reference_failure = None
+
+# how many runs of declarations to make for each worker, so that workers that finish
+# early can pick up more work
+RUNS_PER_JOB = 8
+
+def parse_run(run):
+    """Parse the declarations in spans[first:last], returning them as the bytes of an ASTArena, or None if there's an error."""
+    first, last = run
+    start = spans[first][0]
+    if failure is not None and failure.value < start:
+        # the program will be parsed again because of an earlier run's error
+        return None
+    stream = TokenStream(source, start, spans[last - 1][1], spans[first][2])
+    try:
+        parser = Parser.from_scanner(StreamScanner.from_stream(stream))
+        return ASTArena.from_tree(parser.declaration_list()).to_bytes()
+    except (ScannerException, ParserException):
+        if failure is not None:
+            with failure.get_lock():
+                failure.value = min(failure.value, start)
+        return None
+
+def parse_parallel(program, jobs, scanner_class=Scanner):
+    """Return the declarations of the source code 'program' as a list of ASTArenas, parsing them in 'jobs' processes.
+
+    Each arena holds a run of top-level declarations, in program order, and together
+    they hold the same declarations as the tree Parser.parse() returns. The error raised
+    if the program can't be parsed is the same as well: it comes from a Parser, using
+    'scanner_class', reading the whole program again.
+    """
+    global source, spans, failure
+    source = program
+    spans = split_declarations(program)
+    results = []
+    try:
+        if spans and jobs > 1:
+            failure = multiprocessing.Value('l', len(program))
+            pool = multiprocessing.Pool(jobs)
+            try:
+                results = pool.map(parse_run, split_runs(len(spans), jobs))
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        source = ''
+        spans = []
+        failure = None
+
+    if not results or None in results:
+        return [ASTArena.from_tree(Parser(StringIO(program), scanner_class).parse())]
+    return [ASTArena.from_bytes(result) for result in results]
+
+def compile_run(run):
+    """Find the references in, type check, and generate code for the run arenas[run].
+
+    Return (reference error, type error, (global code, function code)), with None for
+    whatever there isn't, or None if an earlier run's error means nothing here is used.
+    """
+    if reference_failure is not None and reference_failure.value < run:
+        return None
+    top_level = {}
+    for arena in arenas[:run]:
+        for node_id in xrange(arena.root_count):
+            declaration = arena.node(node_id)
+            top_level[declaration.name] = declaration
+    head = arenas[run].to_tree()
+    try:
+        find_references(head, [top_level], False)
+    except TypeCheckerException as e:
+        if reference_failure is not None:
+            with reference_failure.get_lock():
+                reference_failure.value = min(reference_failure.value, run)
+        return e, None, None
+    if failure is not None and failure.value < run:
+        # an earlier run's type error will be reported, unless a reference error is found
+        return None, None, None
+    global_code = StringIO()
+    function_code = StringIO()
+    declaration = head
+    try:
+        while declaration is not None:
+            type_check_declaration(declaration, False)
+            if declaration.kind == NodeType.FUN_DEC:
+                compute_offsets_function(declaration)
+                gen_scoped_function(declaration, function_code)
+            else:
+                gen_global(declaration, global_code)
+            declaration = declaration.next_node
+    except TypeCheckerException as e:
+        if failure is not None:
+            with failure.get_lock():
+                failure.value = min(failure.value, run)
+        return None, e, None
+    return None, None, (global_code.getvalue(), function_code.getvalue())
+
+def split_runs(count, jobs):
+    """Return (start, stop) pairs that split range(count) into about RUNS_PER_JOB * jobs contiguous runs."""
+    runs = max(min(count, RUNS_PER_JOB * jobs), 1)
+    return [(count * i // runs, count * (i + 1) // runs) for i in range(runs)]
+
+def check_and_generate(runs, output_file, jobs):
+    """Type check the runs of declarations 'runs', as returned by parse_parallel(), and write their code to output_file using 'jobs' processes.
+
+    Errors are raised as type_check() raises them: the first reference that can't be
+    found in the program, if there is one, and otherwise the first type error, whatever
+    the number of jobs. Runs after one with an error skip what can't be reported, but
+    the pool is always left to finish rather than terminated, since terminating workers
+    while they send their results can deadlock it.
+    """
+    global arenas, failure, reference_failure
+    arenas = runs
+    try:
+        if jobs <= 1:
+            results = map(compile_run, range(len(runs)))
+        else:
+            failure = multiprocessing.Value('l', len(runs))
+            reference_failure = multiprocessing.Value('l', len(runs))
+            pool = multiprocessing.Pool(jobs)
+            try:
+                results = list(pool.imap(compile_run, range(len(runs))))
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        arenas = []
+        failure = None
+        reference_failure = None
+
+    for index in range(2):
+        for result in results:
+            if result is not None and result[index] is not None:
+                raise result[index]
+    output_file.write(''.join(code[0] for reference_error, type_error, code in results))
+    gen_rodata({}, output_file)
+    gen_text_header(output_file)
+    output_file.write(''.join(code[1] for reference_error, type_error, code in results))
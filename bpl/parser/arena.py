@@ -0,0 +1,452 @@
+"""
+A flat, struct-of-arrays representation of BPL parse trees.
+
+An ASTArena stores every node of a parse tree as an integer id. Each field of a
+node lives in a typed array indexed by that id: its kind and line number, its
+children, an index into a pool of names, its token kind, and so on. Every linked
+list of nodes in the tree (the top-level declarations, a function's parameters,
+a compound statement's local declarations and statements, and a call's
+arguments) is given a contiguous range of ids, so a node's next_node is just the
+following id, up to the end of its range.
+
+Whole-arena passes can run over the arrays directly, and an arena can be
+serialized to and from a string cheaply. ArenaNode views expose the same
+attributes as the parse tree node classes, so the type checker and code
+generator run over an arena unchanged.
+"""
+
+import struct
+from array import array
+from collections import deque
+from bpl.parser.parsetree import *
+from bpl.scanner.token import Token
+from bpl.scanner.token_stream import token_values
+
+# value stored in an integer field that is None in the parse tree
+NONE = -0x80000000
+
+# the integer columns of an arena, in the order they are serialized
+COLUMNS = ('kinds', 'lines', 'ends', 'first', 'second', 'third', 'fourth', 'names', 'tokens',
+        'token_lines', 'flags', 'sizes', 'offsets', 'types', 'declarations')
+
+# the type strings the type checker assigns, shared so that comparisons with "is" still work
+TYPE_STRINGS = ('int', 'string', 'void', 'pointer to int', 'pointer to string', 'int array', 'string array')
+
+MAGIC = 'BPLA'
+FORMAT_VERSION = 1
+
+# how each field of a node is stored
+CHILD, LIST, NAME, TOKEN, FLAG, INT, TYPE, DECLARATION = range(8)
+
+_name = ('name', NAME, 'names')
+_type_token = ('type_token', TOKEN, 'tokens')
+_type_string = ('type_string', TYPE, 'types')
+_declaration = ('declaration', DECLARATION, 'declarations')
+_expression = ('expression', CHILD, 'first')
+_var_dec = (_name, _type_token, ('is_pointer', FLAG, 'flags'), ('offset', INT, 'offsets'))
+_op = (('token', TOKEN, 'tokens'), ('left', CHILD, 'first'), ('right', CHILD, 'second'), _type_string)
+
+# the fields of each kind of node: (attribute, storage, column) or, for lists, (attribute, LIST, start column, end column)
+FIELDS = {
+    NodeType.VAR_DEC: _var_dec,
+    NodeType.ARRAY_DEC: _var_dec + (('size', INT, 'sizes'),),
+    NodeType.FUN_DEC: (_name, _type_token, ('params', LIST, 'first', 'second'), ('body', CHILD, 'third'),
+            ('local_var_offset', INT, 'offsets')),
+    NodeType.EXP_STATEMENT: (_expression,),
+    NodeType.CMPND_STATEMENT: (('local_declarations', LIST, 'first', 'second'),
+            ('statements', LIST, 'third', 'fourth')),
+    NodeType.WHILE_STATEMENT: (('condition', CHILD, 'first'), ('statement', CHILD, 'second')),
+    NodeType.RETURN_STATEMENT: (_expression,),
+    NodeType.IF_STATEMENT: (('condition', CHILD, 'first'), ('statement', CHILD, 'second'),
+            ('else_statement', CHILD, 'third')),
+    NodeType.WRITE_STATEMENT: (_expression,),
+    NodeType.WRITELN_STATEMENT: (),
+    NodeType.VAR_EXP: (_name, _declaration, _type_string),
+    NodeType.ASSIGN_EXP: _op,
+    NodeType.COMP_EXP: _op,
+    NodeType.MATH_EXP: _op,
+    NodeType.ARRAY_EXP: (_name, _expression, _declaration, _type_string),
+    NodeType.ADDRESS_EXP: (_expression, _type_string),
+    NodeType.DEREF_EXP: (_expression, _type_string),
+    NodeType.NEG_EXP: (_expression, _type_string),
+    NodeType.NUM_EXP: (('number', NAME, 'names'), _type_string),
+    NodeType.STR_EXP: (('string', NAME, 'names'), _type_string),
+    NodeType.READ_EXP: (_type_string,),
+    NodeType.FUN_CALL_EXP: (_name, ('arguments', LIST, 'first', 'second'), _declaration, _type_string),
+}
+
+# the parse tree node class for each kind of node
+NODE_CLASSES = {
+    NodeType.VAR_DEC: VarDecNode,
+    NodeType.ARRAY_DEC: ArrayDecNode,
+    NodeType.FUN_DEC: FunDecNode,
+    NodeType.EXP_STATEMENT: ExpressionStatementNode,
+    NodeType.CMPND_STATEMENT: CompoundStatementNode,
+    NodeType.WHILE_STATEMENT: WhileStatementNode,
+    NodeType.RETURN_STATEMENT: ReturnStatementNode,
+    NodeType.IF_STATEMENT: IfStatementNode,
+    NodeType.WRITE_STATEMENT: WriteStatementNode,
+    NodeType.WRITELN_STATEMENT: WritelnStatementNode,
+    NodeType.VAR_EXP: VarExpNode,
+    NodeType.ASSIGN_EXP: OpNode,
+    NodeType.COMP_EXP: OpNode,
+    NodeType.MATH_EXP: OpNode,
+    NodeType.ARRAY_EXP: ArrayExpNode,
+    NodeType.ADDRESS_EXP: AddressExpNode,
+    NodeType.DEREF_EXP: DerefExpNode,
+    NodeType.NEG_EXP: NegExpNode,
+    NodeType.NUM_EXP: NumExpNode,
+    NodeType.STR_EXP: StringExpNode,
+    NodeType.READ_EXP: ReadExpNode,
+    NodeType.FUN_CALL_EXP: FunCallExpNode,
+}
+
+def number_nodes(tree):
+    """Return the nodes of the parse tree 'tree' in id order, and the end of the id range each one belongs to.
+
+    Nodes are numbered breadth first, one linked list at a time, so that every list
+    gets a contiguous range of ids and every child gets a larger id than its parent.
+    """
+    nodes = []
+    ends = array('i')
+    queue = deque([tree])
+    while queue:
+        head = queue.popleft()
+        start = len(nodes)
+        node = head
+        while node is not None:
+            nodes.append(node)
+            node = node.next_node
+        ends.extend(array('i', [len(nodes)]) * (len(nodes) - start))
+        for node in nodes[start:]:
+            for field in FIELDS[node.kind]:
+                if field[1] is CHILD or field[1] is LIST:
+                    child = getattr(node, field[0])
+                    if child is not None:
+                        queue.append(child)
+    return nodes, ends
+
+class ArenaException(Exception):
+    def __init__(self, message):
+        message = 'Arena Error: {}'.format(message)
+        Exception.__init__(self, message)
+
+class ASTArena(object):
+    """A parse tree stored as parallel integer arrays, one element per node."""
+
+    def __init__(self):
+        """Create an empty arena."""
+        for column in COLUMNS:
+            setattr(self, column, array('i'))
+        self.root_count = 0
+        self.name_pool = []
+        self.name_ids = {}
+        self.type_pool = list(TYPE_STRINGS)
+        self.type_ids = dict((t, i) for i, t in enumerate(TYPE_STRINGS))
+        self.views = []
+
+    def __len__(self):
+        return len(self.kinds)
+
+    @classmethod
+    def from_tree(cls, tree):
+        """Return an arena holding the parse tree whose first top-level declaration is 'tree'.
+
+        Any fields filled in by the type checker and code generator (types, declaration
+        links, and offsets) are stored too. The tree is walked iteratively, so it may be
+        arbitrarily deep.
+        """
+        arena = cls()
+        nodes, ends = number_nodes(tree)
+        arena.root_count = ends[0] if nodes else 0
+        for column in COLUMNS:
+            setattr(arena, column, array('i', [-1]) * len(nodes))
+        arena.ends = ends
+        node_ids = dict((id(node), node_id) for node_id, node in enumerate(nodes))
+        for node_id, node in enumerate(nodes):
+            arena.kinds[node_id] = node.kind
+            arena.lines[node_id] = node.line_number
+            for field in FIELDS[node.kind]:
+                value = getattr(node, field[0])
+                storage = field[1]
+                column = getattr(arena, field[2])
+                if storage is CHILD:
+                    if value is not None:
+                        column[node_id] = node_ids[id(value)]
+                elif storage is LIST:
+                    if value is not None:
+                        start = column[node_id] = node_ids[id(value)]
+                        getattr(arena, field[3])[node_id] = ends[start]
+                    else:
+                        column[node_id] = getattr(arena, field[3])[node_id] = 0
+                elif storage is NAME:
+                    column[node_id] = arena.intern(value)
+                elif storage is TOKEN:
+                    column[node_id] = value.kind
+                    arena.token_lines[node_id] = value.line_number
+                elif storage is FLAG:
+                    column[node_id] = 1 if value else 0
+                elif storage is INT:
+                    column[node_id] = NONE if value is None else value
+                elif storage is TYPE:
+                    if value is not None:
+                        column[node_id] = arena.type_id(value)
+                elif value is not None: # DECLARATION
+                    if id(value) not in node_ids:
+                        raise ArenaException('Node {} is linked to a declaration outside of the tree.'.format(node_id))
+                    column[node_id] = node_ids[id(value)]
+        return arena
+
+    def intern(self, name):
+        """Return the index of 'name' in the arena's name pool, adding it if necessary."""
+        index = self.name_ids.get(name)
+        if index is None:
+            index = self.name_ids[name] = len(self.name_pool)
+            self.name_pool.append(name)
+        return index
+
+    def type_id(self, type_string):
+        """Return the index of 'type_string' in the arena's type pool, adding it if necessary."""
+        index = self.type_ids.get(type_string)
+        if index is None:
+            index = self.type_ids[type_string] = len(self.type_pool)
+            self.type_pool.append(type_string)
+        return index
+
+    def to_tree(self, node_id=0):
+        """Return a parse tree built from the arena, or the node with id 'node_id' in it.
+
+        The whole arena is rebuilt, so declaration links always have a node to point to.
+        """
+        nodes = [None] * len(self)
+        token = self.token
+        kinds = self.kinds
+        lines = self.lines
+        ends = self.ends
+        # look up the columns of each kind's fields once, rather than once per node
+        columns = dict((kind, [(field[0], field[1], getattr(self, field[2]),
+                getattr(self, field[3]) if field[1] is LIST else None) for field in fields])
+                for kind, fields in FIELDS.items())
+        # children always have larger ids than their parents, so build the nodes from the last one back
+        for i in xrange(len(self) - 1, -1, -1):
+            kind = kinds[i]
+            node = NODE_CLASSES[kind].__new__(NODE_CLASSES[kind])
+            node.kind = kind
+            node.line_number = lines[i]
+            node.next_node = nodes[i + 1] if i + 1 < ends[i] else None
+            for name, storage, column, ends_column in columns[kind]:
+                value = column[i]
+                if storage is CHILD:
+                    value = nodes[value] if value >= 0 else None
+                elif storage is LIST:
+                    value = nodes[value] if value < ends_column[i] else None
+                elif storage is NAME:
+                    value = self.name_pool[value]
+                elif storage is TOKEN:
+                    value = token(i)
+                elif storage is FLAG:
+                    value = bool(value)
+                elif storage is INT:
+                    value = None if value == NONE else value
+                elif storage is TYPE:
+                    value = self.type_pool[value] if value >= 0 else None
+                else: # DECLARATION, linked below
+                    value = None
+                setattr(node, name, value)
+            nodes[i] = node
+        for i, declaration in enumerate(self.declarations):
+            if declaration >= 0:
+                nodes[i].declaration = nodes[declaration]
+        return nodes[node_id] if nodes else None
+
+    def token(self, node_id):
+        """Return a Token for the token stored with the node 'node_id'."""
+        token = Token.__new__(Token)
+        token.kind = self.tokens[node_id]
+        token.value = token_values[token.kind]
+        token.line_number = self.token_lines[node_id]
+        return token
+
+    def node(self, node_id):
+        """Return the ArenaNode view of the node 'node_id', or None if 'node_id' is negative."""
+        if node_id < 0:
+            return None
+        views = self.views
+        if len(views) < len(self):
+            views.extend([None] * (len(self) - len(views)))
+        view = views[node_id]
+        if view is None:
+            view = views[node_id] = VIEW_CLASSES[self.kinds[node_id]](self, node_id)
+        return view
+
+    def root(self):
+        """Return a view of the first top-level declaration, which the type checker and code generator accept as a parse tree."""
+        return self.node(0 if self.root_count > 0 else -1)
+
+    def count(self, kind):
+        """Return the number of nodes of 'kind'."""
+        return self.kinds.count(kind)
+
+    def kind_counts(self):
+        """Return a dictionary mapping each kind of node in the arena to the number of nodes of that kind."""
+        counts = {}
+        for kind in self.kinds:
+            counts[kind] = counts.get(kind, 0) + 1
+        return counts
+
+    def string_literals(self):
+        """Return the distinct string literals used in the arena, in order of their first node id."""
+        seen = set()
+        strings = []
+        kinds = self.kinds
+        names = self.names
+        for i in xrange(len(kinds)):
+            if kinds[i] == NodeType.STR_EXP and names[i] not in seen:
+                seen.add(names[i])
+                strings.append(self.name_pool[names[i]])
+        return strings
+
+    def to_bytes(self):
+        """Return the arena serialized as a string.
+
+        The header and the sizes of the pools are packed little-endian, but the columns
+        and the lengths of the pooled strings are written as the arrays hold them, in the
+        machine's byte order, so the string can only be read on a machine with the same.
+        """
+        parts = [struct.pack('<4sIII', MAGIC, FORMAT_VERSION, len(self), self.root_count)]
+        for column in COLUMNS:
+            parts.append(getattr(self, column).tostring())
+        for pool in (self.name_pool, self.type_pool):
+            parts.append(struct.pack('<I', len(pool)))
+            parts.append(array('i', [len(s) for s in pool]).tostring())
+            parts.extend(pool)
+        return ''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Return the arena serialized in the string 'data' by to_bytes().
+
+        Raise an ArenaException if 'data' isn't a serialized arena of this version, or is
+        cut short or followed by anything else.
+        """
+        def take(length):
+            if length < 0 or position + length > len(data):
+                raise ArenaException('Serialized arena is truncated.')
+            return data[position:position + length]
+
+        position = 0
+        magic, version, size, root_count = struct.unpack('<4sIII', take(struct.calcsize('<4sIII')))
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ArenaException('Data is not a serialized arena of version {}.'.format(FORMAT_VERSION))
+        arena = cls()
+        arena.root_count = root_count
+        position = struct.calcsize('<4sIII')
+        width = array('i').itemsize * size
+        for column in COLUMNS:
+            getattr(arena, column).fromstring(take(width))
+            position += width
+        pools = []
+        for i in range(2):
+            count, = struct.unpack('<I', take(4))
+            position += 4
+            lengths = array('i')
+            lengths.fromstring(take(lengths.itemsize * count))
+            position += lengths.itemsize * count
+            pool = []
+            for length in lengths:
+                pool.append(take(length))
+                position += length
+            pools.append(pool)
+        if position != len(data):
+            raise ArenaException('Serialized arena is followed by {} more bytes.'.format(len(data) - position))
+        arena.name_pool = pools[0]
+        arena.name_ids = dict((name, i) for i, name in enumerate(arena.name_pool))
+        # keep the shared type strings, so that comparisons with "is" still work
+        arena.type_pool = list(TYPE_STRINGS) + pools[1][len(TYPE_STRINGS):]
+        arena.type_ids = dict((t, i) for i, t in enumerate(arena.type_pool))
+        return arena
+
+class ArenaNode(object):
+    """A view of one node in an ASTArena, with the same attributes as the corresponding parse tree node.
+
+    Fields that are stored in the arena's arrays are read and written through
+    properties, so passes that fill in types, declaration links, or offsets update
+    the arena itself.
+    """
+    __slots__ = ('arena', 'id')
+
+    def __init__(self, arena, node_id):
+        self.arena = arena
+        self.id = node_id
+
+    @property
+    def kind(self):
+        return self.arena.kinds[self.id]
+
+    @property
+    def line_number(self):
+        return self.arena.lines[self.id]
+
+    @property
+    def next_node(self):
+        node_id = self.id + 1
+        return self.arena.node(node_id) if node_id < self.arena.ends[self.id] else None
+
+    @property
+    def base_string(self):
+        return 'Line {}: {}'.format(self.line_number, NODE_CLASSES[self.kind].__name__)
+
+    def __str__(self):
+        return str(self.arena.to_tree(self.id))
+
+def field_property(field):
+    """Return a property that reads and writes 'field' of an ArenaNode in its arena's arrays."""
+    name, storage, column = field[:3]
+    if storage is CHILD:
+        def get_field(self):
+            return self.arena.node(getattr(self.arena, column)[self.id])
+        def set_field(self, value):
+            getattr(self.arena, column)[self.id] = -1 if value is None else value.id
+    elif storage is LIST:
+        end_column = field[3]
+        def get_field(self):
+            start = getattr(self.arena, column)[self.id]
+            return self.arena.node(start) if start < getattr(self.arena, end_column)[self.id] else None
+        set_field = None
+    elif storage is NAME:
+        def get_field(self):
+            return self.arena.name_pool[getattr(self.arena, column)[self.id]]
+        def set_field(self, value):
+            getattr(self.arena, column)[self.id] = self.arena.intern(value)
+    elif storage is TOKEN:
+        def get_field(self):
+            return self.arena.token(self.id)
+        set_field = None
+    elif storage is FLAG:
+        def get_field(self):
+            return bool(getattr(self.arena, column)[self.id])
+        set_field = None
+    elif storage is INT:
+        def get_field(self):
+            value = getattr(self.arena, column)[self.id]
+            return None if value == NONE else value
+        def set_field(self, value):
+            getattr(self.arena, column)[self.id] = NONE if value is None else value
+    elif storage is TYPE:
+        def get_field(self):
+            value = getattr(self.arena, column)[self.id]
+            return self.arena.type_pool[value] if value >= 0 else None
+        def set_field(self, value):
+            getattr(self.arena, column)[self.id] = -1 if value is None else self.arena.type_id(value)
+    else: # DECLARATION
+        def get_field(self):
+            return self.arena.node(getattr(self.arena, column)[self.id])
+        def set_field(self, value):
+            getattr(self.arena, column)[self.id] = -1 if value is None else value.id
+    return property(get_field, set_field)
+
+# a view class for each kind of node, with a property for each of its fields
+VIEW_CLASSES = dict(
+        (kind, type(NODE_CLASSES[kind].__name__ + 'View', (ArenaNode,),
+            dict([('__slots__', ())] + [(field[0], field_property(field)) for field in fields])))
+        for kind, fields in FIELDS.items())
@@ -16,13 +16,54 @@ class ParserException(Exception):
         message = 'Parser Error on line {}: {}'.format(line_number, message)
         Exception.__init__(self, message)
 
+class ExpressionContext(object):
+    """The partially built state of one expression being parsed by Parser.iterative_expression().
+
+    Each field holds what a frame of the recursive expression(), E(), T(), or F()
+    methods would: the pending left operands and operators at each precedence
+    level and the line numbers those nodes get. 'prefixes' and 'resume' describe
+    the factor that was interrupted when a nested expression (in parentheses, an
+    array index, or a function argument) had to be parsed first.
+    """
+    __slots__ = ('line_number', 'e_line_number', 't_line_number', 'assignments', 'comparison',
+            'sum', 'add_op', 'term', 'mul_op', 'prefixes', 'resume')
+
+    def __init__(self, line_number):
+        self.line_number = self.e_line_number = self.t_line_number = line_number
+        self.assignments = []
+        self.comparison = None
+        self.sum = self.add_op = None
+        self.term = self.mul_op = None
+        self.prefixes = self.resume = None
+
+# the kinds of factor that contain a nested expression
+PAREN_FACTOR, ARRAY_FACTOR, CALL_FACTOR = range(3)
+
 class Parser(object):
 
-    def __init__(self, input_file):
-        """Initialize a Scanner using 'input_file' and set its current token to the first token in 'input_file'."""
-        self.scanner = Scanner(input_file)
+    def __init__(self, input_file, scanner_class=Scanner, recursive_expressions=False):
+        """Initialize a Scanner using 'input_file' and set its current token to the first token in 'input_file'.
+
+        'scanner_class' may be any class with the Scanner interface, e.g. BufferScanner.
+        Expressions are parsed by iterative_expression() unless 'recursive_expressions' is
+        set, in which case the recursive descent methods are used instead.
+        """
+        self.recursive_expressions = recursive_expressions
+        self.scanner = scanner_class(input_file)
         self.scanner.get_next_token()
 
+    @classmethod
+    def from_scanner(cls, scanner, recursive_expressions=False):
+        """Return a Parser that reads tokens from 'scanner', e.g. a StreamScanner over part of a file.
+
+        'scanner' must not have read its first token yet.
+        """
+        parser = cls.__new__(cls)
+        parser.recursive_expressions = recursive_expressions
+        parser.scanner = scanner
+        parser.scanner.get_next_token()
+        return parser
+
     def parse(self):
         """Parse the Parser's input file."""
         return self.program()
@@ -32,12 +73,13 @@ class Parser(object):
         return self.declaration_list()
 
     def expect(self, token, message):
-        """Consume the current token, raising an error if it does not match the expected token."""
+        """Consume the current token, raising an error if it does not match the expected token, and return its value."""
         current_token = self.scanner.next_token
         if current_token.kind != getattr(TokenType, token):
             raise ParserException(self.scanner.line_number, message)
+        value = current_token.value
         self.scanner.get_next_token()
-        return current_token
+        return value
 
     def declaration_list(self):
         """Return a linked list of declaration nodes."""
@@ -55,29 +97,29 @@ class Parser(object):
         line_number = self.scanner.line_number
         if not is_type_token(self.scanner.next_token):
             raise ParserException(line_number, 'Expected a type token to begin a declaration.')
-        type_token = self.scanner.next_token
+        type_token = self.scanner.token()
         self.scanner.get_next_token()
 
         if self.scanner.next_token.kind == TokenType.T_MULT:
             is_pointer = True
             self.scanner.get_next_token()
         
-        id_token = self.expect('T_ID', 'Expected an identifier as part of the declaration.')
+        name = self.expect('T_ID', 'Expected an identifier as part of the declaration.')
 
         # handle variable declarations
         if self.scanner.next_token.kind == TokenType.T_SEMICOLON:
            self.scanner.get_next_token() 
-           return VarDecNode('VAR_DEC', line_number, id_token.value, type_token, is_pointer)
+           return VarDecNode('VAR_DEC', line_number, name, type_token, is_pointer)
 
         # handle array declarations
         elif self.scanner.next_token.kind == TokenType.T_LBRACKET:
             if is_pointer:
                 raise ParserException(line_number, 'Cannot declare a pointer to an array.')
             self.scanner.get_next_token()
-            size = int(self.expect('T_NUM', 'Expected an integer size as part of the array declaration.').value)
+            size = int(self.expect('T_NUM', 'Expected an integer size as part of the array declaration.'))
             self.expect('T_RBRACKET', 'Expected a right bracket as part of the array declaration.')
             self.expect('T_SEMICOLON', 'Expected a semicolon to end the array declaration.')
-            return ArrayDecNode('ARRAY_DEC', line_number, id_token.value, type_token, size, is_pointer)
+            return ArrayDecNode('ARRAY_DEC', line_number, name, type_token, size, is_pointer)
 
         # handle function delcarations
         elif self.scanner.next_token.kind == TokenType.T_LPAREN:
@@ -89,7 +131,7 @@ class Parser(object):
             parameters = self.param_list()
             self.expect('T_RPAREN', 'Expected a right parenthesis to end the function parameter declarations.')
             body = self.compound_statement()
-            return FunDecNode('FUN_DEC', line_number, id_token.value, type_token, parameters, body)
+            return FunDecNode('FUN_DEC', line_number, name, type_token, parameters, body)
 
         else:
             raise ParserException(line_number, 'Unexpected token in declaration.')
@@ -167,21 +209,21 @@ class Parser(object):
         line_number = self.scanner.line_number
         if not is_type_token(self.scanner.next_token):
             raise ParserException(self.scanner.line_number, 'Expected a type keyword as part of the function parameter.')
-        type_token = self.scanner.next_token
+        type_token = self.scanner.token()
         self.scanner.get_next_token()
         is_pointer = False
         if self.scanner.next_token.kind == TokenType.T_MULT:
             is_pointer = True
             self.scanner.get_next_token()
-        id_token = self.expect('T_ID', 'Expected an identifier as part of the function parameter.')
+        name = self.expect('T_ID', 'Expected an identifier as part of the function parameter.')
         if self.scanner.next_token.kind == TokenType.T_LBRACKET:
             if is_pointer:
                 raise ParserException(line_number, 'Cannot pass a pointer to an array as a parameter.')
             self.scanner.get_next_token()
             self.expect('T_RBRACKET', 'Expected a right bracket as part of the array parameter.')
-            return ArrayDecNode('ARRAY_DEC', line_number, id_token.value, type_token, -1, is_pointer)
+            return ArrayDecNode('ARRAY_DEC', line_number, name, type_token, -1, is_pointer)
         else:
-            return VarDecNode('VAR_DEC', line_number, id_token.value, type_token, is_pointer)
+            return VarDecNode('VAR_DEC', line_number, name, type_token, is_pointer)
 
     def compound_statement(self):
         """Return a single compound statement node with local declarations and statements."""
@@ -247,6 +289,12 @@ class Parser(object):
 
     def expression(self):
         """Return a single expression node."""
+        if self.recursive_expressions:
+            return self.recursive_expression()
+        return self.iterative_expression()
+
+    def recursive_expression(self):
+        """Return a single expression node, parsed by recursive descent."""
         line_number = self.scanner.line_number
 
         left = self.E()
@@ -257,13 +305,14 @@ class Parser(object):
             if not (left.kind is NodeType.VAR_EXP or left.kind is NodeType.ARRAY_EXP or
                     left.kind is NodeType.DEREF_EXP):
                 raise ParserException(line_number, 'Left side of assignment expression must be a variable, array reference, or pointer dereference.')
-            op_token = self.expect('T_ASSIGN', 'Expected an "=" as part of the assignment expression.')
+            op_token = self.scanner.token()
+            self.expect('T_ASSIGN', 'Expected an "=" as part of the assignment expression.')
             right = self.expression()
             return OpNode('ASSIGN_EXP', line_number, op_token, left, right)
 
         # handle comparison expressions
         elif is_rel_op(self.scanner.next_token):
-            op_token = self.scanner.next_token
+            op_token = self.scanner.token()
             self.scanner.get_next_token()
             right = self.E()
             return OpNode('COMP_EXP', line_number, op_token, left, right)
@@ -272,12 +321,160 @@ class Parser(object):
         else:
             return left
 
+    def iterative_expression(self):
+        """Return a single expression node, parsed without recursion.
+
+        This builds exactly the tree that recursive_expression() does, with the same
+        line numbers and error messages, but keeps the operands and operators that
+        are waiting on a nested expression in ExpressionContexts on an explicit
+        stack. Expressions can therefore be nested arbitrarily deeply, and each
+        token is examined a constant number of times.
+        """
+        scanner = self.scanner
+        suspended = []
+        context = ExpressionContext(scanner.line_number)
+        node = None
+        while True:
+            if node is None:
+                # parse the unary operators in front of a factor
+                prefixes = []
+                while scanner.next_token.kind == TokenType.T_MINUS:
+                    prefixes.append((NegExpNode, 'NEG_EXP', scanner.line_number))
+                    scanner.get_next_token()
+                if scanner.next_token.kind == TokenType.T_AND:
+                    prefixes.append((AddressExpNode, 'ADDRESS_EXP', scanner.line_number))
+                    scanner.get_next_token()
+                elif scanner.next_token.kind == TokenType.T_MULT:
+                    prefixes.append((DerefExpNode, 'DEREF_EXP', scanner.line_number))
+                    scanner.get_next_token()
+
+                # parse the factor, suspending the current expression if it contains another one
+                line_number = scanner.line_number
+                kind = scanner.next_token.kind
+                if kind == TokenType.T_LPAREN:
+                    scanner.get_next_token()
+                    context.resume = (PAREN_FACTOR,)
+                elif kind == TokenType.T_NUM:
+                    number = self.expect('T_NUM', 'Expected a number as part of the expression.')
+                    node = NumExpNode('NUM_EXP', line_number, number)
+                elif kind == TokenType.T_STRVAL:
+                    string = self.expect('T_STRVAL', 'Expected a string literal as part of the expression.')
+                    node = StringExpNode('STR_EXP', line_number, string)
+                elif kind == TokenType.T_READ:
+                    scanner.get_next_token()
+                    self.expect('T_LPAREN', 'Expected a left parenthesis as part of the read expression.')
+                    self.expect('T_RPAREN', 'Expected a right parenthesis as part of the read expression.')
+                    node = ReadExpNode('READ_EXP', line_number)
+                elif kind == TokenType.T_MULT:
+                    scanner.get_next_token()
+                    name = self.expect('T_ID', 'Expected an identifier as part of the pointer dereference.')
+                    v = VarExpNode('VAR_EXP', line_number, name)
+                    node = DerefExpNode('DEREF_EXP', line_number, v)
+                else:
+                    name = self.expect('T_ID', 'Expected an identifier as part of the expression.')
+                    if scanner.next_token.kind == TokenType.T_LBRACKET:
+                        scanner.get_next_token()
+                        context.resume = (ARRAY_FACTOR, line_number, name)
+                    elif scanner.next_token.kind == TokenType.T_LPAREN:
+                        scanner.get_next_token()
+                        if scanner.next_token.kind == TokenType.T_RPAREN:
+                            self.expect('T_RPAREN', 'Expected a right parenthesis to close the function call.')
+                            node = FunCallExpNode('FUN_CALL_EXP', line_number, name, None)
+                        else:
+                            context.resume = (CALL_FACTOR, line_number, name, [])
+                    else:
+                        node = VarExpNode('VAR_EXP', line_number, name)
+
+                if node is None:
+                    context.prefixes = prefixes
+                    suspended.append(context)
+                    context = ExpressionContext(scanner.line_number)
+                    continue
+
+            # apply the unary operators, innermost first
+            for node_class, node_kind, line_number in reversed(prefixes):
+                node = node_class(node_kind, line_number, node)
+
+            # T: fold the factor into the current term
+            if context.mul_op is not None:
+                node = OpNode('MATH_EXP', context.t_line_number, context.mul_op, context.term, node)
+            if is_mul_op(scanner.next_token):
+                context.term = node
+                context.mul_op = scanner.token()
+                scanner.get_next_token()
+                node = None
+                continue
+            context.mul_op = None
+
+            # E: fold the term into the current sum
+            if context.add_op is not None:
+                node = OpNode('MATH_EXP', context.e_line_number, context.add_op, context.sum, node)
+            if is_add_op(scanner.next_token):
+                context.sum = node
+                context.add_op = scanner.token()
+                scanner.get_next_token()
+                context.t_line_number = scanner.line_number
+                node = None
+                continue
+            context.add_op = None
+
+            # expression: comparisons and right-associative assignments
+            if context.comparison is not None:
+                left, op_token = context.comparison
+                node = OpNode('COMP_EXP', context.line_number, op_token, left, node)
+            elif scanner.next_token.kind == TokenType.T_ASSIGN:
+                if not (node.kind is NodeType.VAR_EXP or node.kind is NodeType.ARRAY_EXP or
+                        node.kind is NodeType.DEREF_EXP):
+                    raise ParserException(context.line_number, 'Left side of assignment expression must be a variable, array reference, or pointer dereference.')
+                op_token = scanner.token()
+                self.expect('T_ASSIGN', 'Expected an "=" as part of the assignment expression.')
+                context.assignments.append((context.line_number, op_token, node))
+                context.line_number = context.e_line_number = context.t_line_number = scanner.line_number
+                node = None
+                continue
+            elif is_rel_op(scanner.next_token):
+                context.comparison = (node, scanner.token())
+                scanner.get_next_token()
+                context.e_line_number = context.t_line_number = scanner.line_number
+                node = None
+                continue
+            while context.assignments:
+                line_number, op_token, left = context.assignments.pop()
+                node = OpNode('ASSIGN_EXP', line_number, op_token, left, node)
+
+            # the expression is complete; finish the factor that was waiting on it, if any
+            if not suspended:
+                return node
+            context = suspended.pop()
+            resume = context.resume
+            context.resume = None
+            if resume[0] == PAREN_FACTOR:
+                self.expect('T_RPAREN', 'Expected a right parenthesis to close the expression.')
+            elif resume[0] == ARRAY_FACTOR:
+                self.expect('T_RBRACKET', 'Expected a right bracket to close the array reference.')
+                node = ArrayExpNode('ARRAY_EXP', resume[1], resume[2], node)
+            else:
+                arguments = resume[3]
+                arguments.append(node)
+                if scanner.next_token.kind != TokenType.T_RPAREN:
+                    self.expect('T_COMMA', 'Expected a comma between each function argument.')
+                    context.resume = resume
+                    suspended.append(context)
+                    context = ExpressionContext(scanner.line_number)
+                    node = None
+                    continue
+                self.expect('T_RPAREN', 'Expected a right parenthesis to close the function call.')
+                for a, a1 in zip(arguments, arguments[1:]):
+                    a.next_node = a1
+                node = FunCallExpNode('FUN_CALL_EXP', resume[1], resume[2], arguments[0])
+            prefixes = context.prefixes
+
     def E(self):
         """Return an expression node representing an addition or subtraction operation."""
         line_number = self.scanner.line_number
         t = self.T()
         while is_add_op(self.scanner.next_token):
-            op_token = self.scanner.next_token
+            op_token = self.scanner.token()
             self.scanner.get_next_token()
             t1 = OpNode('MATH_EXP', line_number, op_token, None, None)
             t1.left = t
@@ -290,7 +487,7 @@ class Parser(object):
         line_number = self.scanner.line_number
         f = self.F()
         while is_mul_op(self.scanner.next_token):
-            op_token = self.scanner.next_token
+            op_token = self.scanner.token()
             self.scanner.get_next_token()
             f1 = OpNode('MATH_EXP', line_number, op_token, None, None)
             f1.left = f
@@ -333,12 +530,12 @@ class Parser(object):
         # handle number expressions
         elif self.scanner.next_token.kind == TokenType.T_NUM:
             number = self.expect('T_NUM', 'Expected a number as part of the expression.')
-            return NumExpNode('NUM_EXP', line_number, number.value)
+            return NumExpNode('NUM_EXP', line_number, number)
 
         # handle string expressions
         elif self.scanner.next_token.kind == TokenType.T_STRVAL:
             string = self.expect('T_STRVAL', 'Expected a string literal as part of the expression.')
-            return StringExpNode('STR_EXP', line_number, string.value)
+            return StringExpNode('STR_EXP', line_number, string)
 
         # handle read expressions
         elif self.scanner.next_token.kind == TokenType.T_READ:
@@ -350,30 +547,30 @@ class Parser(object):
         # handle pointer dereference expressions
         elif self.scanner.next_token.kind == TokenType.T_MULT:
             self.scanner.get_next_token()
-            id_token = self.expect('T_ID', 'Expected an identifier as part of the pointer dereference.')
-            v = VarExpNode('VAR_EXP', line_number, id_token.value)
+            name = self.expect('T_ID', 'Expected an identifier as part of the pointer dereference.')
+            v = VarExpNode('VAR_EXP', line_number, name)
             return DerefExpNode('DEREF_EXP', line_number, v)
 
         else:
-            id_token = self.expect('T_ID', 'Expected an identifier as part of the expression.')
+            name = self.expect('T_ID', 'Expected an identifier as part of the expression.')
 
             # handle array reference expressions
             if self.scanner.next_token.kind == TokenType.T_LBRACKET:
                 self.scanner.get_next_token()
                 exp = self.expression()
                 self.expect('T_RBRACKET', 'Expected a right bracket to close the array reference.')
-                return ArrayExpNode('ARRAY_EXP', line_number, id_token.value, exp)
+                return ArrayExpNode('ARRAY_EXP', line_number, name, exp)
 
             # handle function call expressions
             elif self.scanner.next_token.kind == TokenType.T_LPAREN:
                 self.scanner.get_next_token()
                 arguments = self.args()
                 self.expect('T_RPAREN', 'Expected a right parenthesis to close the function call.')
-                return FunCallExpNode('FUN_CALL_EXP', line_number, id_token.value, arguments)
+                return FunCallExpNode('FUN_CALL_EXP', line_number, name, arguments)
 
             # handle variable expressions
             else:
-                return VarExpNode('VAR_EXP', line_number, id_token.value)
+                return VarExpNode('VAR_EXP', line_number, name)
 
     def args(self):
         """Return a linked list of function arguments, each of which is an expression."""
@@ -32,20 +32,32 @@ NodeType = enum('VAR_DEC',
 )
 
 class TreeNode(object):
-    """Base class for parse tree nodes. Inherited by more specific subclasses of nodes."""
+    """Base class for parse tree nodes. Inherited by more specific subclasses of nodes.
+
+    Every node class lists its fields in __slots__, so nodes don't carry an instance
+    __dict__. A subclass must declare any new fields it sets in its own __slots__.
+    """
+    __slots__ = ('kind', 'line_number', 'next_node')
+
     def __init__(self, kind, line_number, next_node=None):
         self.kind = getattr(NodeType, kind)
         self.line_number = line_number
         self.next_node = next_node
-        self.base_string = 'Line {}: {}'.format(
+
+    @property
+    def base_string(self):
+        """The header line of this node's string representation, built only when it is printed."""
+        return 'Line {}: {}'.format(
                 self.line_number,
                 self.__class__.__name__
         )
-        
+
 # Declaration Nodes
 
 class DecNode(TreeNode):
     """Base class for declaration nodes. Inherited by variable, function, and array declaration nodes."""
+    __slots__ = ('name', 'type_token')
+
     def __init__(self, kind, line_number, name, type_token, next_node = None):
         TreeNode.__init__(self, kind, line_number, next_node)
         self.name = name
@@ -53,6 +65,8 @@ class DecNode(TreeNode):
 
 class VarDecNode(DecNode):
     """Represents a variable declaration."""
+    __slots__ = ('is_pointer', 'offset')
+
     def __init__(self, kind, line_number, name, type_token, is_pointer = False, next_node = None):
         DecNode.__init__(self, kind, line_number, name, type_token, next_node)
         self.is_pointer = is_pointer
@@ -72,11 +86,13 @@ class VarDecNode(DecNode):
 
 class FunDecNode(DecNode):
     """Represents a function declaration."""
+    __slots__ = ('params', 'body', 'local_var_offset')
+
     def __init__(self, kind, line_number, name, type_token, params, body, next_node = None):
         DecNode.__init__(self, kind, line_number, name, type_token, next_node)
         self.params = params
         self.body = body
-        self.local_var_offsets = 0
+        self.local_var_offset = 0
 
     def __str__(self):
         string = '{} id = {} return type = {} ({})\nParams:\n{}{}Body:\n{}{}'.format(
@@ -93,6 +109,8 @@ class FunDecNode(DecNode):
 
 class ArrayDecNode(VarDecNode):
     """Represents an array declaration."""
+    __slots__ = ('size',)
+
     def __init__(self, kind, line_number, name, type_token, size, is_pointer = False, next_node = None):
         VarDecNode.__init__(self, kind, line_number, name, type_token, is_pointer, next_node)
         self.size = size
@@ -114,11 +132,15 @@ class ArrayDecNode(VarDecNode):
 
 class StatementNode(TreeNode):
     """Base class for statement nodes. Inherited by compound, while, if, write, writeln, return, and expression statement nodes."""
+    __slots__ = ()
+
     def __init__(self, kind, line_number, next_node = None):
         TreeNode.__init__(self, kind, line_number, next_node)
 
 class ExpressionStatementNode(StatementNode):
     """Represents an expression statement, which can essentially be any type of expression."""
+    __slots__ = ('expression',)
+
     def __init__(self, kind, line_number, expression, next_node = None):
         StatementNode.__init__(self, kind, line_number, next_node)
         self.expression = expression
@@ -133,6 +155,8 @@ class ExpressionStatementNode(StatementNode):
 
 class CompoundStatementNode(StatementNode):
     """Represents a compound statement, which contains local declarations followed by more statements, all inside curly braces."""
+    __slots__ = ('local_declarations', 'statements')
+
     def __init__(self, kind, line_number, local_declarations, statements, next_node = None):
         StatementNode.__init__(self, kind, line_number, next_node)
         self.local_declarations = local_declarations
@@ -150,6 +174,8 @@ class CompoundStatementNode(StatementNode):
 
 class WhileStatementNode(StatementNode):
     """Reprsents a while statement with a condition and a statement to executed."""
+    __slots__ = ('condition', 'statement')
+
     def __init__(self, kind, line_number, condition, statement, next_node = None):
         StatementNode.__init__(self, kind, line_number, next_node)
         self.condition = condition
@@ -166,6 +192,8 @@ class WhileStatementNode(StatementNode):
 
 class ReturnStatementNode(StatementNode):
     """Represents a return statement with an optional expression to be returned."""
+    __slots__ = ('expression',)
+
     def __init__(self, kind, line_number, expression, next_node = None):
         StatementNode.__init__(self, kind, line_number, next_node)
         self.expression = expression
@@ -181,6 +209,8 @@ class ReturnStatementNode(StatementNode):
 
 class IfStatementNode(StatementNode):
     """Represents an if statement with a condition, a statement to executed, and an optional else statement."""
+    __slots__ = ('condition', 'statement', 'else_statement')
+
     def __init__(self, kind, line_number, condition, statement, else_statement, next_node = None):
         StatementNode.__init__(self, kind, line_number, next_node)
         self.condition = condition
@@ -200,6 +230,8 @@ class IfStatementNode(StatementNode):
 
 class WriteStatementNode(StatementNode):
     """Represents a write statement with an expression to be written."""
+    __slots__ = ('expression',)
+
     def __init__(self, kind, line_number, expression, next_node = None):
         StatementNode.__init__(self, kind, line_number, next_node)
         self.expression = expression
@@ -214,6 +246,8 @@ class WriteStatementNode(StatementNode):
 
 class WritelnStatementNode(StatementNode):
     """Represents a writeln statement."""
+    __slots__ = ()
+
     def __init__(self, kind, line_number, next_node = None):
         StatementNode.__init__(self, kind, line_number, next_node)
 
@@ -229,12 +263,16 @@ class WritelnStatementNode(StatementNode):
 class ExpressionNode(TreeNode):
     """Base class for expression nodes. Inherited by variable, operation, array, dereference, address, \
             negative, number, string, read, and function call expression nodes."""
+    __slots__ = ('type_string',)
+
     def __init__(self, kind, line_number, next_node = None):
         TreeNode.__init__(self, kind, line_number, next_node)
         self.type_string = None
 
 class VarExpNode(ExpressionNode):
     """Represents a variable."""
+    __slots__ = ('name', 'declaration')
+
     def __init__(self, kind, line_number, name, next_node = None):
         ExpressionNode.__init__(self, kind, line_number, next_node)
         self.name = name
@@ -253,6 +291,8 @@ class VarExpNode(ExpressionNode):
 class OpNode(ExpressionNode):
     """Represents an infix operation, which can be any one of addition, subtraction, multiplication, \
             division, assignment, or modulo."""
+    __slots__ = ('token', 'left', 'right')
+
     def __init__(self, kind, line_number, token, left, right, next_node = None):
         ExpressionNode.__init__(self, kind, line_number, next_node)
         self.token = token
@@ -273,6 +313,8 @@ class OpNode(ExpressionNode):
 
 class ArrayExpNode(VarExpNode):
     """Represents an array indexing expression, e.g. arr[x+1]."""
+    __slots__ = ('expression',)
+
     def __init__(self, kind, line_number, name, expression, next_node = None):
         VarExpNode.__init__(self, kind, line_number, name, next_node)
         self.expression = expression
@@ -291,6 +333,8 @@ class ArrayExpNode(VarExpNode):
 
 class DerefExpNode(ExpressionNode):
     """Represents a pointer dereference, e.g. *x."""
+    __slots__ = ('expression',)
+
     def __init__(self, kind, line_number, expression, next_node = None):
         ExpressionNode.__init__(self, kind, line_number, next_node)
         self.expression = expression
@@ -306,6 +350,8 @@ class DerefExpNode(ExpressionNode):
 
 class AddressExpNode(ExpressionNode):
     """Represents a memory address reference, e.g. &x."""
+    __slots__ = ('expression',)
+
     def __init__(self, kind, line_number, expression, next_node = None):
         ExpressionNode.__init__(self, kind, line_number, next_node)
         self.expression = expression
@@ -321,6 +367,8 @@ class AddressExpNode(ExpressionNode):
 
 class NegExpNode(ExpressionNode):
     """Represents applying the negative operator to a value, e.g -x."""
+    __slots__ = ('expression',)
+
     def __init__(self, kind, line_number, expression, next_node = None):
         ExpressionNode.__init__(self, kind, line_number, next_node)
         self.expression = expression
@@ -336,6 +384,8 @@ class NegExpNode(ExpressionNode):
 
 class NumExpNode(ExpressionNode):
     """Represents an integer."""
+    __slots__ = ('number',)
+
     def __init__(self, kind, line_number, number, next_node = None):
         ExpressionNode.__init__(self, kind, line_number, next_node)
         self.number = number
@@ -351,6 +401,8 @@ class NumExpNode(ExpressionNode):
 
 class StringExpNode(ExpressionNode):
     """Represents a string."""
+    __slots__ = ('string',)
+
     def __init__(self, kind, line_number, string, next_node = None):
         ExpressionNode.__init__(self, kind, line_number, next_node)
         self.string = string
@@ -366,6 +418,8 @@ class StringExpNode(ExpressionNode):
 
 class ReadExpNode(ExpressionNode):
     """Represents a read operation."""
+    __slots__ = ()
+
     def __init__(self, kind, line_number, next_node = None):
         ExpressionNode.__init__(self, kind, line_number, next_node)
 
@@ -379,6 +433,8 @@ class ReadExpNode(ExpressionNode):
 
 class FunCallExpNode(ExpressionNode):
     """Represents a function call, e.g. f(x)."""
+    __slots__ = ('name', 'arguments', 'declaration')
+
     def __init__(self, kind, line_number, name, arguments, next_node = None):
         ExpressionNode.__init__(self, kind, line_number, next_node)
         self.name = name
@@ -0,0 +1,211 @@
+"""
+Running compiled programs inside the current process, without linking an executable.
+
+load() compiles a program and encodes it with an ObjectWriter, then lays its code, read
+only data, and global variables out in memory mapped into the first 2GB of the address
+space, where the 32-bit addresses the code generator uses can reach them. References
+to labels are filled in, and calls to the C library go through stubs that jump to its
+functions wherever they were loaded, aligning the stack for them. The program's main function is then called like
+any C function through ctypes. Loaded programs are kept by a hash of their source and
+the optimization level they were compiled at, so a program run again is only called again, with its global variables cleared first.
+"""
+
+import ctypes, hashlib, os, struct, tempfile, threading
+from collections import OrderedDict
+from mmap import PAGESIZE
+from bpl.code_generator.encoder import ObjectWriter, PC32, ABS32
+from bpl.compiler import CompilerSession, source_bytes
+from bpl.scanner.scanner import Scanner
+
+# how many loaded programs are kept
+CACHED_PROGRAMS = 256
+
+PROT_READ = 0x1
+PROT_WRITE = 0x2
+PROT_EXEC = 0x4
+MAP_PRIVATE = 0x02
+MAP_ANONYMOUS = 0x20
+MAP_32BIT = 0x40
+
+libc = ctypes.CDLL(None, use_errno=True)
+libc.mmap.restype = ctypes.c_void_p
+libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long]
+libc.mprotect.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int]
+libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+libc.fflush.argtypes = [ctypes.c_void_p]
+libc.clearerr.argtypes = [ctypes.c_void_p]
+libc.__fpurge.argtypes = [ctypes.c_void_p]
+libc.__fpurge.restype = None
+
+# main clobbers registers the C calling convention says it keeps, so it's called through
+# a function that saves them, and that calls it with the stack aligned as it would be
+# in an executable
+ENTRY = '''.text
+bpl_run_entry:
+\tpush %rbx
+\tpush %rbp
+\tpush %r12
+\tpush %r13
+\tpush %r14
+\tpush %r15
+\tsub $8, %rsp
+\tcall main
+\tadd $8, %rsp
+\tpop %r15
+\tpop %r14
+\tpop %r13
+\tpop %r12
+\tpop %rbp
+\tpop %rbx
+\tret
+'''
+ENTRY_LABEL = 'bpl_run_entry'
+# calls to the C library go through a stub that aligns the stack for the function, which
+# the generated code doesn't always do, and calls it through the address after it:
+#   push %rbp; mov %rsp, %rbp; and $-16, %rsp; call *2(%rip); leave; ret
+STUB = b'\x55\x48\x89\xe5\x48\x83\xe4\xf0\xff\x15\x02\0\0\0\xc9\xc3'
+STUB_SIZE = 32
+
+class LoadError(Exception):
+    def __init__(self, message):
+        Exception.__init__(self, 'Error: {}'.format(message))
+
+def page_aligned(size):
+    return -(-size // PAGESIZE) * PAGESIZE
+
+class Program(object):
+    """A compiled program loaded into memory, which runs when it's called."""
+
+    def __init__(self, writer):
+        """Load the program encoded by 'writer', an ObjectWriter."""
+        writer.write(ENTRY)
+        writer.flush()
+        if 'main' not in writer.labels:
+            raise LoadError('undefined reference to "main"')
+        text = writer.sections['.text']
+        rodata = writer.sections['.rodata']
+        externals = sorted(set(fixup[3] for fixup in writer.fixups) - set(writer.labels) - set(writer.commons))
+
+        # code and stubs, then read only data, then global variables, each on pages of its own
+        code_size = page_aligned(len(text) + STUB_SIZE * len(externals))
+        rodata_size = page_aligned(len(rodata))
+        common_offsets = {}
+        common_size = 0
+        for name in sorted(writer.commons):
+            size, alignment = writer.commons[name]
+            common_size += -common_size % alignment
+            common_offsets[name] = common_size
+            common_size += size
+        self.size = code_size + rodata_size + page_aligned(common_size)
+        address = libc.mmap(None, self.size, PROT_READ | PROT_WRITE,
+                MAP_PRIVATE | MAP_ANONYMOUS | MAP_32BIT, -1, 0)
+        if address in (None, ctypes.c_void_p(-1).value):
+            raise LoadError('unable to map memory: {}'.format(os.strerror(ctypes.get_errno())))
+        self.address = address
+        bases = {'.text': address, '.rodata': address + code_size}
+        self.globals_address = address + code_size + rodata_size
+        self.globals_size = common_size
+
+        symbols = {}
+        for name, (section, offset) in writer.labels.items():
+            symbols[name] = bases[section] + offset
+        for name, offset in common_offsets.items():
+            symbols[name] = self.globals_address + offset
+        code = bytearray(text)
+        for i, name in enumerate(externals):
+            try:
+                function = ctypes.cast(getattr(libc, name), ctypes.c_void_p).value
+            except AttributeError:
+                raise LoadError('undefined reference to "{}"'.format(name))
+            symbols[name] = address + len(text) + STUB_SIZE * i
+            code += STUB + struct.pack('<Q', function) + b'\0' * (STUB_SIZE - len(STUB) - 8)
+        sections = {'.text': code, '.rodata': bytearray(rodata)}
+        for section, offset, kind, label, addend in writer.fixups:
+            value = symbols[label] + addend
+            if kind is PC32:
+                value -= bases[section] + offset
+            if not (0 <= value < 2 ** 32 if kind is ABS32 else -2 ** 31 <= value < 2 ** 31):
+                raise LoadError('"{}" is out of range'.format(label))
+            struct.pack_into('<I' if kind is ABS32 else '<i', sections[section], offset, value)
+
+        ctypes.memmove(address, bytes(code), len(code))
+        ctypes.memmove(bases['.rodata'], bytes(sections['.rodata']), len(rodata))
+        libc.mprotect(address, code_size, PROT_READ | PROT_EXEC)
+        if rodata_size:
+            libc.mprotect(bases['.rodata'], rodata_size, PROT_READ)
+        self.entry = ctypes.CFUNCTYPE(ctypes.c_int)(symbols[ENTRY_LABEL])
+
+    def __call__(self):
+        """Run the program from the start of main, returning the value main returns."""
+        ctypes.memset(self.globals_address, 0, self.globals_size)
+        try:
+            return self.entry()
+        finally:
+            libc.fflush(None)
+
+    def __del__(self):
+        # the module's globals may already be gone if the interpreter is exiting
+        if getattr(self, 'address', None) is not None and libc is not None:
+            libc.munmap(self.address, self.size)
+
+programs = OrderedDict()
+programs_lock = threading.Lock()
+# a run takes over the process's standard input and output
+run_lock = threading.Lock()
+
+def load(source, scanner_class=Scanner, cache=None, optimization_level=0):
+    """Return the loaded Program for the BPL program 'source', compiling it unless it was loaded recently.
+
+    'source' may be anything CompilerSession.compile() takes. 'scanner_class', 'cache', and 'optimization_level' are passed on to the CompilerSession that compiles it.
+    Compilation errors are raised as for CompilerSession.compile().
+    """
+    source = source_bytes(source)
+    key = (hashlib.sha1(source).digest(), optimization_level)
+    with programs_lock:
+        program = programs.pop(key, None)
+        if program is not None:
+            programs[key] = program
+            return program
+    writer = ObjectWriter()
+    CompilerSession(scanner_class, cache, optimization_level).compile(source, writer)
+    program = Program(writer)
+    with programs_lock:
+        programs[key] = program
+        while len(programs) > CACHED_PROGRAMS:
+            programs.popitem(last=False)
+    return program
+
+def run(source, input=None, optimization_level=0):
+    """Compile and run the BPL program 'source', returning the value main returns and everything it printed.
+
+    If 'input' is given, the program reads it from its standard input; otherwise it
+    reads this process's standard input. The program is compiled at 'optimization_level'.
+    """
+    program = load(source, optimization_level=optimization_level)
+    with run_lock, tempfile.TemporaryFile() as output:
+        stdin = ctypes.c_void_p.in_dll(libc, 'stdin')
+        libc.fflush(None)
+        saved_stdout = os.dup(1)
+        saved_stdin = os.dup(0) if input is not None else None
+        try:
+            os.dup2(output.fileno(), 1)
+            if input is not None:
+                input_file = tempfile.TemporaryFile()
+                input_file.write(input)
+                input_file.seek(0)
+                os.dup2(input_file.fileno(), 0)
+                input_file.close()
+                # forget anything read from the previous standard input
+                libc.__fpurge(stdin)
+                libc.clearerr(stdin)
+            status = program()
+        finally:
+            os.dup2(saved_stdout, 1)
+            os.close(saved_stdout)
+            if saved_stdin is not None:
+                os.dup2(saved_stdin, 0)
+                os.close(saved_stdin)
+                libc.__fpurge(stdin)
+                libc.clearerr(stdin)
+        output.seek(0)
+        return status, output.read()
@@ -5,6 +5,7 @@ DATE: Feb. 16, 2014
 A lexical scanner for the BPL programming language. Implemented for CS331 at Oberlin College.
 """
 
+import re
 from bpl.scanner.token import TokenType, Token
 
 class ScannerException(Exception):
@@ -31,6 +32,11 @@ class Scanner(object):
                 'T_WHILE', 'T_RETURN', 'T_WRITE', 'T_WRITELN', 'T_READ']
         self.keyword_hash = dict(zip(self.keywords, keyword_tokens)) 
 
+    # Returns the current Token, for the parser to keep in a parse tree node.
+    # A new Token is made for every lexeme, so this is just next_token.
+    def token(self):
+        return self.next_token
+
     # Sets next_token to be the next Token in the input file.
     # This method is one giant if/elif/else statement and I wish
     # it were cleaner, but there aren't a lot of better ways to do this.
@@ -200,3 +206,205 @@ class Scanner(object):
                 raise ScannerException(self.line_number, i, "Unidentifiable token.")
                 #print("Scanning Error: Unidentifiable token at line " + str(self.line_number) + ", index " + str(i) + ".")
                 #exit()
+
+# The BufferScanner is a drop-in replacement for the Scanner that reads the
+# whole input file into memory once and then walks an integer cursor through
+# the buffer, instead of re-slicing the current line after every Token. Blank
+# lines and comments are skipped in a loop rather than by recursion, so long
+# runs of them cannot hit the recursion limit. It produces the same Tokens,
+# line numbers, and ScannerException messages as the Scanner.
+class BufferScanner(object):
+
+    # Characters that always form a Token on their own.
+    single_tokens = {'+': 'T_PLUS', '-': 'T_MINUS', ';': 'T_SEMICOLON',
+            ',': 'T_COMMA', '[': 'T_LBRACKET', ']': 'T_RBRACKET',
+            '{': 'T_LBRACE', '}': 'T_RBRACE', '(': 'T_LPAREN', ')': 'T_RPAREN',
+            '*': 'T_MULT', '/': 'T_DIV', '%': 'T_MOD', '&': 'T_AND'}
+
+    # Characters that form one Token on their own and another when followed by '='.
+    relational_tokens = {'<': ('T_LESS', 'T_LEQ'), '>': ('T_GREATER', 'T_GEQ'),
+            '=': ('T_ASSIGN', 'T_EQ'), '!': (None, 'T_NEQ')}
+
+    # Constructor for the BufferScanner. Takes a file object as the only parameter
+    # and reads its entire contents into the buffer.
+    def __init__(self, input_file):
+        self.input_file = input_file
+        self.buffer = self.input_file.read()
+        self.index = 0 # position of the cursor in the buffer
+        # start of the unconsumed part of the current line; the Scanner reports
+        # error indices relative to this position, so we have to track it too
+        self.segment_start = 0
+        self.line_number = 1
+        self.next_token = None
+        self.keywords = ["int", "void", "string", "if", "else", "while",
+                "return", "write", "writeln", "read"]
+        keyword_tokens = ['T_INT', 'T_VOID', 'T_STRING', 'T_IF', 'T_ELSE',
+                'T_WHILE', 'T_RETURN', 'T_WRITE', 'T_WRITELN', 'T_READ']
+        self.keyword_hash = dict(zip(self.keywords, keyword_tokens))
+
+    # Returns the current Token, for the parser to keep in a parse tree node.
+    # A new Token is made for every lexeme, so this is just next_token.
+    def token(self):
+        return self.next_token
+
+    # Sets next_token to be the next Token in the buffer.
+    def get_next_token(self):
+        buf = self.buffer
+        n = len(buf)
+        i = self.index
+        while True:
+            # skip over whitespace, counting the lines we pass
+            while i < n and buf[i].isspace():
+                # a newline only starts a new line if something follows it
+                if buf[i] == '\n' and i+1 < n:
+                    self.line_number += 1
+                    self.segment_start = i+1
+                i += 1
+            # skip over comments
+            if buf.startswith('/*', i):
+                j = buf.find('*/', i+2)
+                if j == -1:
+                    raise ScannerException(self.line_number, i - self.segment_start, 'Expected an additional "*/" to close the comment block.')
+                newline = buf.find('\n', i, j)
+                while newline != -1:
+                    self.line_number += 1
+                    newline = buf.find('\n', newline+1, j)
+                i = j+2
+                self.segment_start = i
+            else:
+                break
+
+        if i >= n: # we've hit the end of the buffer
+            self.index = i
+            self.next_token = Token('T_EOF', "", self.line_number)
+            self.input_file.close()
+            return
+
+        c = buf[i]
+        j = i+1
+        # handle number Tokens
+        if c.isdigit():
+            while j < n and buf[j].isdigit():
+                j += 1
+            self.next_token = Token('T_NUM', buf[i:j], self.line_number)
+        # handle identifier and keyword Tokens
+        elif c.isalpha():
+            while j < n and buf[j].isalnum():
+                j += 1
+            token_string = buf[i:j]
+            self.next_token = Token(self.keyword_hash.get(token_string, 'T_ID'), token_string, self.line_number)
+        # handle string Tokens, which may not span multiple lines
+        elif c == '"':
+            line_end = buf.find('\n', j)
+            if line_end == -1:
+                line_end = n
+            j = buf.find('"', j, line_end)
+            if j == -1:
+                raise ScannerException(self.line_number, i - self.segment_start, "Expected an additional '\"' to close the string.")
+            self.next_token = Token('T_STRVAL', buf[i+1:j], self.line_number)
+            j += 1
+        # handle two character Tokens and their one character prefixes
+        elif c in self.relational_tokens:
+            if buf.startswith('=', j):
+                j += 1
+                self.next_token = Token(self.relational_tokens[c][1], c + '=', self.line_number)
+            elif c == '!':
+                raise ScannerException(self.line_number, i - self.segment_start, "Unidentifiable token.")
+            else:
+                self.next_token = Token(self.relational_tokens[c][0], c, self.line_number)
+        # handle single character Tokens
+        elif c in self.single_tokens:
+            self.next_token = Token(self.single_tokens[c], c, self.line_number)
+        # we've hit something we can't recognize
+        else:
+            raise ScannerException(self.line_number, i - self.segment_start, "Unidentifiable token.")
+        self.index = self.segment_start = j
+
+# The TableScanner is a table-driven drop-in replacement for the Scanner. One
+# compiled regular expression skips the whitespace and comments before the next
+# lexeme and matches it, and the group that matched picks its kind: keywords and
+# operators are looked up in dictionaries of TokenTypes instead of walking an
+# if/elif chain. Anything the expression doesn't match is an error, which is
+# reported by handing the cursor back to the BufferScanner so the exception
+# messages stay identical.
+class TableScanner(BufferScanner):
+
+    # one lexeme, preceded by any whitespace and comments; the comment pattern
+    # can't be stretched past the first "*/"
+    lexeme_pattern = re.compile(r'''
+        (?:\s+|/\*[^*]*\*+(?:[^*/][^*]*\*+)*/)*
+        (?:
+            ([A-Za-z][A-Za-z0-9]*)                      # 1: identifier or keyword
+          | ([0-9]+)                                    # 2: number
+          | "([^"\n]*)"                                 # 3: string
+          | (<=|>=|==|!=|/(?!\*)|[-+;,\[\]{}()<>=*%&])  # 4: operator
+        )''', re.VERBOSE)
+
+    # whitespace and comments at the end of the buffer
+    trailing_pattern = re.compile(r'(?:\s+|/\*[^*]*\*+(?:[^*/][^*]*\*+)*/)*\Z')
+
+    # Operator and punctuation strings mapped to their TokenTypes.
+    operator_tokens = {'+': 'T_PLUS', '-': 'T_MINUS', ';': 'T_SEMICOLON',
+            ',': 'T_COMMA', '[': 'T_LBRACKET', ']': 'T_RBRACKET',
+            '{': 'T_LBRACE', '}': 'T_RBRACE', '(': 'T_LPAREN', ')': 'T_RPAREN',
+            '*': 'T_MULT', '/': 'T_DIV', '%': 'T_MOD', '&': 'T_AND',
+            '<': 'T_LESS', '<=': 'T_LEQ', '>': 'T_GREATER', '>=': 'T_GEQ',
+            '=': 'T_ASSIGN', '==': 'T_EQ', '!=': 'T_NEQ'}
+
+    # Keyword and operator strings mapped straight to their integer TokenTypes,
+    # so that Tokens can be made without looking the names up in TokenType.
+    word_kinds = dict((word, getattr(TokenType, 'T_' + word.upper())) for word in
+            ["int", "void", "string", "if", "else", "while", "return", "write", "writeln", "read"])
+    operator_kinds = dict((operator, getattr(TokenType, kind)) for operator, kind in operator_tokens.items())
+
+    # Constructor for the TableScanner, which also keeps the methods it calls for
+    # every Token, so they aren't looked up each time.
+    def __init__(self, input_file):
+        BufferScanner.__init__(self, input_file)
+        self.match_lexeme = self.lexeme_pattern.match
+        self.word_kind = self.word_kinds.get
+
+    # Sets next_token to be the next Token in the buffer.
+    def get_next_token(self):
+        buf = self.buffer
+        i = self.index
+        line_number = self.line_number
+        m = self.match_lexeme(buf, i)
+        if m is None:
+            if self.trailing_pattern.match(buf, i) is None:
+                # let the BufferScanner find and report the error, starting over
+                # from the end of the last Token
+                self.segment_start = i
+                return BufferScanner.get_next_token(self)
+            # a newline at the very end of the buffer doesn't start a new line
+            self.line_number = line_number + buf.count('\n', i, max(len(buf) - 1, i))
+            self.next_token = Token('T_EOF', "", self.line_number)
+            self.index = self.segment_start = len(buf)
+            self.input_file.close()
+            return
+
+        group = m.lastindex
+        start, j = m.span(group)
+        if start != i:
+            # only make a new line number at a new line, so the Tokens on a line share it
+            newlines = buf.count('\n', i, start)
+            if newlines:
+                line_number += newlines
+        value = buf[start:j]
+        if group == 4:
+            kind = self.operator_kinds[value]
+        elif group == 1:
+            kind = self.word_kind(value, TokenType.T_ID)
+        elif group == 2:
+            kind = TokenType.T_NUM
+        else:
+            kind = TokenType.T_STRVAL
+            j += 1 # the closing quote
+
+        self.line_number = line_number
+        token = Token.__new__(Token)
+        token.kind = kind
+        token.value = value
+        token.line_number = line_number
+        self.next_token = token
+        self.index = j
@@ -59,6 +59,10 @@ TokenType = enum('T_ID',
 # the actual string it represents, and the line number on which it occurs.
 class Token(object):
 
+    # Tokens are kept alive by the parse tree nodes that refer to them, so
+    # they don't carry an instance __dict__
+    __slots__ = ('kind', 'value', 'line_number')
+
     # kind should be a string that is a valid TokenType (see above)
     # value should be a string
     # line_number should be an integer
@@ -0,0 +1,217 @@
+"""
+A compact, array-backed token stream for the BPL scanner.
+
+A TokenStream scans a whole buffer up front, but instead of allocating a Token
+for every lexeme it records each one in parallel integer arrays: its kind, the
+offset and length of its value in the buffer, and its line number. Values are
+sliced out of the buffer only when they are asked for. A StreamScanner walks a
+cursor through a TokenStream and exposes the same interface as the Scanner, but
+its next_token reads the arrays at the cursor rather than being a new Token, so
+the Parser only gets a Token for the type and operator tokens it keeps in nodes.
+"""
+
+from array import array
+from StringIO import StringIO
+from bpl.scanner.token import TokenType, Token
+from bpl.scanner.scanner import Scanner, BufferScanner, TableScanner
+
+# kind recorded for the position at which scanning failed
+ERROR_KIND = -1
+
+# the patterns and tables the TableScanner matches lexemes with: one lexeme and the
+# whitespace and comments before it, whitespace and comments at the end of the
+# buffer, and keyword and operator strings mapped directly to their integer TokenTypes
+lexeme_pattern = TableScanner.lexeme_pattern
+trailing_pattern = TableScanner.trailing_pattern
+word_kinds = TableScanner.word_kinds
+operator_kinds = TableScanner.operator_kinds
+# the value of each keyword and operator token, by kind
+token_values = dict((kind, value) for value, kind in word_kinds.items() + operator_kinds.items())
+
+class TokenStream(object):
+    """All of the tokens in a buffer, stored as parallel arrays of kinds, value offsets, value lengths, and line numbers."""
+
+    def __init__(self, buffer, start=0, stop=None, line_number=1):
+        """Scan 'buffer' (a string) into parallel arrays.
+
+        Only buffer[start:stop] is scanned, if 'start' or 'stop' is given, and 'line_number'
+        is the line that 'start' is on. The last token is always either T_EOF (at 'stop')
+        or, if the text contains a lexical error, an ERROR_KIND token that marks where
+        scanning stopped.
+        """
+        self.buffer = buffer
+        self.start = start
+        self.stop = len(buffer) if stop is None else stop
+        self.first_line = line_number
+        self.kinds = array('i')
+        self.starts = array('i')
+        self.lengths = array('i')
+        self.lines = array('i')
+        self.scan()
+
+    def scan(self):
+        """Fill the token arrays. No Token objects are allocated here."""
+        buf = self.buffer
+        add_kind = self.kinds.append
+        add_start = self.starts.append
+        add_length = self.lengths.append
+        add_line = self.lines.append
+        get_word = word_kinds.get
+        T_ID = TokenType.T_ID
+        T_NUM = TokenType.T_NUM
+        T_STRVAL = TokenType.T_STRVAL
+        line_number = self.first_line
+        end = self.start
+        limit = self.stop
+        match = lexeme_pattern.scanner(buf, end, limit).match
+        m = match()
+        while m is not None:
+            group = m.lastindex
+            start, stop = m.span(group)
+            if start != end:
+                line_number += buf.count('\n', end, start)
+            if group == 1:
+                kind = get_word(buf[start:stop], T_ID)
+            elif group == 4:
+                kind = operator_kinds[buf[start:stop]]
+            elif group == 2:
+                kind = T_NUM
+            else:
+                kind = T_STRVAL
+            add_kind(kind)
+            add_start(start)
+            add_length(stop - start)
+            add_line(line_number)
+            end = m.end()
+            m = match()
+
+        if trailing_pattern.match(buf, end, limit):
+            # a newline at the very end of the buffer doesn't start a new line
+            line_number += buf.count('\n', end, max(limit - 1, end))
+            kind = TokenType.T_EOF
+        else:
+            kind = ERROR_KIND
+        add_kind(kind)
+        add_start(end)
+        add_length(0)
+        add_line(line_number)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def value(self, index):
+        """Return the string value of the token at 'index'."""
+        start = self.starts[index]
+        return self.buffer[start:start + self.lengths[index]]
+
+    def token(self, index):
+        """Return a Token for the token at 'index'."""
+        token = Token.__new__(Token)
+        token.kind = self.kinds[index]
+        token.value = self.value(index)
+        token.line_number = self.lines[index]
+        return token
+
+    def error_scanner(self, index):
+        """Return a BufferScanner positioned at the ERROR_KIND token at 'index'.
+
+        Its get_next_token() raises the same ScannerException the other scanners
+        raise for this error, since it rescans from the end of the previous token.
+        """
+        scanner = BufferScanner(StringIO(self.buffer))
+        if index > 0:
+            scanner.line_number = self.lines[index - 1]
+        else:
+            scanner.line_number = self.first_line
+        scanner.index = scanner.segment_start = self.starts[index]
+        return scanner
+
+class TokenCursor(Token):
+    """The token under a StreamScanner's cursor.
+
+    Its kind and line number are copied out of the stream's arrays as the cursor
+    moves, and its value is sliced out of the buffer only when it's asked for. The
+    same TokenCursor moves on with the scanner, so a parser that keeps a token in a
+    node asks the scanner for a Token with token() instead.
+    """
+    __slots__ = ('stream', 'index')
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.index = -1
+        self.kind = None
+        self.line_number = 1
+
+    @property
+    def value(self):
+        return self.stream.value(self.index)
+
+class StreamScanner(object):
+    """A cursor over a TokenStream with the same interface as the Scanner.
+
+    next_token is a TokenCursor rather than a new Token for each lexeme.
+    """
+
+    def __init__(self, input_file):
+        """Scan all of 'input_file' into a TokenStream and position the cursor before its first token."""
+        self.input_file = input_file
+        self.stream = TokenStream(input_file.read())
+        self.index = -1
+        self.line_number = 1
+        self.next_token = TokenCursor(self.stream)
+
+    @classmethod
+    def from_stream(cls, stream, index=-1):
+        """Return a StreamScanner over an existing TokenStream, positioned just before the token at 'index' + 1."""
+        scanner = cls.__new__(cls)
+        scanner.input_file = None
+        scanner.stream = stream
+        scanner.index = index
+        scanner.line_number = stream.lines[index] if index >= 0 else 1
+        scanner.next_token = TokenCursor(stream)
+        return scanner
+
+    def get_next_token(self):
+        """Advance the cursor and point next_token at the token under it."""
+        index = self.index + 1
+        stream = self.stream
+        kind = stream.kinds[index]
+        if kind < 0: # ERROR_KIND
+            scanner = stream.error_scanner(index)
+            try:
+                scanner.get_next_token()
+            finally:
+                self.line_number = scanner.line_number
+        if kind == TokenType.T_EOF:
+            # stay on the T_EOF token if we're asked to advance past it
+            if self.input_file is not None:
+                self.input_file.close()
+        else:
+            self.index = index
+        cursor = self.next_token
+        cursor.kind = kind
+        cursor.index = index
+        # reading the array makes a new int, so keep the one the nodes on this line already share
+        line_number = stream.lines[index]
+        if line_number != self.line_number:
+            self.line_number = line_number
+        cursor.line_number = self.line_number
+
+    def token(self):
+        """Return a Token for the token under the cursor, which stays the same after the cursor moves on."""
+        cursor = self.next_token
+        token = Token.__new__(Token)
+        token.kind = cursor.kind
+        # keywords and operators share one string for each kind, rather than a slice of the buffer each
+        if cursor.kind in token_values:
+            token.value = token_values[cursor.kind]
+        else:
+            token.value = cursor.value
+        token.line_number = cursor.line_number
+        return token
+
+# scanner implementations that can be selected by name, e.g. from bplc; they're kept
+# here, with the last of them, so that the names can be listed without importing the
+# rest of the compiler
+SCANNERS = {'line': Scanner, 'buffer': BufferScanner, 'table': TableScanner,
+        'stream': StreamScanner}
@@ -0,0 +1,118 @@
+"""
+A compile server, which keeps the compiler loaded between compilations.
+
+Starting Python and importing the compiler takes longer than compiling a small file,
+so "bplc --server SOCKET" runs a CompileServer listening on a Unix domain socket, and
+"bplc --connect SOCKET FILE" has it compile each file instead. A request is a JSON
+object holding the program's source, the path to write the assembly or executable to,
+and whether to stop at assembly; the client shuts down its side of the connection once
+it's sent, and the server replies with a JSON object holding an exit status and any
+diagnostics. Strings are sent as Latin-1, so a source file that isn't valid UTF-8
+goes through unchanged. The server remembers the assembly of the programs it compiled most
+recently, so a file that hasn't changed since its last compilation is just looked up.
+"""
+
+import hashlib, json, os, socket, threading, SocketServer
+from collections import OrderedDict
+from bpl.client import receive_all
+from bpl.code_generator.encoder import EncodingError
+from bpl.compiler import CompilerSession
+from bpl.parser.parser import ParserException
+from bpl.scanner.scanner import ScannerException
+from bpl.toolchain import build_executable
+from bpl.type_checker.type_checker import TypeCheckerException
+
+# how many programs' assembly code the server remembers
+CACHED_PROGRAMS = 256
+
+class CompileRequestHandler(SocketServer.BaseRequestHandler):
+
+    def handle(self):
+        request = receive_all(self.request)
+        # a connection that sends nothing is just checking whether the server is running
+        if request:
+            try:
+                request = json.loads(request)
+                request = {'source': request['source'].encode('latin-1'), 'output': request['output'].encode('latin-1'),
+                        'stop_at_assembly': request['stop_at_assembly']}
+            except (ValueError, KeyError, TypeError, AttributeError, UnicodeError):
+                reply = {'status': 1, 'message': 'Error: The compile server received a malformed request.'}
+            else:
+                reply = self.server.handle_compilation(request)
+            reply['message'] = reply['message'].decode('latin-1')
+            self.request.sendall(json.dumps(reply))
+
+class CompileServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """Compiles the programs sent to a Unix domain socket, each in a thread of its own."""
+    daemon_threads = True
+
+    def __init__(self, socket_path, session=None, assembler='as'):
+        """Listen on 'socket_path', compiling programs with 'session' (by default, a new CompilerSession).
+
+        Executables are built with 'assembler', which is passed on to build_executable().
+        A socket file left behind by a server that's no longer running is replaced, but
+        one that a server is still listening on is not.
+        """
+        if os.path.exists(socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+            except socket.error:
+                os.remove(socket_path)
+            finally:
+                probe.close()
+        self.bound = False
+        SocketServer.UnixStreamServer.__init__(self, socket_path, CompileRequestHandler)
+        self.session = session if session is not None else CompilerSession()
+        self.assembler = assembler
+        self.programs = OrderedDict()
+        self.programs_lock = threading.Lock()
+
+    def server_bind(self):
+        SocketServer.UnixStreamServer.server_bind(self)
+        self.bound = True
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        # only remove the socket file if it's this server's, not another's it failed to replace
+        if self.bound and os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+    def compile(self, source):
+        """Return the assembly code for the program 'source', reusing it if the program was compiled recently."""
+        key = hashlib.sha1(source).digest()
+        with self.programs_lock:
+            assembly = self.programs.pop(key, None)
+            if assembly is not None:
+                self.programs[key] = assembly
+                return assembly
+        assembly = self.session.compile(source)
+        with self.programs_lock:
+            self.programs[key] = assembly
+            while len(self.programs) > CACHED_PROGRAMS:
+                self.programs.popitem(last=False)
+        return assembly
+
+    def handle_compilation(self, request):
+        """Carry out a client's request, returning the reply to send back."""
+        try:
+            assembly = self.compile(request['source'])
+        except (ScannerException, ParserException, TypeCheckerException) as e:
+            return {'status': 1, 'message': e.message}
+        except Exception as e: # a bug in the compiler shouldn't leave the client without a reply
+            return {'status': 1, 'message': 'Error: {}: {}'.format(type(e).__name__, e)}
+        output_path = request['output']
+        try:
+            if request['stop_at_assembly']:
+                with open(output_path, 'w') as assembly_file:
+                    assembly_file.write(assembly)
+                return {'status': 0, 'message': ''}
+            status, message = build_executable(lambda assembly_file: assembly_file.write(assembly), output_path,
+                    self.assembler)
+        except EncodingError as e:
+            return {'status': 1, 'message': e.message}
+        except (IOError, OSError):
+            return {'status': 1, 'message': 'Error: Unable to write {}.'.format(output_path)}
+        except Exception as e:
+            return {'status': 1, 'message': 'Error: {}: {}'.format(type(e).__name__, e)}
+        return {'status': 1 if status else 0, 'message': message.rstrip('\n')}
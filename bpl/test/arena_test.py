@@ -0,0 +1,50 @@
+from bpl.parser.arena import ASTArena, ArenaException
+from bpl.parser.parser import Parser, ParserException
+from bpl.parser.parsetree import NodeType
+from bpl.scanner.scanner import ScannerException
+from bpl.type_checker.type_checker import TypeCheckerException, type_check
+import sys
+
+if __name__ == "__main__":
+    file_name = "bpl/test/test3.bpl"
+    if len(sys.argv) > 1:
+        file_name = sys.argv[1]
+    try:
+        input_file = open(file_name)
+    except IOError:
+        print("Error: File not found!")
+        sys.exit()
+    try:
+        parser = Parser(input_file)
+        parse_tree = parser.parse()
+    except (ScannerException, ParserException) as e:
+        print e.message
+        sys.exit()
+    arena = ASTArena.from_tree(parse_tree)
+    if str(arena.to_tree()) != str(parse_tree):
+        print 'Error: the parse tree rebuilt from the arena differs from the original!'
+        sys.exit(1)
+    arena = ASTArena.from_bytes(arena.to_bytes())
+    if str(arena.to_tree()) != str(parse_tree):
+        print 'Error: the parse tree rebuilt from the serialized arena differs from the original!'
+        sys.exit(1)
+    # serialized arenas that are cut short or have anything after them are rejected
+    data = arena.to_bytes()
+    for damaged in (data[:10], data[:-1], data + '\0'):
+        try:
+            ASTArena.from_bytes(damaged)
+        except ArenaException:
+            continue
+        print 'Error: a damaged serialized arena was read without an error!'
+        sys.exit(1)
+    print 'Node Counts:\n'
+    for kind, count in sorted(arena.kind_counts().items()):
+        print '{}: {}'.format(NodeType.names[kind], count)
+    print '\nType Checked Arena:\n'
+    try:
+        type_check(arena.root(), False)
+    except TypeCheckerException as t:
+        print t.message
+        sys.exit()
+    print arena.root()
+    input_file.close()
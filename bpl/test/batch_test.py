@@ -0,0 +1,65 @@
+from bpl.batch import compile_batch
+from bpl.compiler import compile
+from bpl.parser.parser import ParserException
+from bpl.scanner.scanner import ScannerException
+from bpl.type_checker.type_checker import TypeCheckerException
+from StringIO import StringIO
+import os, shutil, sys, tempfile
+
+if __name__ == "__main__":
+    file_name = "bpl/test/test3.bpl"
+    if len(sys.argv) > 1:
+        file_name = sys.argv[1]
+    try:
+        input_file = open(file_name)
+    except IOError:
+        print("Error: File not found!")
+        sys.exit()
+    source = input_file.read()
+    input_file.close()
+    try:
+        expected = StringIO()
+        compile(StringIO(source), expected)
+        expected = expected.getvalue()
+    except (ScannerException, ParserException, TypeCheckerException) as e:
+        expected = e.message
+
+    # compile several copies of the file at once, with a missing file among them
+    directory = tempfile.mkdtemp()
+    try:
+        file_names = []
+        for i in range(4):
+            file_names.append(os.path.join(directory, 'copy{}.bpl'.format(i)))
+            with open(file_names[-1], 'w') as copy:
+                copy.write(source)
+        file_names.insert(2, os.path.join(directory, 'missing.bpl'))
+        output_dir = os.path.join(directory, 'output')
+        results = list(compile_batch(file_names, output_dir, 2, True))
+        if [result[0] for result in results] != file_names:
+            print 'Error: the batch results are not in the order the files were given!'
+            sys.exit(1)
+        if results[2][1] != 'Error: Unable to open .bpl file.':
+            print 'Error: the missing file was not reported!'
+            sys.exit(1)
+        del results[2]
+        for copy_name, error in results:
+            if error is None:
+                assembly_name = os.path.splitext(os.path.basename(copy_name))[0] + '.s'
+                with open(os.path.join(output_dir, assembly_name)) as assembly_file:
+                    error = assembly_file.read()
+            if error != expected:
+                print 'Error: the batch output for {} differs from the compiler\'s output!'.format(copy_name)
+                sys.exit(1)
+        # files in different directories with the same name would overwrite each other's output
+        os.mkdir(os.path.join(directory, 'other'))
+        duplicate = os.path.join(directory, 'other', 'copy0.bpl')
+        shutil.copy(file_names[0], duplicate)
+        results = list(compile_batch([file_names[0], duplicate, file_names[1]], output_dir, 1, True))
+        if results[0][1] is None or results[1][1] is None or results[2][1] is not None and results[2][1] != expected:
+            print 'Error: files compiled to the same path were not reported!'
+            sys.exit(1)
+        print results[0][1]
+        print
+        print expected
+    finally:
+        shutil.rmtree(directory)
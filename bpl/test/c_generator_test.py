@@ -0,0 +1,31 @@
+from bpl.code_generator.c_generator import generate_c
+from bpl.scanner.scanner import ScannerException
+from bpl.parser.parser import ParserException, Parser
+from bpl.type_checker.type_checker import TypeCheckerException, type_check
+import sys
+
+if __name__ == "__main__":
+    file_name = "bpl/test/test3.bpl"
+    if len(sys.argv) > 1:
+        file_name = sys.argv[1]
+    if not file_name.endswith('.bpl'):
+        print "Error: File is not a .bpl file!"
+        sys.exit()
+    try:
+        input_file = open(file_name)
+    except IOError:
+        print "Error: File not found!"
+        sys.exit()
+    try:
+        parser = Parser(input_file)
+        parse_tree = parser.parse()
+    except (ScannerException, ParserException) as e:
+        print e.message
+        sys.exit()
+    try:
+        type_check(parse_tree)
+    except TypeCheckerException as t:
+        print t.message
+        sys.exit()
+    input_file.close()
+    generate_c(parse_tree, sys.stdout)
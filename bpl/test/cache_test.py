@@ -0,0 +1,56 @@
+from bpl.cache import CompilationCache
+import bpl.cache
+from bpl.compiler import compile
+from bpl.parser.parser import ParserException
+from bpl.scanner.scanner import ScannerException
+from bpl.type_checker.type_checker import TypeCheckerException
+from StringIO import StringIO
+import shutil, sys, tempfile
+
+if __name__ == "__main__":
+    file_name = "bpl/test/test3.bpl"
+    if len(sys.argv) > 1:
+        file_name = sys.argv[1]
+    try:
+        input_file = open(file_name)
+    except IOError:
+        print("Error: File not found!")
+        sys.exit()
+    source = input_file.read()
+    input_file.close()
+    cache = CompilationCache(tempfile.mkdtemp())
+    try:
+        # the first compilation misses and fills the cache, the second one hits
+        first = StringIO()
+        compile(StringIO(source), first, cache=cache)
+        key = cache.key(source)
+        if cache.load_assembly(key) is None:
+            print 'Error: the compilation result was not cached!'
+            sys.exit(1)
+        second = StringIO()
+        compile(StringIO(source), second, cache=cache)
+        if first.getvalue() != second.getvalue():
+            print 'Error: the cached assembly differs from the compiled assembly!'
+            sys.exit(1)
+        print 'Cached Functions:\n'
+        for name, code in cache.load_functions(key):
+            print '{}: {} bytes'.format(name, len(code))
+        print '\nCached Type Checked Tree:\n'
+        print cache.load_tree(key).root()
+        # a damaged file of incremental units is a miss
+        cache.store_units(file_name, {'unit': 1})
+        with open(cache.units_path(file_name), 'r+b') as f:
+            f.truncate(4)
+        if cache.load_units(file_name) != {}:
+            print 'Error: a damaged file of units was not treated as a miss!'
+            sys.exit(1)
+        # a change to the compiler's modules changes the key, so the entry isn't used
+        bpl.cache.compiler_hash = 'changed'
+        if cache.key(source) == key:
+            print 'Error: the key does not depend on the compiler!'
+            sys.exit(1)
+    except (ScannerException, ParserException, TypeCheckerException) as e:
+        print e.message
+        sys.exit()
+    finally:
+        shutil.rmtree(cache.directory)
@@ -0,0 +1,93 @@
+from bpl.code_generator.code_generator import label_scope
+from bpl.code_generator.encoder import EncodingError
+from bpl.code_generator.lowering import FunctionLowering
+from bpl.code_generator.register_allocation import ARGUMENT_REGISTERS
+from bpl.ir.ir import Opcode, build_ir
+from bpl.ir.passes import optimize
+from bpl.parser.parser import ParserException, Parser
+from bpl.runner import LoadError
+from bpl.scanner.scanner import ScannerException
+from bpl.test.native import check_output
+from bpl.type_checker.type_checker import TypeCheckerException, type_check
+from bpl.vm.machine import VMError
+from StringIO import StringIO
+import sys
+
+if __name__ == "__main__":
+    # a program whose calls pass more than six arguments, arrays, and addresses of arguments
+    file_name = "bpl/test/test7.bpl"
+    if len(sys.argv) > 1:
+        file_name = sys.argv[1]
+    # numbers the program reads, if it reads any
+    program_input = ' '.join(sys.argv[2:]) + '\n'
+    try:
+        input_file = open(file_name)
+    except IOError:
+        print 'Error: File not found!'
+        sys.exit()
+    source = input_file.read()
+    input_file.close()
+    try:
+        parse_tree = Parser(StringIO(source)).parse()
+        type_check(parse_tree)
+    except (ScannerException, ParserException, TypeCheckerException) as e:
+        print e.message
+        sys.exit()
+    with label_scope():
+        program = optimize(build_ir(parse_tree), 2)
+        lowerings = []
+        for function in program.functions:
+            lowering = FunctionLowering(function, StringIO())
+            lowering.lower()
+            code = [line.split(' #')[0].strip() for line in lowering.output_file.getvalue().splitlines()]
+            lowerings.append((function, lowering, code))
+
+    print 'Parameters at -O2:\n'
+    for function, lowering, code in lowerings:
+        print '{}:'.format(function.name)
+        for i, (param, variable) in enumerate(lowering.params):
+            if variable in lowering.registers:
+                home = '%' + lowering.registers[variable]
+            else:
+                home = '{}(%rbx)'.format(lowering.frame_offset(param.offset))
+            if i < len(ARGUMENT_REGISTERS):
+                # a parameter that lives in memory must be stored there before anything can overwrite its register
+                arrival = '%' + ARGUMENT_REGISTERS[i]
+                if variable not in lowering.registers and 'movq {}, {}'.format(arrival, home) not in code:
+                    print 'Error: the parameter {} of {} is never stored in its frame cell!'.format(param.name,
+                            function.name)
+                    sys.exit(1)
+            else:
+                arrival = '{}(%rbx)'.format(16 + 8 * (i - len(ARGUMENT_REGISTERS)))
+                if variable in lowering.registers and 'movq {}, {}'.format(arrival, home) not in code:
+                    print 'Error: the parameter {} of {} is never loaded into its register!'.format(param.name,
+                            function.name)
+                    sys.exit(1)
+            print '    {:<8} passed in {:<10} kept in {}{}'.format(param.name, arrival, home,
+                    '' if variable is not None else ', its address is taken')
+
+    print '\nCalls at -O2:\n'
+    for function, lowering, code in lowerings:
+        position = 0
+        for instruction in function.instructions():
+            if instruction.opcode != Opcode.CALL:
+                continue
+            position = code.index('call ' + instruction.symbol, position)
+            # the arguments after the first six are pushed, and popped once the call returns
+            stacked = max(0, len(instruction.operands) - len(ARGUMENT_REGISTERS))
+            position += 1
+            popped = code[position] if position < len(code) else ''
+            if (popped == 'addq ${}, %rsp'.format(8 * stacked)) != bool(stacked):
+                print 'Error: the call from {} to {} doesn\'t pop its {} stack arguments!'.format(function.name,
+                        instruction.symbol, stacked)
+                sys.exit(1)
+            print '    {} calls {} with {} arguments, {} of them on the stack'.format(function.name,
+                    instruction.symbol, len(instruction.operands), stacked)
+
+    try:
+        output = check_output(source, program_input)
+    except (EncodingError, LoadError, VMError) as e:
+        print e.message
+        sys.exit()
+    print '\nOutput at -O1 and -O2:\n'
+    print output
@@ -0,0 +1,74 @@
+from bpl.code_generator.code_generator import label_scope
+from bpl.code_generator.encoder import EncodingError
+from bpl.ir.ir import Opcode, Temp, build_ir
+from bpl.ir.passes import OPERATIONS, evaluate, optimize
+from bpl.parser.parser import ParserException, Parser
+from bpl.runner import LoadError
+from bpl.scanner.scanner import ScannerException
+from bpl.test.native import check_output
+from bpl.type_checker.type_checker import TypeCheckerException, type_check
+from bpl.vm.machine import VMError
+from StringIO import StringIO
+import sys
+
+# the instructions fold_constants() computes when their operands are constants
+FOLDED = frozenset(OPERATIONS) | frozenset((Opcode.DIV, Opcode.MOD, Opcode.NEG, Opcode.BRANCH))
+
+def count_folded(function):
+    """Return how many arithmetic instructions and comparisons, and how many branches, a function has."""
+    computations = branches = 0
+    for instruction in function.instructions():
+        if instruction.opcode == Opcode.BRANCH:
+            branches += 1
+        elif instruction.opcode in FOLDED:
+            computations += 1
+    return computations, branches
+
+if __name__ == "__main__":
+    # a program with constant expressions, variables assigned once, and branches on constants
+    file_name = "bpl/test/test8.bpl"
+    if len(sys.argv) > 1:
+        file_name = sys.argv[1]
+    # numbers the program reads, if it reads any
+    program_input = ' '.join(sys.argv[2:]) + '\n'
+    try:
+        input_file = open(file_name)
+    except IOError:
+        print 'Error: File not found!'
+        sys.exit()
+    source = input_file.read()
+    input_file.close()
+    try:
+        parse_tree = Parser(StringIO(source)).parse()
+        type_check(parse_tree)
+    except (ScannerException, ParserException, TypeCheckerException) as e:
+        print e.message
+        sys.exit()
+    with label_scope():
+        unoptimized = build_ir(parse_tree)
+    with label_scope():
+        program = optimize(build_ir(parse_tree), 1)
+    print 'IR at -O1:\n'
+    print program
+
+    print 'Computations and branches, before and after -O1:\n'
+    before = dict((function.name, count_folded(function)) for function in unoptimized.functions)
+    for function in program.functions:
+        # only divisions that trap are left with constant operands
+        for instruction in function.instructions():
+            if (instruction.opcode in FOLDED and not any(isinstance(operand, Temp) for operand in instruction.operands)
+                    and (instruction.opcode == Opcode.BRANCH
+                    or evaluate(instruction.opcode, instruction.operands) is not None)):
+                print 'Error: "{}" in {} was not folded!'.format(instruction, function.name)
+                sys.exit(1)
+        computations, branches = count_folded(function)
+        print '    {}: {} computations -> {}, {} branches -> {}'.format(function.name, before[function.name][0],
+                computations, before[function.name][1], branches)
+
+    try:
+        output = check_output(source, program_input)
+    except (EncodingError, LoadError, VMError) as e:
+        print e.message
+        sys.exit()
+    print '\nOutput at -O1 and -O2:\n'
+    print output
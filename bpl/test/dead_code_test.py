@@ -0,0 +1,111 @@
+from bpl.code_generator.code_generator import label_scope
+from bpl.code_generator.encoder import EncodingError
+from bpl.compiler import CompilerSession
+from bpl.ir.ir import Opcode, SIDE_EFFECTS, build_ir
+from bpl.ir.liveness import live_temps
+from bpl.ir.passes import may_trap, optimize
+from bpl.parser.parser import ParserException, Parser
+from bpl.runner import LoadError
+from bpl.scanner.scanner import ScannerException
+from bpl.test.native import check_output
+from bpl.type_checker.type_checker import TypeCheckerException, type_check
+from bpl.vm.machine import VMError
+from StringIO import StringIO
+import sys
+
+def dead_code(function):
+    """Return the unreachable blocks of an optimized function, and the instructions whose results are never read."""
+    found = [block for block in function.blocks[1:] if not block.predecessors]
+    live_in, live_out = live_temps(function)
+    for block in function.blocks:
+        live = set(live_out[block])
+        for instruction in reversed(block.instructions):
+            destination = instruction.destination
+            if (destination is not None and destination not in live and instruction.opcode not in SIDE_EFFECTS
+                    and not may_trap(instruction)):
+                found.append(instruction)
+            live.discard(destination)
+            live.update(instruction.uses())
+    return found
+
+def reachable(program):
+    """Return the names of the functions main() calls, directly or not, and the globals and string labels they use."""
+    functions = dict((function.name, function) for function in program.functions)
+    called = set(['main'])
+    symbols = set()
+    stack = ['main']
+    while stack:
+        for instruction in functions[stack.pop()].instructions():
+            if instruction.opcode == Opcode.CALL and instruction.symbol not in called:
+                called.add(instruction.symbol)
+                stack.append(instruction.symbol)
+            elif instruction.opcode in (Opcode.GLOBAL, Opcode.STRING):
+                symbols.add(instruction.symbol)
+    return called, symbols
+
+if __name__ == "__main__":
+    # a program with unused globals, functions only dead code calls, and code whose results aren't read
+    file_name = "bpl/test/test9.bpl"
+    if len(sys.argv) > 1:
+        file_name = sys.argv[1]
+    # numbers the program reads, if it reads any
+    program_input = ' '.join(sys.argv[2:]) + '\n'
+    try:
+        input_file = open(file_name)
+    except IOError:
+        print 'Error: File not found!'
+        sys.exit()
+    source = input_file.read()
+    input_file.close()
+    try:
+        parse_tree = Parser(StringIO(source)).parse()
+        type_check(parse_tree)
+        assembly = CompilerSession(optimization_level=2).compile(source)
+    except (ScannerException, ParserException, TypeCheckerException) as e:
+        print e.message
+        sys.exit()
+    with label_scope():
+        unoptimized = build_ir(parse_tree)
+    with label_scope():
+        program = optimize(build_ir(parse_tree), 2)
+    print 'IR at -O2:\n'
+    print program
+
+    # what main() can't reach before optimizing must be gone from the assembly, and the rest defined in it
+    called, symbols = reachable(unoptimized)
+    lines = assembly.splitlines()
+    labels = set(line[:-1] for line in lines if line.endswith(':'))
+    labels.update(line.split(':')[0] for line in lines if line.startswith('.S'))
+    labels.update(line.split()[1].rstrip(',') for line in lines if line.startswith('.comm '))
+    kept = set(function.name for function in program.functions)
+    removed = []
+    for function in unoptimized.functions:
+        if function.name not in called and function.name in labels:
+            print 'Error: the function {} is never called, but is in the assembly!'.format(function.name)
+            sys.exit(1)
+        if function.name in kept and function.name not in labels:
+            print 'Error: the function {} is missing from the assembly!'.format(function.name)
+            sys.exit(1)
+        if function.name not in labels:
+            removed.append(function.name)
+    strings = dict((label, string) for string, label in unoptimized.string_table.iteritems())
+    for name in [declaration.name for declaration in unoptimized.globals] + sorted(strings):
+        if name not in symbols and name in labels:
+            print 'Error: {} is never used, but is in the assembly!'.format(strings.get(name, name))
+            sys.exit(1)
+        if name not in labels:
+            removed.append('"{}"'.format(strings[name]) if name in strings else name)
+    print 'Removed from the assembly at -O2: {}\n'.format(', '.join(removed) or 'nothing')
+
+    for function in program.functions:
+        for code in dead_code(function):
+            print 'Error: dead code was kept in {}: {}'.format(function.name, code)
+            sys.exit(1)
+
+    try:
+        output = check_output(source, program_input)
+    except (EncodingError, LoadError, VMError) as e:
+        print e.message
+        sys.exit()
+    print 'Output at -O1 and -O2:\n'
+    print output
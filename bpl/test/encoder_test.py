@@ -0,0 +1,70 @@
+from bpl.code_generator.encoder import EncodingError, ObjectWriter
+from bpl.compiler import compile
+from bpl.toolchain import build_with_encoder
+from bpl.parser.parser import ParserException
+from bpl.scanner.scanner import ScannerException
+from bpl.type_checker.type_checker import TypeCheckerException
+from StringIO import StringIO
+import os, subprocess, sys, tempfile
+
+if __name__ == "__main__":
+    file_name = "bpl/test/test3.bpl"
+    if len(sys.argv) > 1:
+        file_name = sys.argv[1]
+    try:
+        input_file = open(file_name)
+    except IOError:
+        print("Error: File not found!")
+        sys.exit()
+    try:
+        assembly = StringIO()
+        compile(input_file, assembly)
+    except (ScannerException, ParserException, TypeCheckerException) as e:
+        print e.message
+        sys.exit()
+    input_file.close()
+    assembly = assembly.getvalue()
+
+    try:
+        writer = ObjectWriter()
+        for line in assembly.splitlines(True):
+            writer.write(line)
+        object_file = writer.getvalue()
+        whole = ObjectWriter()
+        whole.write(assembly)
+    except EncodingError as e:
+        print e.message
+        sys.exit(1)
+    if whole.getvalue() != object_file:
+        print 'Error: the object file differs when the assembly code is written all at once!'
+        sys.exit(1)
+    print 'Sections:\n'
+    for name in ('.text', '.rodata'):
+        print '{}: {} bytes'.format(name, len(writer.sections[name]))
+    print '\nSymbols:\n'
+    for name in sorted(name for name in writer.labels if not name.startswith('.')):
+        print '{}: {} {}'.format(name, *writer.labels[name])
+    for name in sorted(writer.commons):
+        print '{}: common, {} bytes'.format(name, writer.commons[name][0])
+    print '\nExternal References:\n'
+    for name in sorted(set(fixup[3] for fixup in writer.fixups) - set(writer.labels) - set(writer.commons)):
+        print name
+    print '\nObject File: {} bytes'.format(len(object_file))
+
+    # build an executable with the encoder taking the code generator's output directly, as --assembler builtin does
+    descriptor, executable_path = tempfile.mkstemp()
+    os.close(descriptor)
+    try:
+        with open(file_name) as input_file:
+            status, message = build_with_encoder(lambda writer: compile(input_file, writer), executable_path)
+        if status:
+            print 'Error: linking failed!\n' + message
+            sys.exit(1)
+        program = subprocess.Popen([executable_path], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        output = program.communicate('')[0]
+    finally:
+        # a failed link may have removed the file, or never written it
+        if os.path.exists(executable_path):
+            os.remove(executable_path)
+    print '\nOutput of the program built with the encoder:\n'
+    print output
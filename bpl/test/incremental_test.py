@@ -0,0 +1,55 @@
+from bpl.cache import CompilationCache
+from bpl.compiler import compile_incremental
+from bpl.incremental import split_declarations, fingerprint
+from bpl.parser.parser import ParserException
+from bpl.parser.parsetree import NodeType
+from bpl.scanner.scanner import ScannerException
+from bpl.type_checker.type_checker import TypeCheckerException
+from StringIO import StringIO
+import shutil, sys, tempfile
+
+if __name__ == "__main__":
+    file_name = "bpl/test/test3.bpl"
+    if len(sys.argv) > 1:
+        file_name = sys.argv[1]
+    try:
+        input_file = open(file_name)
+    except IOError:
+        print("Error: File not found!")
+        sys.exit()
+    source = input_file.read()
+    input_file.close()
+    cache = CompilationCache(tempfile.mkdtemp())
+    try:
+        # the first compilation stores every unit, the second one reuses all of them
+        first = StringIO()
+        compile_incremental(StringIO(source), first, cache, file_name)
+        units = cache.load_units(file_name)
+        spans = split_declarations(source)
+        if sorted(units) != sorted(set(fingerprint(source, start, stop) for start, stop, line in spans)):
+            print 'Error: the stored units differ from the declarations in the file!'
+            sys.exit(1)
+        second = StringIO()
+        compile_incremental(StringIO(source + '\n/* edited */\n'), second, cache, file_name)
+        if first.getvalue() != second.getvalue():
+            print 'Error: the reused units produced different assembly!'
+            sys.exit(1)
+        print 'Compiled Units:\n'
+        for start, stop, line_number in spans:
+            for unit in units[fingerprint(source, start, stop)]:
+                print 'line {}: {} {}: {} bytes'.format(line_number, NodeType.names[unit.kind], unit.name, len(unit.code))
+        print '\nAssembly:\n'
+        print first.getvalue()
+        # a file with nothing but a comment is an error, as it is without --incremental
+        try:
+            compile_incremental(StringIO('/* empty */\n'), StringIO(), cache, 'empty.bpl')
+        except ParserException as e:
+            print e.message
+        else:
+            print 'Error: a file without declarations was compiled!'
+            sys.exit(1)
+    except (ScannerException, ParserException, TypeCheckerException) as e:
+        print e.message
+        sys.exit()
+    finally:
+        shutil.rmtree(cache.directory)
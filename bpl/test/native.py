@@ -0,0 +1,20 @@
+"""
+Checks shared by the optimizer tests, which run a program both natively and in the virtual machine.
+"""
+
+from bpl.runner import run
+from bpl.vm.machine import run as run_in_vm
+import sys
+
+def check_output(source, program_input, optimization_levels=(1, 2)):
+    """Return what the program 'source' prints in the virtual machine, exiting with an error if it prints anything else compiled at any of optimization_levels.
+
+    Only the output is compared, since a void main returns whatever it leaves in %rax.
+    """
+    expected = run_in_vm(source, program_input)[1]
+    for optimization_level in optimization_levels:
+        if run(source, program_input, optimization_level)[1] != expected:
+            print 'Error: the program compiled at -O{} printed something different than in the virtual machine!'.format(
+                    optimization_level)
+            sys.exit(1)
+    return expected
@@ -0,0 +1,46 @@
+from bpl.compiler import compile, compile_parallel
+from bpl.parallel import parse_parallel, check_and_generate
+from bpl.parser.parser import ParserException, Parser
+from bpl.scanner.scanner import ScannerException
+from bpl.type_checker.type_checker import TypeCheckerException
+from StringIO import StringIO
+import sys
+
+if __name__ == "__main__":
+    file_name = "bpl/test/test3.bpl"
+    if len(sys.argv) > 1:
+        file_name = sys.argv[1]
+    try:
+        input_file = open(file_name)
+    except IOError:
+        print 'Error: File not found!'
+        sys.exit()
+    source = input_file.read()
+    input_file.close()
+    try:
+        # the runs parsed by 2 jobs must hold the same declarations as the serial parse tree
+        runs = parse_parallel(source, 2)
+        if '\n'.join(str(run.to_tree()) for run in runs) != str(Parser(StringIO(source)).parse()):
+            print 'Error: the parse tree built by 2 jobs differs from the serial parse tree!'
+            sys.exit(1)
+        # the assembly must not depend on how many processes generated it, however many CPUs there are
+        serial = StringIO()
+        check_and_generate(runs, serial, 2)
+        for jobs in (3, 4):
+            parallel = StringIO()
+            check_and_generate(parse_parallel(source, jobs), parallel, jobs)
+            if parallel.getvalue() != serial.getvalue():
+                print 'Error: the assembly generated with {} jobs differs from the assembly generated with 2!'.format(jobs)
+                sys.exit(1)
+        # a single job compiles the program as compile() does
+        single = StringIO()
+        compile_parallel(StringIO(source), single, 1)
+        expected = StringIO()
+        compile(StringIO(source), expected)
+        if single.getvalue() != expected.getvalue():
+            print 'Error: the assembly generated with 1 job differs from the serial compiler\'s!'
+            sys.exit(1)
+    except (ScannerException, ParserException, TypeCheckerException) as e:
+        print e.message
+        sys.exit()
+    print serial.getvalue()
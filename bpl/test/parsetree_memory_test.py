@@ -0,0 +1,62 @@
+from bpl.parser.parser import Parser, ParserException
+from bpl.parser.parsetree import TreeNode
+from bpl.scanner.scanner import ScannerException
+from bpl.scanner.token import Token
+import sys
+
+# the largest average footprint of a parse tree node, in bytes, that we accept
+MAX_BYTES_PER_NODE = 192
+
+def fields(node):
+    """Return the names of all of the fields of 'node'."""
+    names = []
+    for cls in type(node).__mro__:
+        names.extend(getattr(cls, '__slots__', ()))
+    names.extend(getattr(node, '__dict__', ()))
+    return names
+
+def footprint(tree):
+    """Return the number of nodes in 'tree' and the bytes used by them and by the tokens they own."""
+    nodes = 0
+    size = 0
+    seen = set()
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node is None or id(node) in seen:
+            continue
+        seen.add(id(node))
+        nodes += 1
+        size += sys.getsizeof(node)
+        if hasattr(node, '__dict__'):
+            size += sys.getsizeof(node.__dict__)
+        for name in fields(node):
+            # a declaration is a link to a node elsewhere in the tree, not a child
+            value = getattr(node, name, None)
+            if isinstance(value, TreeNode) and name != 'declaration':
+                stack.append(value)
+            elif isinstance(value, Token) and id(value) not in seen:
+                seen.add(id(value))
+                size += sys.getsizeof(value)
+    return nodes, size
+
+if __name__ == "__main__":
+    file_name = "bpl/test/test3.bpl"
+    if len(sys.argv) > 1:
+        file_name = sys.argv[1]
+    try:
+        input_file = open(file_name)
+    except IOError:
+        print("Error: File not found!")
+        sys.exit()
+    try:
+        parser = Parser(input_file)
+        parse_tree = parser.parse()
+    except (ScannerException, ParserException) as e:
+        print e.message
+        sys.exit()
+    nodes, size = footprint(parse_tree)
+    print '{} nodes, {} bytes, {:.1f} bytes per node'.format(nodes, size, float(size) / nodes)
+    if float(size) / nodes > MAX_BYTES_PER_NODE:
+        print 'Error: parse tree nodes use more than {} bytes each!'.format(MAX_BYTES_PER_NODE)
+        sys.exit(1)
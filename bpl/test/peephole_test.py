@@ -0,0 +1,44 @@
+from bpl.code_generator.code_generator import generate_code, label_scope
+from bpl.code_generator.lowering import lower
+from bpl.code_generator.peephole import PATTERNS
+from bpl.ir.ir import build_ir
+from bpl.ir.passes import PIPELINES, optimize
+from bpl.parser.parser import ParserException, Parser
+from bpl.scanner.scanner import ScannerException
+from bpl.type_checker.type_checker import TypeCheckerException, type_check
+import sys
+
+if __name__ == "__main__":
+    file_name = "bpl/test/test3.bpl"
+    if len(sys.argv) > 1:
+        file_name = sys.argv[1]
+    # at level 0, the code generator's output is run through the peephole optimizer
+    optimization_level = 0
+    if len(sys.argv) > 2:
+        optimization_level = int(sys.argv[2])
+    if optimization_level not in PIPELINES:
+        print "Error: There is no optimization level {}!".format(optimization_level)
+        sys.exit()
+    try:
+        input_file = open(file_name)
+    except IOError:
+        print("Error: File not found!")
+        sys.exit()
+    try:
+        parser = Parser(input_file)
+        parse_tree = parser.parse()
+        type_check(parse_tree)
+    except (ScannerException, ParserException, TypeCheckerException) as e:
+        print e.message
+        sys.exit()
+    input_file.close()
+    hits = {}
+    with label_scope():
+        if optimization_level:
+            lower(optimize(build_ir(parse_tree), optimization_level), sys.stdout, hits)
+        else:
+            generate_code(parse_tree, sys.stdout, hits)
+    print
+    print 'Peephole hits:'
+    for pattern, opcodes in PATTERNS:
+        print '    {:<24} {}'.format(pattern.__name__, hits.get(pattern.__name__, 0))
@@ -0,0 +1,43 @@
+from bpl.code_generator.code_generator import label_scope
+from bpl.code_generator.register_allocation import allocate_registers, live_intervals
+from bpl.ir.ir import build_ir
+from bpl.ir.passes import PIPELINES, optimize
+from bpl.parser.parser import ParserException, Parser
+from bpl.scanner.scanner import ScannerException
+from bpl.type_checker.type_checker import TypeCheckerException, type_check
+import sys
+
+if __name__ == "__main__":
+    file_name = "bpl/test/test3.bpl"
+    if len(sys.argv) > 1:
+        file_name = sys.argv[1]
+    # the optimization level whose passes are run over the IR before allocating registers
+    optimization_level = 2
+    if len(sys.argv) > 2:
+        optimization_level = int(sys.argv[2])
+    if optimization_level not in PIPELINES:
+        print "Error: There is no optimization level {}!".format(optimization_level)
+        sys.exit()
+    try:
+        input_file = open(file_name)
+    except IOError:
+        print("Error: File not found!")
+        sys.exit()
+    try:
+        parser = Parser(input_file)
+        parse_tree = parser.parse()
+        type_check(parse_tree)
+    except (ScannerException, ParserException, TypeCheckerException) as e:
+        print e.message
+        sys.exit()
+    input_file.close()
+    with label_scope():
+        program = optimize(build_ir(parse_tree), optimization_level)
+    for function in program.functions:
+        print function
+        registers = allocate_registers(function)
+        print 'Live intervals of {}:'.format(function.name)
+        for interval in live_intervals(function):
+            print '    {:<12} {:>4} - {:<4} {:<6} {}'.format(interval.temp, interval.start, interval.end,
+                    registers.get(interval.temp, 'spilled'), 'spans a call' if interval.spans_call else '')
+        print
@@ -0,0 +1,35 @@
+from bpl.code_generator.encoder import EncodingError
+from bpl.parser.parser import ParserException
+from bpl.runner import LoadError, load, run
+from bpl.scanner.scanner import ScannerException
+from bpl.type_checker.type_checker import TypeCheckerException
+import sys
+
+if __name__ == "__main__":
+    file_name = "bpl/test/test3.bpl"
+    if len(sys.argv) > 1:
+        file_name = sys.argv[1]
+    # numbers the program reads, if it reads any
+    program_input = ' '.join(sys.argv[2:]) + '\n'
+    try:
+        input_file = open(file_name)
+    except IOError:
+        print("Error: File not found!")
+        sys.exit()
+    source = input_file.read()
+    input_file.close()
+    try:
+        status, output = run(source, program_input)
+    except (ScannerException, ParserException, TypeCheckerException, EncodingError, LoadError) as e:
+        print e.message
+        sys.exit()
+
+    # running the program again should reuse the loaded program, starting it afresh
+    if load(source) is not load(bytearray(source)):
+        print 'Error: the program was loaded again rather than reused!'
+        sys.exit(1)
+    if run(source, program_input) != (status, output):
+        print 'Error: the program behaved differently when it was run again!'
+        sys.exit(1)
+    print output
+    print '\nmain returned {}'.format(status)
@@ -1,17 +1,21 @@
-from bpl.scanner.scanner import Scanner
+from bpl.scanner.scanner import ScannerException
 from bpl.scanner.token import TokenType
+from bpl.scanner.token_stream import SCANNERS
 import sys
 
 if __name__ == "__main__":
     file_name = "bpl/test/test.bpl"
     if len(sys.argv) > 1:
         file_name = sys.argv[1]
+    scanner_name = "line"
+    if len(sys.argv) > 2:
+        scanner_name = sys.argv[2]
     try:
         input_file = open(file_name)
     except IOError:
         print("Error: File not found!")
         sys.exit()
-    scanner = Scanner(input_file)
+    scanner = SCANNERS[scanner_name](input_file)
     try:
         scanner.get_next_token()
         while(scanner.next_token.kind != TokenType.T_EOF):
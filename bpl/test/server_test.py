@@ -0,0 +1,65 @@
+from bpl.client import request_compilation
+from bpl.compiler import compile
+from bpl.parser.parser import ParserException
+from bpl.scanner.scanner import ScannerException
+from bpl.server import CompileServer
+from bpl.type_checker.type_checker import TypeCheckerException
+from StringIO import StringIO
+import os, shutil, sys, tempfile, threading
+
+if __name__ == "__main__":
+    file_name = "bpl/test/test3.bpl"
+    if len(sys.argv) > 1:
+        file_name = sys.argv[1]
+    try:
+        input_file = open(file_name)
+    except IOError:
+        print("Error: File not found!")
+        sys.exit()
+    source = input_file.read()
+    input_file.close()
+    try:
+        expected = StringIO()
+        compile(StringIO(source), expected)
+        expected = expected.getvalue()
+    except (ScannerException, ParserException, TypeCheckerException) as e:
+        expected = e.message
+
+    directory = tempfile.mkdtemp()
+    server = CompileServer(os.path.join(directory, 'socket'))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        # the second request is answered from the server's memory of the first
+        output_path = os.path.join(directory, 'output.s')
+        for attempt in range(2):
+            status, message = request_compilation(server.server_address, source, output_path, True)
+            if status == 0:
+                with open(output_path) as output_file:
+                    message = output_file.read()
+            if message != expected:
+                print 'Error: the compile server\'s reply differs from the compiler\'s output!'
+                sys.exit(1)
+        print message
+        # a source that isn't valid UTF-8 reaches the server unchanged
+        latin_source = 'int main(void) {\n    write("caf\xe9");\n}\n'
+        status, message = request_compilation(server.server_address, latin_source, output_path, True)
+        expected = StringIO()
+        compile(StringIO(latin_source), expected)
+        with open(output_path) as output_file:
+            if status != 0 or output_file.read() != expected.getvalue():
+                print 'Error: the compile server changed a source that isn\'t valid UTF-8!'
+                sys.exit(1)
+        print 'Compiled a source that isn\'t valid UTF-8.'
+        # statements nested too deeply for the compiler still get a reply
+        nested_source = 'int main(void) {' + 'if (1) ' * 3000 + 'write(1); }'
+        status, message = request_compilation(server.server_address, nested_source, output_path, True)
+        if status != 1 or not message.startswith('Error: RuntimeError'):
+            print 'Error: the compile server did not reply to a program it failed on!'
+            sys.exit(1)
+        print message
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+        shutil.rmtree(directory)
@@ -0,0 +1,47 @@
+from bpl.compiler import CompilerSession, compile
+from bpl.parser.parser import ParserException
+from bpl.scanner.scanner import ScannerException
+from bpl.type_checker.type_checker import TypeCheckerException
+from StringIO import StringIO
+import sys, threading
+
+THREADS = 8
+COMPILES_PER_THREAD = 20
+
+if __name__ == "__main__":
+    file_name = "bpl/test/test3.bpl"
+    if len(sys.argv) > 1:
+        file_name = sys.argv[1]
+    try:
+        input_file = open(file_name)
+    except IOError:
+        print("Error: File not found!")
+        sys.exit()
+    source = input_file.read()
+    input_file.close()
+    session = CompilerSession()
+    try:
+        expected = StringIO()
+        compile(StringIO(source), expected)
+        expected = expected.getvalue()
+        if session.compile(memoryview(source)) != expected or str(session.compile(source, bytearray())) != expected:
+            print 'Error: the session\'s assembly differs from the compiler\'s!'
+            sys.exit(1)
+    except (ScannerException, ParserException, TypeCheckerException) as e:
+        print e.message
+        sys.exit()
+
+    # compile the program from several threads at once; every result should be the same
+    results = []
+    def compile_repeatedly():
+        for i in range(COMPILES_PER_THREAD):
+            results.append(session.compile(source))
+    threads = [threading.Thread(target=compile_repeatedly) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if len(results) != THREADS * COMPILES_PER_THREAD or any(result != expected for result in results):
+        print 'Error: compiling from several threads at once changed the assembly!'
+        sys.exit(1)
+    print expected
@@ -0,0 +1,41 @@
+from bpl.parser.parser import ParserException, Parser
+from bpl.scanner.scanner import ScannerException
+from bpl.type_checker.type_checker import TypeCheckerException, type_check
+from bpl.vm.bytecode import BytecodeException, compile_bytecode, disassemble
+from bpl.vm.machine import VMError, execute
+from StringIO import StringIO
+import sys
+
+if __name__ == "__main__":
+    file_name = "bpl/test/test3.bpl"
+    if len(sys.argv) > 1:
+        file_name = sys.argv[1]
+    # numbers the program reads, if it reads any
+    program_input = ' '.join(sys.argv[2:]) + '\n'
+    try:
+        input_file = open(file_name)
+    except IOError:
+        print("Error: File not found!")
+        sys.exit()
+    try:
+        parser = Parser(input_file)
+        parse_tree = parser.parse()
+        type_check(parse_tree)
+        code_object = compile_bytecode(parse_tree)
+    except (ScannerException, ParserException, TypeCheckerException, BytecodeException) as e:
+        print e.message
+        sys.exit()
+    input_file.close()
+    print 'Bytecode:\n'
+    print disassemble(code_object)
+
+    output = StringIO()
+    try:
+        status = execute(code_object, StringIO(program_input), output)
+    except VMError as e:
+        print output.getvalue()
+        print e.message
+        sys.exit()
+    print 'Output:\n'
+    print output.getvalue()
+    print '\nmain returned {}'.format(status)
@@ -0,0 +1,183 @@
+"""
+Assembling and linking generated code without the gcc driver or an assembly file.
+
+gcc is asked once, with -###, for the assembler and linker commands it runs to build
+an executable from an assembly file. Those commands are then run directly: the
+assembly code is written into the assembler's standard input while it's being
+generated, and the object file is linked with the command line gcc would have used.
+If the commands can't be worked out, gcc is run on a temporary assembly file instead.
+The assembler can also be skipped altogether, by encoding the code in this process.
+C source code is built by the C compiler, which reads it from its standard input.
+"""
+
+import cStringIO, errno, fcntl, os, shlex, subprocess, tempfile
+from bpl.code_generator.encoder import ObjectWriter
+
+# the names gcc is asked to build, which are replaced in the commands it prints
+ASSEMBLY_PLACEHOLDER = 'bplc-placeholder.s'
+OUTPUT_PLACEHOLDER = 'bplc-placeholder'
+OBJECT = object()
+OUTPUT = object()
+
+# the code generator writes a line at a time, so the assembler's input is buffered
+PIPE_BUFFER_SIZE = 1 << 16
+
+# the (assembler, linker) commands, found the first time they're needed
+commands = None
+
+def find_commands():
+    """Return the assembler and linker commands gcc runs to build an executable from an assembly file.
+
+    The assembler command has no input file, so it reads its standard input. OBJECT
+    stands for the object file in both commands, and OUTPUT for the executable in the
+    linker's. Return None if gcc's commands aren't an assembler and a linker that can
+    be run like this.
+    """
+    try:
+        gcc = subprocess.Popen(['gcc', '-###', ASSEMBLY_PLACEHOLDER, '-o', OUTPUT_PLACEHOLDER],
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        listing = gcc.communicate()[0]
+        if gcc.returncode:
+            return None
+        lines = [shlex.split(line) for line in listing.splitlines() if line.startswith(' ')]
+        if len(lines) != 2 or os.path.basename(lines[0][0]) != 'as' or '-o' not in lines[0][:-1]:
+            return None
+        assembler, linker = lines
+        object_path = assembler[assembler.index('-o') + 1]
+        if os.path.basename(linker[0]) == 'collect2':
+            # collect2 only passes its arguments on to ld unless link-time optimization is used
+            ld = subprocess.Popen(['gcc', '-print-prog-name=ld'], stdout=subprocess.PIPE)
+            linker[0] = ld.communicate()[0].strip()
+            if ld.returncode or not linker[0]:
+                return None
+        elif os.path.basename(linker[0]) != 'ld':
+            return None
+    except (OSError, ValueError):
+        return None
+
+    assembler = [OBJECT if argument == object_path else argument
+            for argument in assembler if argument != ASSEMBLY_PLACEHOLDER]
+    command = [linker[0]]
+    arguments = iter(linker[1:])
+    for argument in arguments:
+        if argument == '-plugin':
+            next(arguments)
+        elif argument.startswith('-plugin-opt'):
+            continue
+        elif argument == object_path:
+            command.append(OBJECT)
+        elif argument == OUTPUT_PLACEHOLDER and command[-1] == '-o':
+            command.append(OUTPUT)
+        else:
+            command.append(argument)
+    if OBJECT not in command or OUTPUT not in command:
+        return None
+    return assembler, command
+
+def find_commands_once():
+    """Return find_commands(), only running gcc the first time, or () if there are no commands."""
+    global commands
+    if commands is None:
+        commands = find_commands() or ()
+    return commands
+
+def build_executable(generate, output_path, assembler='as'):
+    """Build the executable output_path from the assembly code generate(assembly_file) writes.
+
+    If 'assembler' is 'as', the assembler gcc uses is run, and if it's 'builtin', the
+    code is encoded in this process by an ObjectWriter. Return the exit status and
+    output of the assembler or linker, or of gcc if their commands couldn't be found.
+    An exception raised by generate() is raised again once the assembler has been
+    stopped.
+    """
+    if assembler == 'builtin':
+        return build_with_encoder(generate, output_path)
+    commands = find_commands_once()
+    if not commands:
+        return build_with_gcc(generate, output_path)
+
+    descriptor, object_path = tempfile.mkstemp(suffix='.o')
+    os.close(descriptor)
+    try:
+        # the assembler's output goes to a file, so it can't fill a pipe while we fill its input
+        with tempfile.TemporaryFile() as messages:
+            assembler = subprocess.Popen([object_path if argument is OBJECT else argument
+                    for argument in commands[0]], PIPE_BUFFER_SIZE, stdin=subprocess.PIPE,
+                    stdout=messages, stderr=subprocess.STDOUT)
+            # processes started later by other threads mustn't hold the assembler's input open
+            descriptor = assembler.stdin.fileno()
+            fcntl.fcntl(descriptor, fcntl.F_SETFD, fcntl.fcntl(descriptor, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+            try:
+                generate(assembler.stdin)
+            except IOError as e:
+                # the assembler stopped reading, so report its errors
+                if e.errno != errno.EPIPE:
+                    raise
+            finally:
+                try:
+                    assembler.stdin.close()
+                except IOError:
+                    pass
+                assembler.wait()
+            if assembler.returncode:
+                messages.seek(0)
+                return assembler.returncode, messages.read()
+        return link(object_path, output_path)
+    finally:
+        os.remove(object_path)
+
+def build_with_encoder(generate, output_path):
+    """Build the executable output_path by encoding the assembly code in this process and linking the object file."""
+    writer = ObjectWriter()
+    generate(writer)
+    descriptor, object_path = tempfile.mkstemp(suffix='.o')
+    try:
+        with os.fdopen(descriptor, 'wb') as object_file:
+            object_file.write(writer.getvalue())
+        return link(object_path, output_path)
+    finally:
+        os.remove(object_path)
+
+def link(object_path, output_path):
+    """Link the object file object_path into the executable output_path, returning the linker's exit status and output."""
+    commands = find_commands_once()
+    if commands:
+        command = [object_path if argument is OBJECT else output_path if argument is OUTPUT else argument
+                for argument in commands[1]]
+    else:
+        command = ['gcc', object_path, '-o', output_path]
+    linker = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    message = linker.communicate()[0]
+    return linker.returncode, message
+
+def build_with_gcc(generate, output_path):
+    """Build the executable output_path by running gcc on a temporary assembly file."""
+    descriptor, assembly_path = tempfile.mkstemp(suffix='.s')
+    try:
+        with os.fdopen(descriptor, 'w') as assembly_file:
+            generate(assembly_file)
+        gcc = subprocess.Popen(['gcc', assembly_path, '-o', output_path], stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT)
+        message = gcc.communicate()[0]
+        return gcc.returncode, message
+    finally:
+        os.remove(assembly_path)
+
+def build_with_cc(generate, output_path, optimization_level=2):
+    """Build the executable output_path from the C source code generate(c_file) writes, with the C compiler's optimizer.
+
+    The compiler is the one named by the CC environment variable, or cc, and it's run
+    with -O<optimization_level>. Return its exit status and output. The C code is
+    generated before the compiler is started, so an exception raised by generate() stops
+    the build without running it.
+    """
+    c_file = cStringIO.StringIO()
+    generate(c_file)
+    command = [os.environ.get('CC', 'cc'), '-O{}'.format(optimization_level), '-x', 'c', '-', '-o', output_path]
+    try:
+        compiler = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT)
+    except OSError as e:
+        return 1, 'Error: Unable to run {}: {}\n'.format(command[0], e.strerror)
+    message = compiler.communicate(c_file.getvalue())[0]
+    return compiler.returncode, message
@@ -8,9 +8,14 @@ from bpl.scanner.token import TokenType
 
 class TypeCheckerException(Exception):
     def __init__(self, line_number, message):
+        self.arguments = (line_number, message)
         message = 'Type Checking Error on line {}: {}'.format(line_number, message)
         Exception.__init__(self, message)
 
+    def __reduce__(self):
+        """Rebuild the exception from its original arguments, so that it can be sent between processes."""
+        return (self.__class__, self.arguments)
+
 def type_check(parse_tree, debug=False):
     symbol_table = [{}] # this is meant to function as a stack of symbol tables
     # top down pass through the parse tree
@@ -171,20 +176,23 @@ def type_check_declarations(parse_tree, debug):
     """Type check top-level declarations of the parse tree"""
     declaration = parse_tree
     while declaration is not None:
-        if declaration.kind in (NodeType.VAR_DEC, NodeType.ARRAY_DEC):
-            if declaration.type_token.kind is TokenType.T_VOID:
-                raise TypeCheckerException(declaration.line_number, 'Cannot have a variable or array of type "void".')
-            declaration = declaration.next_node
+        type_check_declaration(declaration, debug)
+        declaration = declaration.next_node
 
-        elif declaration.kind is NodeType.FUN_DEC:
-            if declaration.type_token.kind not in (TokenType.T_INT, TokenType.T_STRING, TokenType.T_VOID):
-                raise TypeCheckerException(declaration.line_number, 'Function declaration must have a type of "int", "string", or "void".')
-            # type check function body
-            type_check_statement(declaration.body, declaration.type_token.kind, debug)
-            declaration = declaration.next_node
+def type_check_declaration(declaration, debug):
+    """Type check a single top-level declaration, whose references have already been found."""
+    if declaration.kind in (NodeType.VAR_DEC, NodeType.ARRAY_DEC):
+        if declaration.type_token.kind is TokenType.T_VOID:
+            raise TypeCheckerException(declaration.line_number, 'Cannot have a variable or array of type "void".')
 
-        else:
-            raise TypeCheckerException(declaration.line_number, 'Top-level declaration is not a variable, pointer, array, or function.')
+    elif declaration.kind is NodeType.FUN_DEC:
+        if declaration.type_token.kind not in (TokenType.T_INT, TokenType.T_STRING, TokenType.T_VOID):
+            raise TypeCheckerException(declaration.line_number, 'Function declaration must have a type of "int", "string", or "void".')
+        # type check function body
+        type_check_statement(declaration.body, declaration.type_token.kind, debug)
+
+    else:
+        raise TypeCheckerException(declaration.line_number, 'Top-level declaration is not a variable, pointer, array, or function.')
 
 def type_check_statement(statement, return_type, debug):
     """Type check statements using declaration links created by find_references."""
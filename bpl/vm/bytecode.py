@@ -0,0 +1,353 @@
+"""
+Compilation of type-checked parse trees into bytecode for the BPL virtual machine.
+
+The bytecode is a flat list of integers, each instruction an opcode followed by its
+operand, if it has one, for a stack machine whose stack lives in the same list of
+memory cells as the program's global variables. A cell holds one integer, string, or
+address (the index of another cell), and stands for one 8-byte word of the native
+code. Frames are laid out as compute_offsets() lays them out, except that the stack
+grows upwards, so the offset of a cell from the frame pointer is the native offset
+divided by -8: a function's parameters are below its frame pointer, from cell -2 down,
+and its local variables are above it. String constants are numbered in a separate
+table, using the string table build_string_table() builds for the code generator.
+"""
+
+from bpl.code_generator.code_generator import build_string_table, compute_offsets, label_scope
+from bpl.code_generator.encoder import parse_string
+from bpl.parser.parsetree import NodeType
+from bpl.scanner.token import TokenType, enum
+
+# Instructions are numbered in the order the virtual machine tests for them, most
+# frequent first, and execute() relies on that order. Operands are described after the
+# colon.
+Opcode = enum('LOAD_LOCAL',     # offset: push the local variable or parameter at this offset
+        'PUSH_INT',             # number: push the integer
+        'JUMP_IF_FALSE',        # target: pop a value and jump to target if it's 0
+        'STORE_LOCAL',          # offset: pop a value and store it in the local variable at this offset
+        'STORE',                # pop a value and an address, store the value there, and push it
+        'LOCAL_ADDRESS',        # offset: push the address of the local variable or parameter at this offset
+        'POP',                  # pop a value and discard it
+        'ADD',                  # pop two integers and push their sum
+        'SUB',                  # pop two integers and push the first minus the second
+        'LESS',                 # pop two integers and push 1 if the first is less than the second, or 0
+        'LEQ',
+        'EQ',
+        'NEQ',
+        'GEQ',
+        'GREATER',
+        'JUMP',                 # target: jump to target
+        'LOAD',                 # pop an address and push the value stored there
+        'INDEX',                # size: pop an index and the address of an array with this many elements
+                                # (any number if it's 0), and push the address of that element
+        'MUL',
+        'DIV',
+        'MOD',
+        'NEG',                  # pop an integer and push its negation
+        'CALL',                 # target: call the function starting at target
+        'ENTER',                # cells: allocate this many cells of local variables, set to 0
+        'RETURN',               # parameters: pop the return value, pop the frame and this many
+                                # parameters, return to the caller, and push the value
+        'PUSH_STRING',          # index: push the string constant with this index
+        'WRITE_INT',            # pop an integer and write it
+        'WRITE_STRING',         # pop a string and write it
+        'WRITELN',              # write a newline
+        'READ',                 # read an integer and push it
+        'HALT',                 # pop main's return value and stop
+)
+# instructions that are followed by an operand
+HAS_OPERAND = frozenset((Opcode.LOAD_LOCAL, Opcode.PUSH_INT, Opcode.JUMP_IF_FALSE, Opcode.STORE_LOCAL, Opcode.LOCAL_ADDRESS,
+        Opcode.JUMP, Opcode.INDEX, Opcode.CALL, Opcode.ENTER, Opcode.RETURN, Opcode.PUSH_STRING))
+
+COMPARISONS = {
+    TokenType.T_LESS: Opcode.LESS,
+    TokenType.T_LEQ: Opcode.LEQ,
+    TokenType.T_EQ: Opcode.EQ,
+    TokenType.T_NEQ: Opcode.NEQ,
+    TokenType.T_GEQ: Opcode.GEQ,
+    TokenType.T_GREATER: Opcode.GREATER,
+}
+ARITHMETIC = {
+    TokenType.T_PLUS: Opcode.ADD,
+    TokenType.T_MINUS: Opcode.SUB,
+    TokenType.T_MULT: Opcode.MUL,
+    TokenType.T_DIV: Opcode.DIV,
+    TokenType.T_MOD: Opcode.MOD,
+}
+
+class BytecodeException(Exception):
+    def __init__(self, message):
+        Exception.__init__(self, 'Error: {}'.format(message))
+
+class CodeObject(object):
+    """The bytecode of a whole program, with everything the virtual machine needs to run it."""
+
+    def __init__(self, code, line_numbers, strings, globals_size, functions):
+        """'code' is the list of instructions, which starts by calling main and halting.
+
+        'line_numbers' holds the source line each word of 'code' was compiled from,
+        'strings' the string constants, 'globals_size' the number of cells of global
+        variables, and 'functions' the address in 'code' of each function, by name.
+        """
+        self.code = code
+        self.line_numbers = line_numbers
+        self.strings = strings
+        self.globals_size = globals_size
+        self.functions = functions
+
+def frame_cell(declaration):
+    """Return the offset from the frame pointer of the cell of a local variable or parameter, or of the first element of a local array."""
+    if declaration.kind == NodeType.ARRAY_DEC and declaration.size > 0:
+        # the elements have to go up from the first one, whose native offset is lowest
+        return -(declaration.offset + 8 * (declaration.size - 1)) // 8
+    return -declaration.offset // 8
+
+def compile_bytecode(type_checked_parse_tree):
+    """Compile a type-checked program into a CodeObject."""
+    compute_offsets(type_checked_parse_tree)
+    compiler = BytecodeCompiler()
+    with label_scope():
+        compiler.program(type_checked_parse_tree)
+    return CodeObject(compiler.code, compiler.line_numbers, compiler.strings, compiler.globals_size,
+            compiler.functions)
+
+class BytecodeCompiler(object):
+    """Builds the bytecode of one program."""
+
+    def __init__(self):
+        self.code = []
+        self.line_numbers = []
+        self.strings = []
+        self.string_indexes = {}
+        self.globals_size = 0
+        self.global_addresses = {}
+        self.functions = {}
+        # where each call's target address goes, and the name of the function it calls
+        self.calls = []
+
+    def emit(self, line_number, opcode, operand=None):
+        """Append an instruction, returning the index of its operand, if it has one."""
+        self.code.append(opcode)
+        self.line_numbers.append(line_number)
+        if operand is None:
+            return None
+        self.code.append(operand)
+        self.line_numbers.append(line_number)
+        return len(self.code) - 1
+
+    def patch(self, index):
+        """Make the jump whose target is at 'index' jump to the next instruction."""
+        self.code[index] = len(self.code)
+
+    def program(self, parse_tree):
+        """Compile every top-level declaration, after the code that calls main and halts."""
+        if 'main' not in self.find_functions(parse_tree):
+            raise BytecodeException('undefined reference to "main"')
+        self.calls.append((self.emit(0, Opcode.CALL, 0), 'main'))
+        self.emit(0, Opcode.HALT)
+
+        # number the string constants, and lay out the global variables from cell 0 on
+        declaration = parse_tree
+        while declaration is not None:
+            if declaration.kind == NodeType.FUN_DEC:
+                string_table = build_string_table(declaration.body)
+                for string in sorted(string_table):
+                    if string not in self.string_indexes:
+                        self.string_indexes[string] = len(self.strings)
+                        # like printf, stop at the first null character
+                        self.strings.append(parse_string('"{}"'.format(string)).split('\0')[0])
+            elif declaration.kind == NodeType.ARRAY_DEC:
+                self.global_addresses[declaration.name] = self.globals_size
+                self.globals_size += declaration.size
+            else:
+                self.global_addresses[declaration.name] = self.globals_size
+                self.globals_size += 1
+            declaration = declaration.next_node
+
+        declaration = parse_tree
+        while declaration is not None:
+            if declaration.kind == NodeType.FUN_DEC:
+                self.function(declaration)
+            declaration = declaration.next_node
+        for index, name in self.calls:
+            self.code[index] = self.functions[name]
+
+    def find_functions(self, parse_tree):
+        names = set()
+        declaration = parse_tree
+        while declaration is not None:
+            if declaration.kind == NodeType.FUN_DEC:
+                names.add(declaration.name)
+            declaration = declaration.next_node
+        return names
+
+    def function(self, function):
+        self.functions[function.name] = len(self.code)
+        parameters = 0
+        param = function.params
+        while param is not None:
+            parameters += 1
+            param = param.next_node
+        self.parameters = parameters
+        self.emit(function.line_number, Opcode.ENTER, function.local_var_offset // 8)
+        self.statement(function.body)
+        # a function that ends without a return statement returns 0
+        self.emit(function.line_number, Opcode.PUSH_INT, 0)
+        self.emit(function.line_number, Opcode.RETURN, parameters)
+
+    def statement(self, statement):
+        line_number = statement.line_number
+        if statement.kind == NodeType.CMPND_STATEMENT:
+            stmnt = statement.statements
+            while stmnt is not None:
+                self.statement(stmnt)
+                stmnt = stmnt.next_node
+
+        elif statement.kind == NodeType.WRITE_STATEMENT:
+            self.expression(statement.expression)
+            if statement.expression.type_string == 'int':
+                self.emit(line_number, Opcode.WRITE_INT)
+            else:
+                self.emit(line_number, Opcode.WRITE_STRING)
+
+        elif statement.kind == NodeType.WRITELN_STATEMENT:
+            self.emit(line_number, Opcode.WRITELN)
+
+        elif statement.kind == NodeType.IF_STATEMENT:
+            self.expression(statement.condition)
+            skip = self.emit(line_number, Opcode.JUMP_IF_FALSE, 0)
+            self.statement(statement.statement)
+            if statement.else_statement is not None:
+                end = self.emit(line_number, Opcode.JUMP, 0)
+                self.patch(skip)
+                self.statement(statement.else_statement)
+                self.patch(end)
+            else:
+                self.patch(skip)
+
+        elif statement.kind == NodeType.RETURN_STATEMENT:
+            if statement.expression is not None:
+                self.expression(statement.expression)
+            else:
+                self.emit(line_number, Opcode.PUSH_INT, 0)
+            self.emit(line_number, Opcode.RETURN, self.parameters)
+
+        elif statement.kind == NodeType.EXP_STATEMENT:
+            expression = statement.expression
+            # an assignment to a local variable whose value isn't used stores it without pushing it
+            if (expression.kind == NodeType.ASSIGN_EXP and expression.left.kind == NodeType.VAR_EXP
+                    and expression.left.declaration.kind == NodeType.VAR_DEC
+                    and expression.left.declaration.offset is not None):
+                self.expression(expression.right)
+                self.emit(line_number, Opcode.STORE_LOCAL, frame_cell(expression.left.declaration))
+            else:
+                self.expression(expression)
+                self.emit(line_number, Opcode.POP)
+
+        elif statement.kind == NodeType.WHILE_STATEMENT:
+            loop = len(self.code)
+            self.expression(statement.condition)
+            end = self.emit(line_number, Opcode.JUMP_IF_FALSE, 0)
+            self.statement(statement.statement)
+            self.emit(line_number, Opcode.JUMP, loop)
+            self.patch(end)
+
+    def expression(self, expression):
+        """Compile code that pushes the value of 'expression'."""
+        line_number = expression.line_number
+        if expression.kind == NodeType.NUM_EXP:
+            self.emit(line_number, Opcode.PUSH_INT, int(expression.number))
+
+        elif expression.kind == NodeType.STR_EXP:
+            self.emit(line_number, Opcode.PUSH_STRING, self.string_indexes[expression.string])
+
+        elif expression.kind == NodeType.MATH_EXP:
+            self.expression(expression.left)
+            self.expression(expression.right)
+            self.emit(line_number, ARITHMETIC[expression.token.kind])
+
+        elif expression.kind == NodeType.COMP_EXP:
+            self.expression(expression.left)
+            self.expression(expression.right)
+            self.emit(line_number, COMPARISONS[expression.token.kind])
+
+        elif expression.kind == NodeType.FUN_CALL_EXP:
+            args = []
+            arg = expression.arguments
+            while arg is not None:
+                args.append(arg)
+                arg = arg.next_node
+            # push the arguments in reverse order, so the first one is nearest the callee's frame
+            for arg in reversed(args):
+                if arg.type_string in ('int array', 'string array'):
+                    self.l_value(arg)
+                else:
+                    self.expression(arg)
+            self.calls.append((self.emit(line_number, Opcode.CALL, 0), expression.name))
+
+        elif expression.kind == NodeType.VAR_EXP:
+            if expression.declaration.offset is not None:
+                self.emit(line_number, Opcode.LOAD_LOCAL, frame_cell(expression.declaration))
+            else:
+                self.emit(line_number, Opcode.PUSH_INT, self.global_addresses[expression.name])
+                self.emit(line_number, Opcode.LOAD)
+
+        elif expression.kind in (NodeType.ARRAY_EXP, NodeType.DEREF_EXP):
+            self.l_value(expression)
+            self.emit(line_number, Opcode.LOAD)
+
+        elif expression.kind == NodeType.ASSIGN_EXP:
+            self.l_value(expression.left)
+            self.expression(expression.right)
+            self.emit(line_number, Opcode.STORE)
+
+        elif expression.kind == NodeType.NEG_EXP:
+            self.expression(expression.expression)
+            self.emit(line_number, Opcode.NEG)
+
+        elif expression.kind == NodeType.ADDRESS_EXP:
+            self.l_value(expression.expression)
+
+        elif expression.kind == NodeType.READ_EXP:
+            self.emit(line_number, Opcode.READ)
+
+    def l_value(self, expression):
+        """Compile code that pushes the address of 'expression'; for an array, that's the address of its first element."""
+        line_number = expression.line_number
+        if expression.kind in (NodeType.VAR_EXP, NodeType.ARRAY_EXP):
+            declaration = expression.declaration
+            if declaration.offset is None:
+                self.emit(line_number, Opcode.PUSH_INT, self.global_addresses[expression.name])
+            # an array parameter holds the address of the array passed to the function
+            elif declaration.kind == NodeType.ARRAY_DEC and declaration.size == -1:
+                self.emit(line_number, Opcode.LOAD_LOCAL, frame_cell(declaration))
+            else:
+                self.emit(line_number, Opcode.LOCAL_ADDRESS, frame_cell(declaration))
+            if expression.kind == NodeType.ARRAY_EXP:
+                self.expression(expression.expression)
+                self.emit(line_number, Opcode.INDEX, max(declaration.size, 0))
+
+        elif expression.kind == NodeType.DEREF_EXP:
+            self.expression(expression.expression)
+
+def disassemble(code_object):
+    """Return the instructions of 'code_object' as text, one per line, with the functions they belong to."""
+    starts = dict((address, name) for name, address in code_object.functions.items())
+    code = code_object.code
+    lines = []
+    pc = 0
+    while pc < len(code):
+        if pc in starts:
+            lines.append('{}:'.format(starts[pc]))
+        opcode = code[pc]
+        if opcode in HAS_OPERAND:
+            operand = code[pc + 1]
+            if opcode == Opcode.PUSH_STRING:
+                operand = '{} ({!r})'.format(operand, code_object.strings[operand])
+            elif opcode == Opcode.CALL:
+                operand = '{} ({})'.format(operand, starts[operand])
+            lines.append('{:6} {:14} {}'.format(pc, Opcode.names[opcode], operand))
+            pc += 2
+        else:
+            lines.append('{:6} {}'.format(pc, Opcode.names[opcode]))
+            pc += 1
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,263 @@
+"""
+A virtual machine that runs the bytecode compile_bytecode() produces.
+
+Memory is one list of cells, with the program's global variables at the bottom and
+the stack above them, so an address is just an index into the list. The list is
+extended as the stack grows.
+Integers behave as the native code's do: arithmetic wraps around at 32 bits, and
+division truncates towards zero. Local variables start out as 0 rather than as
+whatever was left on the stack. Errors the native code would crash on, or not notice,
+are raised as VMError with the line they happened on.
+"""
+
+import cStringIO, re, sys
+from bpl.compiler import source_bytes
+from bpl.parser.parser import Parser
+from bpl.scanner.scanner import Scanner
+from bpl.type_checker.type_checker import type_check
+from bpl.vm.bytecode import Opcode, compile_bytecode
+
+# the number of cells the stack may grow to, which is the native default of 8MB, and the
+# number it starts with
+STACK_SIZE = 1 << 20
+INITIAL_STACK_SIZE = 1 << 12
+# cells kept free above each frame for the values its expressions push
+STACK_RESERVE = 256
+
+INTEGER = re.compile(r'[-+]?[0-9]+')
+
+class VMError(Exception):
+    def __init__(self, line_number, message):
+        self.arguments = (line_number, message)
+        message = 'Runtime Error on line {}: {}'.format(line_number, message)
+        Exception.__init__(self, message)
+
+    def __reduce__(self):
+        return (VMError, self.arguments)
+
+def wrap(number):
+    """Return 'number' wrapped around to a signed 32-bit integer."""
+    return ((number + 0x80000000) & 0xffffffff) - 0x80000000
+
+def divide(dividend, divisor):
+    """Return the quotient and remainder of dividing two integers, truncating the quotient towards zero as C does."""
+    quotient = abs(dividend) // abs(divisor)
+    if (dividend < 0) != (divisor < 0):
+        quotient = -quotient
+    return wrap(quotient), dividend - divisor * quotient
+
+class IntegerReader(object):
+    """Reads integers from a file the way scanf("%d") does, a line at a time so it works interactively."""
+
+    def __init__(self, input_file):
+        self.input_file = input_file
+        self.line = ''
+        self.position = 0
+
+    def read(self):
+        """Return the next integer, or None if there's no integer next in the file."""
+        while True:
+            line = self.line
+            position = self.position
+            while position < len(line) and line[position].isspace():
+                position += 1
+            if position < len(line):
+                break
+            self.line = self.input_file.readline()
+            self.position = 0
+            if not self.line:
+                return None
+        match = INTEGER.match(line, position)
+        self.position = match.end() if match else position
+        return wrap(int(match.group())) if match else None
+
+def execute(code_object, input_file=None, output_file=None, stack_size=STACK_SIZE):
+    """Run the program in 'code_object', returning the value its main function returns.
+
+    The program reads from 'input_file' and writes to 'output_file', which default to
+    this process's standard input and output. Its stack may grow to 'stack_size' cells.
+    A function that doesn't return a value returns 0.
+    """
+    if input_file is None:
+        input_file = sys.stdin
+    if output_file is None:
+        output_file = sys.stdout
+    write = output_file.write
+    reader = IntegerReader(input_file)
+    code = code_object.code
+    strings = code_object.strings
+    line_numbers = code_object.line_numbers
+    memory = [0] * (code_object.globals_size + INITIAL_STACK_SIZE)
+    memory_limit = code_object.globals_size + stack_size
+    # the stack pointer is the address of the value on top of the stack
+    sp = fp = code_object.globals_size - 1
+    pc = 0
+    # bind the opcodes to local variables, which are quicker to look up than globals
+    (LOAD_LOCAL, PUSH_INT, JUMP_IF_FALSE, STORE_LOCAL, STORE, LOCAL_ADDRESS, POP, ADD, SUB, LESS, LEQ, EQ,
+            NEQ, GEQ, GREATER, JUMP, LOAD, INDEX, MUL, DIV, MOD, NEG, CALL, ENTER, RETURN, PUSH_STRING,
+            WRITE_INT, WRITE_STRING, WRITELN, READ, HALT) = range(len(Opcode.names))
+    try:
+        while True:
+            opcode = code[pc]
+            if opcode == LOAD_LOCAL:
+                sp += 1
+                memory[sp] = memory[fp + code[pc + 1]]
+                pc += 2
+            elif opcode == PUSH_INT:
+                sp += 1
+                memory[sp] = code[pc + 1]
+                pc += 2
+            elif opcode == JUMP_IF_FALSE:
+                sp -= 1
+                if memory[sp + 1] == 0:
+                    pc = code[pc + 1]
+                else:
+                    pc += 2
+            elif opcode == STORE_LOCAL:
+                memory[fp + code[pc + 1]] = memory[sp]
+                sp -= 1
+                pc += 2
+            elif opcode == STORE:
+                value = memory[sp]
+                sp -= 1
+                memory[memory[sp]] = value
+                memory[sp] = value
+                pc += 1
+            elif opcode == LOCAL_ADDRESS:
+                sp += 1
+                memory[sp] = fp + code[pc + 1]
+                pc += 2
+            elif opcode == POP:
+                sp -= 1
+                pc += 1
+            elif opcode == ADD:
+                sp -= 1
+                value = memory[sp] + memory[sp + 1]
+                if not -0x80000000 <= value <= 0x7fffffff:
+                    value = wrap(value)
+                memory[sp] = value
+                pc += 1
+            elif opcode == SUB:
+                sp -= 1
+                value = memory[sp] - memory[sp + 1]
+                if not -0x80000000 <= value <= 0x7fffffff:
+                    value = wrap(value)
+                memory[sp] = value
+                pc += 1
+            elif opcode == LESS:
+                sp -= 1
+                memory[sp] = 1 if memory[sp] < memory[sp + 1] else 0
+                pc += 1
+            elif opcode == LEQ:
+                sp -= 1
+                memory[sp] = 1 if memory[sp] <= memory[sp + 1] else 0
+                pc += 1
+            elif opcode == EQ:
+                sp -= 1
+                memory[sp] = 1 if memory[sp] == memory[sp + 1] else 0
+                pc += 1
+            elif opcode == NEQ:
+                sp -= 1
+                memory[sp] = 1 if memory[sp] != memory[sp + 1] else 0
+                pc += 1
+            elif opcode == GEQ:
+                sp -= 1
+                memory[sp] = 1 if memory[sp] >= memory[sp + 1] else 0
+                pc += 1
+            elif opcode == GREATER:
+                sp -= 1
+                memory[sp] = 1 if memory[sp] > memory[sp + 1] else 0
+                pc += 1
+            elif opcode == JUMP:
+                pc = code[pc + 1]
+            elif opcode == LOAD:
+                memory[sp] = memory[memory[sp]]
+                pc += 1
+            elif opcode == INDEX:
+                index = memory[sp]
+                sp -= 1
+                size = code[pc + 1]
+                if index < 0 or size and index >= size:
+                    raise VMError(line_numbers[pc], 'You fell off the end of an array.')
+                memory[sp] += index
+                pc += 2
+            elif opcode == MUL:
+                sp -= 1
+                value = memory[sp] * memory[sp + 1]
+                if not -0x80000000 <= value <= 0x7fffffff:
+                    value = wrap(value)
+                memory[sp] = value
+                pc += 1
+            elif opcode == DIV or opcode == MOD:
+                sp -= 1
+                if memory[sp + 1] == 0:
+                    raise VMError(line_numbers[pc], 'Division by zero.')
+                quotient, remainder = divide(memory[sp], memory[sp + 1])
+                memory[sp] = quotient if opcode == DIV else remainder
+                pc += 1
+            elif opcode == NEG:
+                memory[sp] = wrap(-memory[sp])
+                pc += 1
+            elif opcode == CALL:
+                # save the frame pointer and the return address just past the arguments
+                memory[sp + 1] = fp
+                sp += 2
+                memory[sp] = pc + 2
+                fp = sp
+                pc = code[pc + 1]
+            elif opcode == ENTER:
+                cells = code[pc + 1]
+                if sp + cells + STACK_RESERVE >= len(memory):
+                    if sp + cells + STACK_RESERVE >= memory_limit:
+                        raise VMError(line_numbers[pc], 'Stack overflow.')
+                    memory.extend([0] * min(len(memory), memory_limit - len(memory)))
+                memory[sp + 1:sp + 1 + cells] = [0] * cells
+                sp += cells
+                pc += 2
+            elif opcode == RETURN:
+                value = memory[sp]
+                sp = fp - 1 - code[pc + 1]
+                pc = memory[fp]
+                fp = memory[fp - 1]
+                memory[sp] = value
+            elif opcode == PUSH_STRING:
+                sp += 1
+                memory[sp] = strings[code[pc + 1]]
+                pc += 2
+            elif opcode == WRITE_INT:
+                write('{} '.format(memory[sp]))
+                sp -= 1
+                pc += 1
+            elif opcode == WRITE_STRING:
+                # like printf, write an uninitialized string as (null)
+                value = memory[sp]
+                write('{} '.format(value if value != 0 else '(null)'))
+                sp -= 1
+                pc += 1
+            elif opcode == WRITELN:
+                write('\n')
+                pc += 1
+            elif opcode == READ:
+                value = reader.read()
+                sp += 1
+                memory[sp] = value if value is not None else 0
+                pc += 1
+            elif opcode == HALT:
+                return memory[sp]
+    except IndexError:
+        raise VMError(line_numbers[pc], 'Invalid memory access.')
+
+def run(source, input=None, scanner_class=Scanner):
+    """Compile the BPL program 'source' to bytecode and run it, returning the value main returns and everything it printed.
+
+    'source' may be anything CompilerSession.compile() takes. If 'input' is given, the
+    program reads it from its standard input; otherwise it reads this process's
+    standard input. Compilation errors are raised as for CompilerSession.compile().
+    """
+    parse_tree = Parser(cStringIO.StringIO(source_bytes(source)), scanner_class).parse()
+    type_check(parse_tree)
+    code_object = compile_bytecode(parse_tree)
+    output = cStringIO.StringIO()
+    input_file = cStringIO.StringIO(input) if input is not None else None
+    status = execute(code_object, input_file, output)
+    return status, output.getvalue()
@@ -7,7 +7,7 @@ setup(name='bpl',
       author_email='oshoham@oberlin.edu',
       url='https://github.com/oshoham/bpl-compyler',
       license='GPL',
-      packages=['bpl', 'bpl.scanner', 'bpl.parser', 'bpl.type_checker', 'bpl.code_generator', 'bpl.test'],
+      packages=['bpl', 'bpl.scanner', 'bpl.parser', 'bpl.type_checker', 'bpl.code_generator', 'bpl.ir', 'bpl.vm', 'bpl.test'],
       package_data={'bpl.test': ['test3.bpl']},
       scripts=['bplc']
 )